@@ -0,0 +1,71 @@
+'''
+Microbenchmark of the secondary 1x1 group convolution of the imagenet igc networks on cpu:
+Convolution with num_group against the batched GroupPointwise operator.
+The shapes are collected from the graph network/resnet_igc_imgnet_d18.py builds at 224x224 for the
+configurations of the README table, one per stage g1..g4.
+Usage: python benchmark/group_pointwise.py --batch-size=32 --config=L4M32,L16M16,L100M2
+'''
+import mxnet as mx
+import numpy as np
+import argparse
+import logging
+import re
+import sys
+from reorder import timeit
+sys.path.insert(0, '.')
+import utility
+
+def get_shapes(config, batch_size):
+    """(input shape, num_group) of the secondary convolution of every stage of resnet_igc_imgnet_d18, e.g., config=L4M32"""
+    primary, secondary = [int(v) for v in re.match(r'L(\d+)M(\d+)$', config).groups()]
+    symbol, _, _ = utility.load_network('resnet_igc_imgnet_d18', (1000, 18, primary, secondary), {}, (1, 3, 224, 224))
+    internals = symbol.get_internals()
+    _, shapes, _ = internals.infer_shape(data=(batch_size, 3, 224, 224))
+    shapes = dict(zip(internals.list_outputs(), shapes))
+    attrs = symbol.attr_dict()
+    configs = []
+    for name in internals.list_outputs():
+        if name.endswith('_conv2_output') and '_igc' in name:
+            layer = name[:-len('_output')]
+            config = (shapes[layer[:-1]+'1_output'], int(attrs[layer]['num_group'])) #the input of conv2 is the output of conv1
+            if config not in configs: #the blocks of a stage share it
+                configs.append(config)
+    return configs
+
+def get_conv(data, channels, num_group):
+    return mx.symbol.Convolution(name='conv2', data=data, num_filter=channels, kernel=(1,1), stride=(1,1), pad=(0,0), no_bias=True, num_group=num_group)
+
+def get_batched(data, channels, num_group):
+    return mx.symbol.GroupPointwise(name='conv2', data=data, num_filter=channels, num_group=num_group, no_bias=True)
+
+def bind(builder, shape, num_group, ctx):
+    symbol = builder(mx.symbol.Variable(name='data'), shape[1], num_group)
+    exe = symbol.simple_bind(ctx=ctx, grad_req='write', data=shape)
+    for name, arr in exe.arg_dict.items():
+        arr[:] = mx.random.uniform(-1, 1, arr.shape, ctx=ctx)
+    return exe
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark GroupPointwise against Convolution with num_group')
+    parser.add_argument('--batch-size', type=int, default=32, help='the batch size')
+    parser.add_argument('--config', type=str, default='L4M32,L16M16,L100M2', help='igc configurations to test, e.g., --config=L4M32,L100M2')
+    parser.add_argument('--repeat', type=int, default=10, help='the number of timed iterations')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    ctx = mx.cpu()
+    for config in args.config.split(','):
+        for stage, (shape, num_group) in enumerate(get_shapes(config, args.batch_size)):
+            conv = bind(get_conv, shape, num_group, ctx)
+            batched = bind(get_batched, shape, num_group, ctx)
+            batched.copy_params_from(conv.arg_dict)
+            conv.forward(is_train=False)
+            batched.forward(is_train=False)
+            assert np.allclose(conv.outputs[0].asnumpy(), batched.outputs[0].asnumpy(), rtol=1e-4, atol=1e-4)
+            new_fwd, new_bwd = timeit(batched, args.repeat)
+            old_fwd, old_bwd = timeit(conv, args.repeat)
+            logging.info('%s g%d %s, %d groups\tforward: %.2fms (Convolution %.2fms, x%.2f)\tbackward: %.2fms (Convolution %.2fms, x%.2f)',
+                         config, stage+1, shape, num_group, new_fwd*1e3, old_fwd*1e3, old_fwd/new_fwd, new_bwd*1e3, old_bwd*1e3, old_bwd/new_bwd)
+
+if __name__ == '__main__':
+    main()
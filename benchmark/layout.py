@@ -0,0 +1,58 @@
+'''
+Training throughput of the networks built with NCHW and NHWC feature maps.
+Both graphs get the same weights (converted by tools/convert_layout.py) and must agree.
+MXNet runs NHWC convolutions with cuDNN only, so use --gpus unless the build has NHWC cpu kernels.
+Usage: python benchmark/layout.py --network=resnet_igc,plain_igc --depth=20 --primary-partition=4 --secondary-partition=8 --gpus=0
+'''
+import mxnet as mx
+import numpy as np
+import argparse
+import importlib
+import logging
+import sys
+sys.path.insert(0, 'network')
+sys.path.insert(0, 'tools')
+from reorder import timeit
+from convert_layout import convert_params
+
+def bind(args, network, layout, ctx):
+    symbol = importlib.import_module(network).get_symbol(args.num_classes, args.depth, args.primary_partition, args.secondary_partition, layout=layout)
+    shape = (args.batch_size, 3, args.data_shape, args.data_shape)
+    exe = symbol.simple_bind(ctx=ctx, grad_req='write', data=shape)
+    exe.arg_dict['data'][:] = mx.random.uniform(-1, 1, shape, ctx=ctx)
+    return exe
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark NCHW against NHWC networks')
+    parser.add_argument('--network', type=str, default='resnet_igc', help='networks to test, e.g., --network=resnet,resnet_igc')
+    parser.add_argument('--depth', type=int, default=20, help='the network depth')
+    parser.add_argument('--primary-partition', type=int, default=4, help='primary partition number')
+    parser.add_argument('--secondary-partition', type=int, default=8, help='secondary partition number')
+    parser.add_argument('--num-classes', type=int, default=10, help='the number of classes')
+    parser.add_argument('--data-shape', type=int, default=32, help='the image size')
+    parser.add_argument('--batch-size', type=int, default=64, help='the batch size')
+    parser.add_argument('--gpus', type=str, help='the gpu to use, cpu if not given')
+    parser.add_argument('--repeat', type=int, default=10, help='the number of timed iterations')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    ctx = mx.cpu() if args.gpus is None else mx.gpu(int(args.gpus.split(',')[0]))
+    for network in args.network.split(','):
+        nchw = bind(args, network, 'NCHW', ctx)
+        nhwc = bind(args, network, 'NHWC', ctx)
+        params = {k: v.asnumpy() for k, v in nchw.arg_dict.items() if k != 'data'}
+        convert_params(params, 'NHWC')
+        nhwc.copy_params_from({k: mx.nd.array(v) for k, v in params.items()}, nchw.aux_dict)
+        nhwc.arg_dict['data'][:] = nchw.arg_dict['data']
+        nchw.forward(is_train=False)
+        nhwc.forward(is_train=False)
+        diff = np.abs(nchw.outputs[0].asnumpy() - nhwc.outputs[0].asnumpy()).max()
+        speed = []
+        for exe in [nchw, nhwc]:
+            fwd, bwd = timeit(exe, args.repeat)
+            speed.append(args.batch_size / (fwd + bwd))
+        logging.info('%s\tNCHW: %.1f images/sec\tNHWC: %.1f images/sec (x%.2f)\tmax abs difference: %g',
+                     network, speed[0], speed[1], speed[1] / speed[0], diff)
+
+if __name__ == '__main__':
+    main()
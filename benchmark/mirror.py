@@ -0,0 +1,48 @@
+'''
+Memory and time of the mirror (recompute) policies of an igc network.
+For every policy, i.e. the set of stages whose blocks recompute their inner activations in backward,
+it reports the memory planned by the executor and the forward and backward time of one batch.
+Keep MXNET_BACKWARD_DO_MIRROR unset: it mirrors the cheap layers of every stage on top of the policy.
+Usage: python benchmark/mirror.py --network=resnet_igc --depth=110 --primary-partition=4 --secondary-partition=8 --policies=none,1,1+2,1+2+3
+'''
+import mxnet as mx
+import argparse
+import importlib
+import logging
+import sys
+sys.path.insert(0, '.')
+sys.path.insert(0, 'network')
+from reorder import timeit
+from utility import memory
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark the mirror policies of an igc network')
+    parser.add_argument('--network', type=str, default='resnet_igc', help='plain_igc, resnet_igc or resnet_igc_imgnet_d18')
+    parser.add_argument('--depth', type=int, default=110, help='the network depth')
+    parser.add_argument('--primary-partition', type=int, default=4, help='primary partition number')
+    parser.add_argument('--secondary-partition', type=int, default=8, help='secondary partition number')
+    parser.add_argument('--num-classes', type=int, default=10, help='the number of classes')
+    parser.add_argument('--data-shape', type=int, default=32, help='the image size')
+    parser.add_argument('--batch-size', type=int, default=64, help='the batch size')
+    parser.add_argument('--gpus', type=str, help='the gpu to use, cpu if not given')
+    parser.add_argument('--policies', type=str, default='none,1,2,3,1+2+3', help='the sets of mirrored stages, joined by +')
+    parser.add_argument('--repeat', type=int, default=5, help='the number of timed iterations')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    ctx = mx.cpu() if args.gpus is None else mx.gpu(int(args.gpus.split(',')[0]))
+    network = importlib.import_module(args.network)
+    shape = (args.batch_size, 3, args.data_shape, args.data_shape)
+    logging.info('policy\tmemory (MB)\tforward (ms)\tbackward (ms)')
+    for policy in args.policies.split(','):
+        mirror = () if policy == 'none' else tuple(int(stage) for stage in policy.split('+'))
+        symbol = network.get_symbol(args.num_classes, args.depth, args.primary_partition, args.secondary_partition, mirror=mirror)
+        exe = symbol.simple_bind(ctx=ctx, grad_req='write', data=shape)
+        for arr in exe.arg_arrays:
+            arr[:] = mx.random.uniform(-1, 1, arr.shape, ctx=ctx)
+        fwd, bwd = timeit(exe, args.repeat)
+        logging.info('%s\t%s\t%.1f\t%.1f', policy, memory(exe), fwd*1e3, bwd*1e3)
+        del exe
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+'''
+Search of the (primary, secondary) partitions of an igc network under a latency budget.
+The igc builders take a base width of primary_partition*secondary_partition channels, so for every
+--width every factorisation (L, M) is built with get_symbol, counted with tools/analyze.py (parameters
+and multiply-adds) and timed: the median forward latency at --batch-size on the local cpu.
+Latencies are cached in --cache, keyed by the network source, its arguments, the cpu, the number
+of threads and the libmxnet build (path and mtime), so later searches only time the new configurations.
+
+The configurations on the Pareto front are those no other one beats on all of latency (lower),
+parameters and multiply-adds (higher, the capacity of the network); they are marked with *.
+With --max-latency, the configuration with the most parameters within the budget is reported.
+Usage: python benchmark/partitions.py --network=resnet_igc --depth=20 --width=32,64 --max-latency=5
+'''
+import mxnet as mx
+import numpy as np
+import argparse
+import hashlib
+import json
+import logging
+import os
+import platform
+import sys
+import time
+sys.path.insert(0, '.')
+sys.path.insert(0, 'tools')
+import utility
+from analyze import analyze_symbol
+
+def partitions(width, min_partition=1):
+    """(L, M) with L*M == width"""
+    return [(l, width//l) for l in range(min_partition, width//min_partition+1) if width % l == 0]
+
+def host():
+    """The cpu model and the number of threads, part of the cache key"""
+    name = platform.processor()
+    if os.path.isfile('/proc/cpuinfo'):
+        with open('/proc/cpuinfo') as f:
+            models = [line.split(':', 1)[1].strip() for line in f if line.startswith('model name')]
+        name = models[0] if models else name
+    return '%s/%s threads'%(name, os.environ.get('OMP_NUM_THREADS', 'all'))
+
+def library():
+    """The libmxnet build, part of the cache key"""
+    path = os.path.realpath(mx.libinfo.find_lib_path()[0])
+    return '%s@%d'%(path, os.path.getmtime(path))
+
+def latency(symbol, shape, repeat, warmup=3):
+    """Median forward time in seconds of an inference executor"""
+    exe = symbol.simple_bind(ctx=mx.cpu(), grad_req='null', data=shape)
+    for arr in exe.arg_arrays:
+        arr[:] = mx.random.uniform(-1, 1, arr.shape)
+    for name, arr in zip(symbol.list_auxiliary_states(), exe.aux_arrays): #a valid batch norm, no NaNs
+        arr[:] = 1 if name.endswith('moving_var') else 0
+    times = []
+    for i in range(warmup+repeat):
+        tic = time.time()
+        exe.forward(is_train=False)
+        exe.outputs[0].wait_to_read()
+        if i >= warmup:
+            times.append(time.time()-tic)
+    return float(np.median(times))
+
+def pareto(records):
+    """Records no other record dominates: lower or equal latency, at least as many params and MACs"""
+    def dominates(a, b):
+        better = (a['latency_ms'] <= b['latency_ms'], a['params'] >= b['params'], a['macs'] >= b['macs'])
+        strictly = (a['latency_ms'] < b['latency_ms'], a['params'] > b['params'], a['macs'] > b['macs'])
+        return all(better) and any(strictly)
+    return [r for r in records if not any(dominates(o, r) for o in records)]
+
+def load_cache(filename):
+    if filename and os.path.isfile(filename):
+        with open(filename) as f:
+            return json.load(f)
+    return {}
+
+def save_cache(filename, cache):
+    if not filename:
+        return
+    utility.mkdir(os.path.dirname(filename) or '.')
+    tmp = '%s.%d.tmp'%(filename, os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump(cache, f, indent=2, sort_keys=True)
+    os.rename(tmp, filename)
+
+def search(args):
+    with open(os.path.join('network', args.network+'.py')) as f:
+        source = f.read()
+    with open(os.path.join('network', 'common.py')) as f: #the helpers of all builders
+        source = hashlib.sha1(source+f.read()).hexdigest()
+    kwargs = {'impl': args.igc_impl} if args.igc_impl != 'default' else {}
+    if args.layout != 'NCHW':
+        kwargs['layout'] = args.layout
+    shape = (args.batch_size, 3, args.data_shape, args.data_shape)
+    cache = load_cache(args.cache)
+    machine = host()
+    build = library()
+    records = []
+    for width in [int(w) for w in args.width.split(',')]:
+        for primary, secondary in partitions(width, args.min_partition):
+            build_args = (args.num_classes, args.depth, primary, secondary)
+            try:
+                symbol, _, _ = utility.load_network(args.network, build_args, kwargs, (1,)+shape[1:], args.network_cache or None)
+            except Exception as e: #e.g., an invalid depth, or channels the groups of a stage do not divide
+                logging.info('L%dM%d: invalid, %s', primary, secondary, e)
+                continue
+            _, totals = analyze_symbol(symbol, shape)
+            key = json.dumps([source, args.network, list(build_args), sorted(kwargs.items()), list(shape), machine, mx.__version__, build])
+            if key not in cache:
+                cache[key] = latency(symbol, shape, args.repeat)*1e3
+                save_cache(args.cache, cache)
+            records.append({'width': width, 'primary_partition': primary, 'secondary_partition': secondary,
+                            'params': totals['params'], 'macs': totals['macs'], 'latency_ms': cache[key]})
+    return records
+
+def main():
+    parser = argparse.ArgumentParser(description='search the igc partitions by parameters, multiply-adds and cpu latency')
+    parser.add_argument('--network', type=str, default='resnet_igc', help='the igc network, plain_igc, resnet_igc or resnet_igc_imgnet_d18')
+    parser.add_argument('--depth', type=int, default=20, help='the network depth')
+    parser.add_argument('--width', type=str, default='64', help='base widths L*M to factorise, e.g., --width=32,64')
+    parser.add_argument('--min-partition', type=int, default=1, help='the smallest L and M, 2 leaves out the plain convolutions')
+    parser.add_argument('--num-classes', type=int, default=10, help='the number of classes')
+    parser.add_argument('--data-shape', type=int, default=32, help='the image size')
+    parser.add_argument('--batch-size', type=int, default=1, help='the batch size of the timed forward pass')
+    parser.add_argument('--igc-impl', type=str, default='default', choices=['default', 'batched', 'fused'], help='igc block implementation, see train_model.py')
+    parser.add_argument('--layout', type=str, default='NCHW', choices=['NCHW', 'NHWC'], help='the feature map layout')
+    parser.add_argument('--repeat', type=int, default=20, help='the number of timed forward passes')
+    parser.add_argument('--max-latency', type=float, help='the latency budget in ms')
+    parser.add_argument('--cache', type=str, default='cache/partitions.json', help='the latency cache, empty to disable')
+    parser.add_argument('--network-cache', type=str, default='cache/network/', help='the symbol cache of utility.load_network, empty to disable')
+    parser.add_argument('--output', type=str, help='json file receiving all configurations and the front')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    records = search(args)
+    front = pareto(records)
+    logging.info('%s depth %d, batch %d at %dx%d on %s', args.network, args.depth, args.batch_size, args.data_shape, args.data_shape, host())
+    logging.info('  width\tL\tM\tparams (M)\tMACs (M)\tlatency (ms)')
+    for r in sorted(records, key=lambda r: r['latency_ms']):
+        logging.info('%s %d\t%d\t%d\t%.4f\t%.1f\t%.2f', '*' if r in front else ' ', r['width'], r['primary_partition'],
+                     r['secondary_partition'], r['params']/1e6, r['macs']/1e6, r['latency_ms'])
+    best = None
+    if args.max_latency is not None:
+        within = [r for r in records if r['latency_ms'] <= args.max_latency]
+        if within:
+            best = max(within, key=lambda r: (r['params'], r['macs'], -r['latency_ms']))
+            logging.info('within %.2fms: width %d L%dM%d, %.4fM params, %.2fms', args.max_latency, best['width'],
+                         best['primary_partition'], best['secondary_partition'], best['params']/1e6, best['latency_ms'])
+        else:
+            logging.warning('no configuration within %.2fms', args.max_latency)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'args': vars(args), 'host': host(), 'records': records, 'front': front, 'best': best}, f, indent=2)
+
+if __name__ == '__main__':
+    main()
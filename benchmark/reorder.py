@@ -0,0 +1,77 @@
+'''
+Microbenchmark of the Reorder operator on cpu.
+The legacy path reproduces the former kernel, which moved every activation
+through two temporary buffers (three swapaxis copies) before writing out.
+Usage: python benchmark/reorder.py --batch-size=64 --channels=128 --size=56 --branch-factor=4
+'''
+import mxnet as mx
+import numpy as np
+import argparse
+import logging
+import time
+
+def get_reorder(data, shape, branch_factor):
+    return mx.symbol.Reorder(name='reorder', data=data, branch_factor=branch_factor)
+
+def get_legacy(data, shape, branch_factor):
+    #(N,C,H,W)->(C,N,H,W)->(L,C/L,NHW)->(C/L,L,NHW)->(C,N,H,W)->(N,C,H,W)
+    num, channels, height, width = shape
+    data = mx.symbol.SwapAxis(name='legacy_swap1', data=data, dim1=0, dim2=1)
+    data = mx.symbol.Reshape(data=data, shape=(branch_factor, channels//branch_factor, num*height*width))
+    data = mx.symbol.SwapAxis(name='legacy_swap2', data=data, dim1=0, dim2=1)
+    data = mx.symbol.Reshape(data=data, shape=(channels, num, height, width))
+    data = mx.symbol.SwapAxis(name='legacy_swap3', data=data, dim1=0, dim2=1)
+    return data
+
+def bind(builder, shape, branch_factor, ctx):
+    symbol = builder(mx.symbol.Variable(name='data'), shape, branch_factor)
+    exe = symbol.simple_bind(ctx=ctx, grad_req='write', data=shape)
+    exe.arg_dict['data'][:] = mx.random.uniform(-1, 1, shape, ctx=ctx)
+    return exe
+
+def timeit(exe, repeat, warmup=3):
+    """Average forward and backward time in seconds"""
+    head_grad = mx.nd.ones(exe.outputs[0].shape, ctx=exe.outputs[0].context)
+    for _ in range(warmup):
+        exe.forward(is_train=True)
+        exe.backward([head_grad])
+    mx.nd.waitall()
+    tic = time.time()
+    for _ in range(repeat):
+        exe.forward(is_train=True)
+    mx.nd.waitall()
+    forward = (time.time() - tic) / repeat
+    tic = time.time()
+    for _ in range(repeat):
+        exe.backward([head_grad])
+    mx.nd.waitall()
+    backward = (time.time() - tic) / repeat
+    return forward, backward
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark the Reorder operator against the legacy swapaxis path')
+    parser.add_argument('--batch-size', type=int, default=64, help='the batch size')
+    parser.add_argument('--channels', type=int, default=128, help='the channel number')
+    parser.add_argument('--size', type=int, default=56, help='the spatial size (height=width)')
+    parser.add_argument('--branch-factor', type=str, default='4,32', help='branch factors to test, e.g., --branch-factor=4,32')
+    parser.add_argument('--repeat', type=int, default=20, help='the number of timed iterations')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    ctx = mx.cpu()
+    shape = (args.batch_size, args.channels, args.size, args.size)
+    logging.info('data shape %s, %.1f MB', shape, np.prod(shape) * 4 / 1048576.0)
+    for branch_factor in [int(v) for v in args.branch_factor.split(',')]:
+        reorder = bind(get_reorder, shape, branch_factor, ctx)
+        legacy = bind(get_legacy, shape, branch_factor, ctx)
+        legacy.arg_dict['data'][:] = reorder.arg_dict['data']
+        reorder.forward(is_train=False)
+        legacy.forward(is_train=False)
+        assert np.array_equal(reorder.outputs[0].asnumpy(), legacy.outputs[0].asnumpy())
+        new_fwd, new_bwd = timeit(reorder, args.repeat)
+        old_fwd, old_bwd = timeit(legacy, args.repeat)
+        logging.info('branch_factor=%d\tforward: %.2fms (legacy %.2fms, x%.2f)\tbackward: %.2fms (legacy %.2fms, x%.2f)',
+                     branch_factor, new_fwd*1e3, old_fwd*1e3, old_fwd/new_fwd, new_bwd*1e3, old_bwd*1e3, old_bwd/new_bwd)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+'''
+Training throughput against the number of worker processes on one machine.
+For every --workers count it starts a dist_sync (or --kv-store) job with tools/launch.py, whose workers
+train the network with engine.Trainer on synthetic data and write their images/sec; the throughput
+of the job is their sum. The cores of the machine are split between the workers.
+Usage: python benchmark/scaling.py --network=resnet_igc --depth=20 --workers=1,2,4 [--gc-type=2bit]
+'''
+import mxnet as mx
+import numpy as np
+import argparse
+import importlib
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import tempfile
+sys.path.insert(0, '.')
+sys.path.insert(0, 'network')
+sys.path.insert(0, 'tools')
+import engine
+import utility #registers the Nesterov optimizer
+from launch import launch, wait
+from trainer import Clock
+
+def worker(args):
+    """One worker of the job, writes its images/sec to <output>.<rank>"""
+    kv = mx.kvstore.create(args.kv_store)
+    if args.gc_type != 'none':
+        kv.set_gradient_compression({'type': args.gc_type, 'threshold': args.gc_threshold})
+    num = args.batch_size * (args.batches + args.warmup)
+    data = np.random.uniform(-1, 1, (num, 3, args.data_shape, args.data_shape)).astype(np.float32)
+    label = np.random.randint(0, args.num_classes, (num,)).astype(np.float32)
+    symbol = importlib.import_module(args.network).get_symbol(args.num_classes, args.depth, args.primary_partition, args.secondary_partition)
+    train = mx.io.NDArrayIter(data, label, args.batch_size, label_name='softmax_label')
+    clock = Clock(args.batch_size, args.warmup)
+    trainer = engine.Trainer(symbol, mx.cpu(), kvstore=kv, optimizer='Nesterov',
+                             optimizer_params={'learning_rate': 0.1, 'momentum': 0.9, 'wd': 0.0001})
+    trainer.fit(train, eval_metric='acc', num_epoch=1, batch_end_callback=clock)
+    with open('%s.%d'%(args.output, kv.rank), 'w') as f:
+        json.dump({'rank': kv.rank, 'speed': clock.speed()}, f)
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark the throughput of distributed training on one machine')
+    parser.add_argument('--network', type=str, default='resnet_igc', help='the network to train')
+    parser.add_argument('--depth', type=int, default=20, help='the network depth')
+    parser.add_argument('--primary-partition', type=int, default=4, help='primary partition number')
+    parser.add_argument('--secondary-partition', type=int, default=8, help='secondary partition number')
+    parser.add_argument('--num-classes', type=int, default=10, help='the number of classes')
+    parser.add_argument('--data-shape', type=int, default=32, help='the image size')
+    parser.add_argument('--batch-size', type=int, default=64, help='the batch size of each worker')
+    parser.add_argument('--workers', type=str, default='1,2,4', help='the numbers of workers to test')
+    parser.add_argument('--servers', type=int, default=1, help='the number of parameter servers')
+    parser.add_argument('--kv-store', type=str, default='dist_sync', help='the kvstore type')
+    parser.add_argument('--gc-type', type=str, default='none', choices=['none', '2bit'], help='gradient compression')
+    parser.add_argument('--gc-threshold', type=float, default=0.5, help='the threshold of 2bit gradient compression')
+    parser.add_argument('--batches', type=int, default=20, help='the number of timed batches')
+    parser.add_argument('--warmup', type=int, default=3, help='the number of untimed batches')
+    parser.add_argument('--worker', action='store_true', help='internal usage, run as a worker of the job')
+    parser.add_argument('--output', type=str, help='internal usage, result file prefix of the workers')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    if args.worker:
+        worker(args)
+        return
+
+    cores = multiprocessing.cpu_count()
+    base = None
+    logging.info('workers\timages/sec\tspeedup\tper worker')
+    for num_workers in [int(n) for n in args.workers.split(',')]:
+        output = os.path.join(tempfile.mkdtemp(), 'speed')
+        command = [sys.executable]+sys.argv+['--worker', '--output', output]
+        status = wait(*launch(command, num_workers, args.servers, cores_per_worker=max(1, cores//num_workers)))
+        if status != 0:
+            logging.error('%d workers: the job failed with status %d', num_workers, status)
+            continue
+        speeds = []
+        for rank in range(num_workers):
+            with open('%s.%d'%(output, rank)) as f:
+                speeds.append(json.load(f)['speed'])
+        total = sum(speeds)
+        base = base or total/num_workers
+        logging.info('%d\t%.1f\tx%.2f\t%s', num_workers, total, total/base, ' '.join('%.1f'%s for s in speeds))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+'''
+Benchmark suite of the Reorder operator and single igc blocks on cpu.
+The sweep follows the builders of plain_igc, resnet_igc and resnet_igc_imgnet_d18: for every
+(L, M) partition, every stage (channel number and spatial size) and every batch size it times
+forward and backward, and records the memory planned by the executor.
+Results are written as json; with --baseline, cases slower than the baseline by more than
+--tolerance are reported and the script exits with status 1.
+
+Usage: python benchmark/suite.py --output=result.json [--baseline=baseline.json]
+       python benchmark/suite.py --network=resnet_igc_imgnet_d18 --partitions=4x16,100x1 --batch-size=32
+'''
+import mxnet as mx
+import argparse
+import importlib
+import json
+import logging
+import sys
+import time
+sys.path.insert(0, '.')
+sys.path.insert(0, 'network')
+from reorder import timeit
+from utility import memory
+
+#default (primary, secondary) partitions passed to get_symbol, and the spatial size of each stage
+NETWORKS = {
+    'plain_igc': ('4x8,8x4,24x2', [32, 16, 8]),
+    'resnet_igc': ('4x8,8x4,24x2', [32, 16, 8]),
+    'resnet_igc_imgnet_d18': ('4x16,16x8,100x1', [56, 28, 14, 7]),
+}
+
+def get_blocks(network, primary, secondary, impl):
+    """(stage, channels, spatial size, first Reorder branch factor, block builder) of every stage of `network`"""
+    module = importlib.import_module(network)
+    sizes = NETWORKS[network][1]
+    blocks = []
+    for stage, size in enumerate(sizes):
+        scale = 2**stage
+        if network == 'plain_igc':
+            channels, factor = primary*secondary*scale, primary
+            build = lambda data, c=channels, s=secondary*scale: module.get_igc(
+                'block', data, kin=c, kout=c, primary_partition=primary, secondary_partition=s, impl=impl)
+        elif network == 'resnet_igc':
+            channels, factor = primary*secondary*scale, primary
+            build = lambda data, c=channels: module.get_igc(
+                'block', data, c, kernel=(3, 3), stride=(1, 1), pad=(1, 1), primary_partition=primary, secondary_partition=c/primary, impl=impl)
+        else:
+            channels, factor = primary*secondary*2*scale, primary*scale
+            build = lambda data, c=channels, p=factor: module.get_igc(
+                'block', data, kout=c, kernel=(3, 3), stride=(1, 1), pad=(1, 1), primary_partition=p, impl=impl)
+        blocks.append((stage+1, channels, size, factor, build))
+    return blocks
+
+def run(symbol, shape, repeat):
+    exe = symbol.simple_bind(ctx=mx.cpu(), grad_req='write', data=shape)
+    for arr in exe.arg_arrays:
+        arr[:] = mx.random.uniform(-1, 1, arr.shape)
+    fwd, bwd = timeit(exe, repeat)
+    return {'forward_ms': fwd*1e3, 'backward_ms': bwd*1e3, 'memory_mb': memory(exe)}
+
+def sweep(args):
+    results = []
+    for network in args.network.split(','):
+        partitions = args.partitions or NETWORKS[network][0]
+        for partition in partitions.split(','):
+            primary, secondary = [int(v) for v in partition.split('x')]
+            for stage, channels, size, factor, build in get_blocks(network, primary, secondary, args.igc_impl):
+                for batch_size in [int(v) for v in args.batch_size.split(',')]:
+                    shape = (batch_size, channels, size, size)
+                    data = mx.symbol.Variable('data')
+                    cases = [('reorder', mx.symbol.Reorder(name='reorder', data=data, branch_factor=factor)),
+                             ('igc_'+args.igc_impl, build(data))]
+                    for kind, symbol in cases:
+                        record = {'case': '%s/%s/L%dM%d/g%d/b%d'%(kind, network, primary, secondary, stage, batch_size),
+                                  'kind': kind, 'network': network, 'primary_partition': primary,
+                                  'secondary_partition': secondary, 'stage': stage, 'shape': list(shape)}
+                        record.update(run(symbol, shape, args.repeat))
+                        logging.info('%-48s forward %8.2fms  backward %8.2fms  memory %sMB', record['case'],
+                                     record['forward_ms'], record['backward_ms'], record['memory_mb'])
+                        results.append(record)
+    return results
+
+def compare(results, baseline, tolerance):
+    """Cases slower than the baseline by more than `tolerance`"""
+    reference = {r['case']: r for r in baseline['results']}
+    regressions = []
+    for record in results:
+        base = reference.get(record['case'])
+        if base is None:
+            continue
+        for key in ['forward_ms', 'backward_ms']:
+            ratio = record[key] / base[key]
+            if ratio > 1 + tolerance:
+                regressions.append((record['case'], key, base[key], record[key], ratio))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark Reorder and igc blocks on cpu')
+    parser.add_argument('--network', type=str, default=','.join(sorted(NETWORKS)), help='builders to sweep, e.g., --network=resnet_igc,plain_igc')
+    parser.add_argument('--partitions', type=str, help='(primary, secondary) partitions given to get_symbol, e.g., --partitions=4x8,24x2; per network defaults otherwise')
+    parser.add_argument('--igc-impl', type=str, default='default', choices=['default','batched','fused'], help='igc block implementation, see train_model.py')
+    parser.add_argument('--batch-size', type=str, default='1,32', help='batch sizes, e.g., --batch-size=1,32')
+    parser.add_argument('--repeat', type=int, default=10, help='the number of timed iterations')
+    parser.add_argument('--output', type=str, help='json file receiving the results')
+    parser.add_argument('--baseline', type=str, help='json results of a previous run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='relative slowdown reported as a regression')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    results = sweep(args)
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump({'date': time.strftime('%Y-%m-%d %H:%M:%S'), 'mxnet': getattr(mx, '__version__', None),
+                       'args': vars(args), 'results': results}, f, indent=2, sort_keys=True)
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for case, key, old, new, ratio in regressions:
+            logging.warning('regression %s %s: %.2fms -> %.2fms (x%.2f)', case, key, old, new, ratio)
+        logging.info('%d regressions against %s', len(regressions), args.baseline)
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
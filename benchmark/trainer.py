@@ -0,0 +1,84 @@
+'''
+Training throughput of mx.model.FeedForward against engine.Trainer on synthetic data.
+Both train the same network with the same optimizer and kvstore over the same batches, alternately
+--repeat times; the first --warmup batches of each run are not timed and the best run is reported.
+Usage: python benchmark/trainer.py --network=resnet_igc --depth=20 --primary-partition=4 --secondary-partition=8 --gpus=0,1
+'''
+import mxnet as mx
+import numpy as np
+import argparse
+import importlib
+import logging
+import time
+import sys
+sys.path.insert(0, '.')
+sys.path.insert(0, 'network')
+import engine
+import utility #registers the Nesterov optimizer
+
+class Clock(object):
+    """Batch end callback, images/sec after the first `warmup` batches"""
+    def __init__(self, batch_size, warmup):
+        self.batch_size = batch_size
+        self.warmup = warmup
+        self.tic = None
+        self.count = 0
+
+    def __call__(self, param):
+        if param.nbatch == self.warmup:
+            mx.nd.waitall()
+            self.tic = time.time()
+        elif param.nbatch > self.warmup:
+            self.count = param.nbatch - self.warmup
+
+    def speed(self):
+        mx.nd.waitall()
+        return self.count * self.batch_size / (time.time() - self.tic)
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark the FeedForward and the Module training loops')
+    parser.add_argument('--network', type=str, default='resnet_igc', help='the network to train')
+    parser.add_argument('--depth', type=int, default=20, help='the network depth')
+    parser.add_argument('--primary-partition', type=int, default=4, help='primary partition number')
+    parser.add_argument('--secondary-partition', type=int, default=8, help='secondary partition number')
+    parser.add_argument('--num-classes', type=int, default=10, help='the number of classes')
+    parser.add_argument('--data-shape', type=int, default=32, help='the image size')
+    parser.add_argument('--batch-size', type=int, default=64, help='the batch size of each device')
+    parser.add_argument('--gpus', type=str, help='the gpus to use, cpu if not given')
+    parser.add_argument('--kv-store', type=str, default='device', help='the kvstore type')
+    parser.add_argument('--batches', type=int, default=50, help='the number of timed batches')
+    parser.add_argument('--warmup', type=int, default=5, help='the number of untimed batches')
+    parser.add_argument('--repeat', type=int, default=3, help='the number of runs of each trainer')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    devs = mx.cpu() if args.gpus is None else [mx.gpu(int(i)) for i in args.gpus.split(',')]
+    num_devs = 1 if args.gpus is None else len(devs)
+    batch_size = args.batch_size * num_devs
+    num = batch_size * (args.batches + args.warmup)
+    data = np.random.uniform(-1, 1, (num, 3, args.data_shape, args.data_shape)).astype(np.float32)
+    label = np.random.randint(0, args.num_classes, (num,)).astype(np.float32)
+    symbol = importlib.import_module(args.network).get_symbol(args.num_classes, args.depth, args.primary_partition, args.secondary_partition)
+    kv = None if num_devs == 1 else mx.kvstore.create(args.kv_store)
+    optimizer_params = {'learning_rate': 0.1, 'momentum': 0.9, 'wd': 0.0001}
+
+    names = ['FeedForward', 'engine.Trainer']
+    speed = dict.fromkeys(names, 0.0)
+    for _ in range(args.repeat):
+        for name in names:
+            train = mx.io.NDArrayIter(data, label, batch_size, label_name='softmax_label')
+            clock = Clock(batch_size, args.warmup)
+            if name == 'FeedForward':
+                model = mx.model.FeedForward(ctx=devs, symbol=symbol, num_epoch=1, optimizer='Nesterov',
+                                             initializer=engine.get_initializer(), **optimizer_params)
+                model.fit(X=train, eval_metric='acc', kvstore=kv, batch_end_callback=clock)
+            else:
+                trainer = engine.Trainer(symbol, devs, kvstore=kv, optimizer='Nesterov', optimizer_params=optimizer_params)
+                trainer.fit(train, eval_metric='acc', num_epoch=1, batch_end_callback=clock)
+            speed[name] = max(speed[name], clock.speed())
+    for name in names:
+        logging.info('%s\t%.1f images/sec', name, speed[name])
+    logging.info('engine.Trainer / FeedForward: x%.2f', speed['engine.Trainer'] / speed['FeedForward'])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+'''
+Parameter update of engine.Trainer: one Nesterov update per parameter against utility.FusedNesterov.
+For both, it reports the time of the update phase per batch (kvstore included), measured with
+utility.PhaseTimer, and the training throughput of an untimed run on synthetic data; the best of
+--repeat runs is kept.
+Usage: python benchmark/update.py --network=resnet_igc --depth=38 --primary-partition=4 --secondary-partition=8 --gpus=0,1
+'''
+import mxnet as mx
+import numpy as np
+import argparse
+import importlib
+import logging
+import sys
+sys.path.insert(0, '.')
+sys.path.insert(0, 'network')
+import engine
+import utility #registers the Nesterov optimizer
+from trainer import Clock
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark the per parameter and the fused Nesterov update')
+    parser.add_argument('--network', type=str, default='resnet_igc', help='the network to train')
+    parser.add_argument('--depth', type=int, default=38, help='the network depth')
+    parser.add_argument('--primary-partition', type=int, default=4, help='primary partition number')
+    parser.add_argument('--secondary-partition', type=int, default=8, help='secondary partition number')
+    parser.add_argument('--num-classes', type=int, default=10, help='the number of classes')
+    parser.add_argument('--data-shape', type=int, default=32, help='the image size')
+    parser.add_argument('--batch-size', type=int, default=64, help='the batch size of each device')
+    parser.add_argument('--gpus', type=str, help='the gpus to use, cpu if not given')
+    parser.add_argument('--kv-store', type=str, default='device', help='the kvstore type')
+    parser.add_argument('--batches', type=int, default=30, help='the number of timed batches')
+    parser.add_argument('--warmup', type=int, default=5, help='the number of untimed batches')
+    parser.add_argument('--repeat', type=int, default=3, help='the number of runs of each update')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    devs = mx.cpu() if args.gpus is None else [mx.gpu(int(i)) for i in args.gpus.split(',')]
+    num_devs = 1 if args.gpus is None else len(devs)
+    batch_size = args.batch_size * num_devs
+    num = batch_size * (args.batches + args.warmup)
+    data = np.random.uniform(-1, 1, (num, 3, args.data_shape, args.data_shape)).astype(np.float32)
+    label = np.random.randint(0, args.num_classes, (num,)).astype(np.float32)
+    symbol = importlib.import_module(args.network).get_symbol(args.num_classes, args.depth, args.primary_partition, args.secondary_partition)
+    logging.info('%d parameters', len([name for name in symbol.list_arguments() if name not in ('data', 'softmax_label')]))
+    kv = None if num_devs == 1 else args.kv_store
+    optimizer_params = {'learning_rate': 0.1, 'momentum': 0.9, 'wd': 0.0001}
+
+    names = ['per parameter', 'fused']
+    update = dict.fromkeys(names, float('inf'))
+    speed = dict.fromkeys(names, 0.0)
+    for _ in range(args.repeat):
+        for name in names:
+            for timer in [utility.PhaseTimer(), None]:
+                train = mx.io.NDArrayIter(data, label, batch_size, label_name='softmax_label')
+                clock = Clock(batch_size, args.warmup)
+                trainer = engine.Trainer(symbol, devs, kvstore=kv, optimizer='Nesterov', optimizer_params=optimizer_params,
+                                         timer=timer, fused=name == 'fused')
+                trainer.fit(train, eval_metric='acc', num_epoch=1, batch_end_callback=clock)
+                if timer is None:
+                    speed[name] = max(speed[name], clock.speed())
+                else:
+                    update[name] = min(update[name], timer.total['update'] / (args.batches + args.warmup))
+    logging.info('update\tupdate (ms)\timages/sec')
+    for name in names:
+        logging.info('%s\t%.2f\t%.1f', name, update[name]*1e3, speed[name])
+    logging.info('fused / per parameter: update x%.2f, images/sec x%.2f',
+                 update['per parameter'] / update['fused'], speed['fused'] / speed['per parameter'])
+
+if __name__ == '__main__':
+    main()
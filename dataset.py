@@ -0,0 +1,528 @@
+'''
+Input pipelines.
+Decoded dataset cache for Cifar10, Cifar100, and SVHN.
+A .rec file is decoded once into a memory-mapped uint8 NCHW array (<prefix>_data.npy) and its labels
+(<prefix>_label.npy). CachedIter reads batches from it and applies the augmentations of ImageRecordIter
+(pad, random crop, mirror, mean/std normalization) as batched numpy operations in worker threads.
+IndexedRecord serves the images of a .rec file by random access through its .idx (built if missing),
+so CachedIter can read them without the decoded cache. Every epoch CachedIter draws one permutation
+of the whole dataset, identical on all workers, and each worker takes its own slice of it.
+
+PipelineIter runs ImageRecordIter (ImageNet decoding and augmentation) in worker processes which
+fill a shared ring of batches, and reports how long training waits for data.
+ProgressiveIter changes the image size of the training batches with the epoch.
+
+Usage: python dataset.py --rec=<dataset location>/train.rec [--prefix=<dataset location>/train]
+'''
+import mxnet as mx
+import numpy as np
+import argparse
+import json
+import logging
+import mmap
+import os
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+try:
+    from Queue import Queue
+except ImportError:
+    from queue import Queue
+try:
+    import cv2 #thread-safe decoding
+except ImportError:
+    cv2 = None
+
+#dmlc recordio: every chunk starts with the magic number and (continuation flag << 29 | length)
+RECORD_MAGIC = 0xced7230a
+decode_lock = threading.Lock()
+
+def imdecode(buf):
+    """Decode an image into a uint8 CHW RGB array"""
+    if cv2 is not None:
+        return cv2.imdecode(np.frombuffer(buf, dtype=np.uint8), cv2.IMREAD_COLOR)[:, :, ::-1].transpose(2, 0, 1)
+    with decode_lock: #the NDArray front end is not thread-safe
+        return mx.image.imdecode(buf).asnumpy().transpose(2, 0, 1)
+
+def cache_files(prefix):
+    return prefix+'_data.npy', prefix+'_label.npy'
+
+def convert(rec, prefix):
+    """Decode every image of `rec` into <prefix>_data.npy (N, 3, H, W) and <prefix>_label.npy (N,).
+    The images are counted with the .idx of `rec` (built if missing) and decoded straight into the memory map."""
+    record = IndexedRecord(rec)
+    data_file, label_file = cache_files(prefix)
+    #written under temporary names and renamed, a killed conversion leaves no partial cache
+    data = np.lib.format.open_memmap(data_file+'.tmp', mode='w+', dtype=np.uint8, shape=record.shape)
+    for i in range(len(record)):
+        img = record._decode(i)
+        assert img.shape == data.shape[1:], 'all images of %s must have the same size'%rec
+        data[i] = img
+    data.flush()
+    del data
+    with open(label_file+'.tmp', 'wb') as f:
+        np.save(f, record.label)
+    record.close()
+    os.rename(data_file+'.tmp', data_file)
+    os.rename(label_file+'.tmp', label_file)
+    logging.info('decoded %d images of %s into %s', len(record), rec, data_file)
+
+def load(rec, prefix=None):
+    """Memory-mapped (data, label) of `rec`, converted on the first call"""
+    if prefix is None:
+        prefix = os.path.splitext(rec)[0]
+    data_file, label_file = cache_files(prefix)
+    if not os.path.isfile(data_file) or not os.path.isfile(label_file):
+        convert(rec, prefix)
+    return np.load(data_file, mmap_mode='r'), np.load(label_file)
+
+def build_index(rec, idx):
+    """Write the MXNet .idx file (`key\\toffset` per record) of `rec`"""
+    with open(rec, 'rb') as f:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        offsets = []
+        pos = 0
+        while pos < len(buf):
+            magic, lrecord = struct.unpack_from('<II', buf, pos)
+            assert magic == RECORD_MAGIC, 'invalid record at byte %d of %s'%(pos, rec)
+            if lrecord >> 29 in (0, 1): #a whole record or its first chunk
+                offsets.append(pos)
+            pos += 8 + (((lrecord & ((1 << 29)-1)) + 3) & ~3)
+        buf.close()
+    with open(idx+'.tmp', 'w') as f:
+        for key, offset in enumerate(offsets):
+            f.write('%d\t%d\n'%(key, offset))
+    os.rename(idx+'.tmp', idx)
+    logging.info('indexed %d records of %s into %s', len(offsets), rec, idx)
+
+class IndexedRecord(object):
+    """Images of a .rec file read at the offsets of its .idx from a memory map.
+    Indexing with an array of record numbers returns the decoded uint8 NCHW images;
+    all images must have the same size, `label` holds the first label of every record."""
+    def __init__(self, rec, idx=None):
+        idx = idx or os.path.splitext(rec)[0]+'.idx'
+        if not os.path.isfile(idx):
+            build_index(rec, idx)
+        with open(idx) as f:
+            self.offsets = np.sort([int(line.split('\t')[1]) for line in f if line.strip()])
+        self.file = open(rec, 'rb')
+        self.buf = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.label = np.array([self._label(offset) for offset in self.offsets], dtype=np.float32)
+        self.shape = (len(self.offsets),)+self._decode(0).shape
+
+    def _label(self, offset):
+        flag, label, _, _ = struct.unpack_from(mx.recordio._IR_FORMAT, self.buf, offset+8)
+        if flag > 0:
+            label, = struct.unpack_from('f', self.buf, offset+8+mx.recordio._IR_SIZE)
+        return label
+
+    def read(self, i):
+        """The raw record `i`, with its chunks joined"""
+        pos = self.offsets[i]
+        chunks = []
+        while True:
+            _, lrecord = struct.unpack_from('<II', self.buf, pos)
+            length = lrecord & ((1 << 29)-1)
+            chunks.append(self.buf[pos+8:pos+8+length])
+            pos += 8 + ((length + 3) & ~3)
+            if lrecord >> 29 in (0, 3): #a whole record or its last chunk
+                break
+        return struct.pack('<I', RECORD_MAGIC).join(chunks)
+
+    def _decode(self, i):
+        return imdecode(mx.recordio.unpack(self.read(i))[1])
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, index):
+        return np.stack([self._decode(i) for i in index])
+
+    def close(self):
+        self.buf.close()
+        self.file.close()
+
+def load_indexed(rec, idx=None):
+    """(IndexedRecord, labels) of `rec`, indexed on the first call"""
+    record = IndexedRecord(rec, idx)
+    return record, record.label
+
+class CachedIter(mx.io.DataIter):
+    """Batches of a decoded dataset (an array or an IndexedRecord), augmented like ImageRecordIter
+    with the same arguments (pad, rand_crop, rand_mirror, mean_*, scale_*, fill_value_*, num_parts, part_index).
+    With `shuffle`, epoch e visits the permutation of RandomState(seed+e), the same on every worker given the same
+    `seed`; the first epoch is `begin_epoch`, so a resumed run goes on with the order of the epochs it has not seen.
+    worker `part_index` takes every `num_parts`-th sample of it, so all workers get the same number of batches.
+    Each batch is split over `num_threads` threads and `prefetch` batches are prepared ahead."""
+    def __init__(self, data, label, batch_size, data_shape, shuffle=False, pad=0, rand_crop=False, rand_mirror=False,
+                 mean_r=0, mean_g=0, mean_b=0, scale_r=1, scale_g=1, scale_b=1,
+                 fill_value_r=0, fill_value_g=0, fill_value_b=0, num_parts=1, part_index=0,
+                 num_threads=4, prefetch=2, seed=0, begin_epoch=0):
+        super(CachedIter, self).__init__()
+        self.data = data
+        self.label = label
+        self.num_parts = num_parts
+        self.part_index = part_index
+        self.seed = seed
+        self.epoch = begin_epoch-1 #reset() starts begin_epoch
+        self.batch_size = batch_size
+        self.data_shape = tuple(data_shape)
+        self.shuffle = shuffle
+        self.pad = pad
+        self.rand_crop = rand_crop
+        self.rand_mirror = rand_mirror
+        self.mean = np.array([mean_r, mean_g, mean_b], dtype=np.float32).reshape(1, 3, 1, 1)
+        self.scale = np.array([scale_r, scale_g, scale_b], dtype=np.float32).reshape(1, 3, 1, 1)
+        self.fill = np.array([fill_value_r, fill_value_g, fill_value_b], dtype=np.uint8).reshape(1, 3, 1, 1)
+        self.num_threads = num_threads
+        self.prefetch = prefetch
+        self.rng = np.random.RandomState([seed, part_index]) #augmentation differs between the workers
+        self.pool = ThreadPool(num_threads)
+        self.reset()
+
+    @property
+    def provide_data(self):
+        return [('data', (self.batch_size,)+self.data_shape)]
+
+    @property
+    def provide_label(self):
+        return [('softmax_label', (self.batch_size,))]
+
+    def reset(self):
+        self.epoch += 1
+        order = np.random.RandomState(self.seed+self.epoch).permutation(len(self.data)) if self.shuffle else np.arange(len(self.data))
+        self.order = order[self.part_index::self.num_parts][:len(order)//self.num_parts]
+        self.cursor = 0
+        self.pending = []
+        for _ in range(self.prefetch):
+            self._submit()
+
+    def _submit(self):
+        """Queue the batch at the cursor; the last batch wraps around and reports the padding"""
+        if self.cursor >= len(self.order):
+            return
+        index = self.order[self.cursor:self.cursor+self.batch_size]
+        pad = self.batch_size - len(index)
+        if pad > 0:
+            index = np.concatenate([index, self.order[:pad]])
+        self.cursor += self.batch_size
+        #random numbers are drawn here, in order, so the augmentation does not depend on thread timing
+        _, size, _ = self.data_shape
+        height, width = self.data.shape[2]+2*self.pad, self.data.shape[3]+2*self.pad
+        if self.rand_crop:
+            y = self.rng.randint(0, height-size+1, len(index))
+            x = self.rng.randint(0, width-size+1, len(index))
+        else:
+            y = np.full(len(index), (height-size)//2, dtype=np.int64)
+            x = np.full(len(index), (width-size)//2, dtype=np.int64)
+        flip = self.rng.randint(0, 2, len(index)).astype(bool) if self.rand_mirror else np.zeros(len(index), dtype=bool)
+        chunks = np.array_split(np.arange(len(index)), self.num_threads)
+        jobs = [self.pool.apply_async(self._augment, (np.sort(index[c]), index[c], y[c], x[c], flip[c])) for c in chunks if len(c)]
+        self.pending.append((jobs, self.label[index], pad))
+
+    def _augment(self, sorted_index, index, y, x, flip):
+        """Pad, crop, mirror and normalize the images `index` as one gather"""
+        #read the memory map in increasing order, then restore the sampled order
+        images = np.asarray(self.data[sorted_index])[np.searchsorted(sorted_index, index)]
+        num, channel, height, width = images.shape
+        if self.pad > 0:
+            padded = np.empty((num, channel, height+2*self.pad, width+2*self.pad), dtype=np.uint8)
+            padded[:] = self.fill
+            padded[:, :, self.pad:self.pad+height, self.pad:self.pad+width] = images
+            images = padded
+        _, size, _ = self.data_shape
+        rows = y[:, None] + np.arange(size)
+        cols = x[:, None] + np.arange(size)
+        cols[flip] = cols[flip, ::-1]
+        out = images[np.arange(num)[:, None, None, None], np.arange(channel)[None, :, None, None],
+                     rows[:, None, :, None], cols[:, None, None, :]].astype(np.float32)
+        out -= self.mean
+        out *= self.scale
+        return out
+
+    def next(self):
+        if not self.pending:
+            raise StopIteration
+        jobs, label, pad = self.pending.pop(0)
+        self._submit()
+        data = np.concatenate([job.get() for job in jobs])
+        return mx.io.DataBatch(data=[mx.nd.array(data)], label=[mx.nd.array(label)], pad=pad, index=None)
+
+    __next__ = next
+
+def create_iterator(config):
+    """Iterator described by {'iterator': 'ImageRecordIter', 'cache' or 'index', 'kwargs': ImageRecordIter arguments},
+    a json-able form used to rebuild the validation iterator in another process"""
+    kwargs = dict((str(k), v) for k, v in config['kwargs'].items())
+    kwargs['data_shape'] = tuple(kwargs['data_shape'])
+    if config['iterator'] == 'ImageRecordIter':
+        return mx.io.ImageRecordIter(**kwargs)
+    rec = kwargs.pop('path_imgrec')
+    source = load if config['iterator'] == 'cache' else load_indexed
+    return CachedIter(*source(rec), **kwargs)
+
+class BucketIter(mx.io.DataIter):
+    """Batches of `data_iter` tagged with `key` as bucket key, for a BucketingModule"""
+    def __init__(self, data_iter, key, default_bucket_key=None):
+        super(BucketIter, self).__init__()
+        self.data_iter = data_iter
+        self.key = key
+        self.default_bucket_key = key if default_bucket_key is None else default_bucket_key
+        self.batch_size = data_iter.batch_size
+
+    @property
+    def provide_data(self):
+        return self.data_iter.provide_data
+
+    @property
+    def provide_label(self):
+        return self.data_iter.provide_label
+
+    def reset(self):
+        self.data_iter.reset()
+
+    def next(self):
+        batch = self.data_iter.next()
+        batch.bucket_key = self.key
+        batch.provide_data = self.data_iter.provide_data
+        batch.provide_label = self.data_iter.provide_label
+        return batch
+
+    __next__ = next
+
+class ProgressiveIter(BucketIter):
+    """Training batches whose image size follows `schedule`, a list of (first epoch, size).
+    The iterator of a size is built by `create(size)` when the size changes, and the previous one is
+    closed. Batches carry their size as bucket key, so a BucketingModule binds one executor per size,
+    all sharing the parameters and the memory of the executor of the largest size (provide_data)."""
+    def __init__(self, schedule, create, begin_epoch=0):
+        self.schedule = sorted(schedule)
+        self.create = create
+        self.epoch = begin_epoch
+        size = self._size()
+        logging.info('Epoch[%d] training at %dx%d', self.epoch, size, size)
+        super(ProgressiveIter, self).__init__(create(size), size, max(s for _, s in self.schedule))
+
+    def _size(self):
+        return [s for first, s in self.schedule if first <= self.epoch][-1]
+
+    @property
+    def provide_data(self):
+        name, shape = self.data_iter.provide_data[0]
+        return [(name, tuple(shape[:-2])+(self.default_bucket_key, self.default_bucket_key))]
+
+    def reset(self):
+        self.epoch += 1
+        size = self._size()
+        if size != self.key:
+            getattr(self.data_iter, 'close', lambda: None)()
+            logging.info('Epoch[%d] training at %dx%d', self.epoch, size, size)
+            self.data_iter = self.create(size)
+            self.key = size
+        self.data_iter.reset()
+
+def pin(cores):
+    """Restrict the current process to `cores` if the platform allows it"""
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cores)
+        return
+    try:
+        import psutil
+        psutil.Process().cpu_affinity(list(cores))
+    except (ImportError, AttributeError):
+        pass
+
+def worker(config):
+    """Worker process of PipelineIter: fills the ring slots asked for on stdin and answers on stdout
+    with `<slot> <pad>`, or `end` first when its part of the dataset is exhausted (then it starts over)"""
+    pin(config['cores'])
+    kwargs = config['kwargs']
+    kwargs['data_shape'] = tuple(kwargs['data_shape'])
+    batch_shape = (kwargs['batch_size'],)+kwargs['data_shape']
+    data = np.memmap(config['ring']+'.data', dtype=np.float32, mode='r+', shape=(config['slots'],)+batch_shape)
+    label = np.memmap(config['ring']+'.label', dtype=np.float32, mode='r+', shape=(config['slots'], kwargs['batch_size']))
+    it = mx.io.ImageRecordIter(**kwargs)
+    for line in iter(sys.stdin.readline, ''):
+        slot = int(line)
+        try:
+            batch = it.next()
+        except StopIteration:
+            sys.stdout.write('end\n')
+            it.reset()
+            batch = it.next()
+        data[slot] = batch.data[0].asnumpy()
+        label[slot] = batch.label[0].asnumpy()
+        sys.stdout.write('%d %d\n'%(slot, batch.pad))
+        sys.stdout.flush()
+
+class PipelineIter(mx.io.DataIter):
+    """ImageRecordIter split over `num_workers` processes, each reading 1/num_workers of this node's
+    part of the dataset with `threads` preprocessing threads, pinned to its own cores.
+    Every worker keeps `prefetch` batches ready in a shared memory ring; the ready batches are
+    handed out in the order they complete. Every `report` batches, the time spent waiting for a
+    batch is logged, as a warning when it exceeds 5% of the time."""
+    def __init__(self, num_workers, threads=None, prefetch=2, report=100, **kwargs):
+        super(PipelineIter, self).__init__()
+        self.batch_size = kwargs['batch_size']
+        self.data_shape = tuple(kwargs['data_shape'])
+        self.num_workers = num_workers
+        self.report = report
+        slots = num_workers*prefetch
+        threads = threads or max(1, cpu_count() // num_workers)
+        shm = '/dev/shm' if os.path.isdir('/dev/shm') else None
+        fd, self.ring = tempfile.mkstemp(prefix='pipeline', dir=shm)
+        os.close(fd)
+        self.data = np.memmap(self.ring+'.data', dtype=np.float32, mode='w+', shape=(slots, self.batch_size)+self.data_shape)
+        self.label = np.memmap(self.ring+'.label', dtype=np.float32, mode='w+', shape=(slots, self.batch_size))
+        num_parts, part_index = kwargs.pop('num_parts', 1), kwargs.pop('part_index', 0)
+        self.ready = Queue()
+        self.workers = []
+        for i in range(num_workers):
+            worker_kwargs = dict(kwargs, num_parts=num_parts*num_workers, part_index=part_index*num_workers+i,
+                                 preprocess_threads=threads)
+            cores = [(i*threads+k) % cpu_count() for k in range(threads)]
+            config = {'kwargs': worker_kwargs, 'cores': cores, 'ring': self.ring, 'slots': slots}
+            proc = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--worker', json.dumps(config)],
+                                    stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+            reader = threading.Thread(target=self._read, args=(i, proc))
+            reader.daemon = True
+            reader.start()
+            self.workers.append(proc)
+            for slot in range(i*prefetch, (i+1)*prefetch):
+                self._request(i, slot)
+        self.epoch = 0
+        self.ended = set()
+        self.deferred = []
+        self.consumed = 0
+        self._reset_report()
+
+    def _read(self, worker, proc):
+        for line in iter(proc.stdout.readline, b''):
+            self.ready.put((worker, line.split()))
+        self.ready.put((worker, None))
+
+    def _request(self, worker, slot):
+        self.workers[worker].stdin.write(b'%d\n'%slot)
+        self.workers[worker].stdin.flush()
+
+    def _reset_report(self):
+        self.wait = 0.0
+        self.tic = time.time()
+        self.count = 0
+
+    @property
+    def provide_data(self):
+        return [('data', (self.batch_size,)+self.data_shape)]
+
+    @property
+    def provide_label(self):
+        return [('softmax_label', (self.batch_size,))]
+
+    def _get(self):
+        """Next message of the current epoch, the messages of workers already in the next epoch are deferred"""
+        while True:
+            worker, message = self.ready.get()
+            if message is None:
+                raise RuntimeError('input pipeline worker %d exited with status %s'%(worker, self.workers[worker].wait()))
+            if worker in self.ended:
+                self.deferred.append((worker, message))
+                continue
+            if message[0] == b'end':
+                self.ended.add(worker)
+                if len(self.ended) == self.num_workers:
+                    return None
+                continue
+            return worker, message
+
+    def next(self):
+        tic = time.time()
+        item = self._get()
+        self.wait += time.time()-tic
+        if item is None:
+            raise StopIteration
+        worker, (slot, pad) = item
+        slot = int(slot)
+        batch = mx.io.DataBatch(data=[mx.nd.array(self.data[slot])], label=[mx.nd.array(self.label[slot])], pad=int(pad), index=None)
+        self._request(worker, slot)
+        self.consumed += 1
+        self.count += 1
+        if self.report and self.count == self.report:
+            total = time.time()-self.tic
+            log = logging.warning if self.wait > 0.05*total else logging.info
+            log('input pipeline: training waited %.2fs of %.2fs (%.1f%%) for data in the last %d batches',
+                self.wait, total, 100.0*self.wait/total, self.count)
+            self._reset_report()
+        return batch
+
+    __next__ = next
+
+    def reset(self):
+        if self.consumed == 0:
+            return
+        while len(self.ended) < self.num_workers: #reset in the middle of an epoch
+            try:
+                self.next()
+            except StopIteration:
+                break
+        for item in self.deferred:
+            self.ready.put(item)
+        self.deferred = []
+        self.ended = set()
+        self.consumed = 0
+        self.epoch += 1
+
+    def close(self):
+        for proc in self.workers:
+            proc.stdin.close()
+            proc.wait()
+        for f in [self.ring, self.ring+'.data', self.ring+'.label']:
+            if os.path.exists(f):
+                os.remove(f)
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+def calibrate(max_workers=None, batches=4, **kwargs):
+    """Number of PipelineIter workers: doubled from 1 while the throughput grows by more than 10%"""
+    max_workers = max_workers or cpu_count()
+    best, best_speed, num = 1, 0.0, 1
+    while num <= max_workers:
+        it = PipelineIter(num, prefetch=1, report=0, **kwargs)
+        for _ in range(num): #the first batch of every worker includes its startup
+            it.next()
+        tic = time.time()
+        for _ in range(batches*num):
+            it.next()
+        speed = batches*num*kwargs['batch_size'] / (time.time()-tic)
+        it.close()
+        logging.info('input pipeline calibration: %d workers, %.1f images/sec', num, speed)
+        if speed < best_speed*1.1:
+            break
+        best, best_speed = num, speed
+        num *= 2
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description='decode a .rec dataset into a memory-mapped uint8 array')
+    parser.add_argument('--rec', type=str, help='the .rec file to decode')
+    parser.add_argument('--prefix', type=str, help='prefix of the cache files, the .rec path without extension by default')
+    parser.add_argument('--worker', type=str, help='internal usage: run a PipelineIter worker with this json config')
+    args = parser.parse_args()
+    if args.worker is not None:
+        worker(json.loads(args.worker))
+        return
+    if args.rec is None:
+        parser.error('--rec is required')
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    convert(args.rec, args.prefix or os.path.splitext(args.rec)[0])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,376 @@
+'''
+Training engine of train_model.py and train_imagenet.py, on the Module API.
+Contact: Liming Zhao (zlmzju@gmail.com)
+'''
+import mxnet as mx
+import numpy as np
+import logging
+import os
+import sys
+import threading
+import time
+import utility
+
+class Init(mx.init.Xavier):
+    def __init__(self, rnd_type="uniform", factor_type="avg", magnitude=3):
+        self.rnd_type = rnd_type
+        self.factor_type = factor_type
+        self.magnitude = float(magnitude)
+
+    def __call__(self, name, arr):
+        """Override () function to do Initialization
+
+        Parameters
+        ----------
+        name : str
+            name of corrosponding ndarray
+
+        arr : NDArray
+            ndarray to be Initialized
+        """
+        if not isinstance(name, mx.base.string_types):
+            raise TypeError('name must be string')
+        if not isinstance(arr, mx.ndarray.NDArray):
+            raise TypeError('arr must be NDArray')
+        if name.endswith('upsampling'):
+            self._init_bilinear(name, arr)
+        elif name.endswith('bias'):
+            self._init_bias(name, arr)
+        elif name.endswith('gamma'):
+            self._init_gamma(name, arr)
+        elif name.endswith('beta'):
+            self._init_beta(name, arr)
+        elif name.endswith('weight'):
+            self._init_weight(name, arr)
+        elif name.endswith("moving_mean"):
+            self._init_zero(name, arr)
+        elif name.endswith("moving_var"):
+            self._init_zero(name, arr)
+        elif name.endswith("moving_inv_var"):
+            self._init_zero(name, arr)
+        elif name.endswith("moving_avg"):
+            self._init_zero(name, arr)
+        else:
+            self._init_default(name, arr)
+
+def get_initializer():
+    # Note we initialize BatchNorm beta and gamma as that in
+    # https://github.com/facebook/fb.resnet.torch/
+    # i.e. constant 0 and 1, rather than
+    # https://github.com/gcr/torch-residual-networks/blob/master/residual-layers.lua
+    # FC layer is initialized as that in torch default
+    # https://github.com/torch/nn/blob/master/Linear.lua
+    return mx.init.Mixed(['.*fc.*', '.*'],
+        [mx.init.Xavier(rnd_type='uniform', factor_type='in', magnitude=1),
+         Init(rnd_type='gaussian', factor_type='in', magnitude=2)])
+
+def _as_list(callbacks):
+    if callbacks is None:
+        return []
+    return callbacks if isinstance(callbacks, list) else [callbacks]
+
+class Checkpoint(object):
+    """Epoch end callback writing the checkpoints of mx.callback.do_checkpoint, <prefix>-symbol.json
+    and <prefix>-%04d.params, with the optimizer states of `trainer` in <prefix>-%04d.states.
+    The parameters and the states are copied when the epoch ends and written by a background thread,
+    so training goes on meanwhile; every file is written aside and renamed in place, and the states
+    before the parameters, so a params file is complete and has its states. A write waits for the
+    previous one, a failed write is logged and raises in the next call or in wait()."""
+    def __init__(self, prefix, period=1, trainer=None):
+        self.prefix = prefix
+        self.period = int(max(1, period))
+        self.trainer = trainer
+        self.thread = None
+        self.error = None
+
+    def __call__(self, epoch, symbol, arg_params, aux_params):
+        if (epoch + 1) % self.period != 0:
+            return
+        self.wait()
+        #the copies are queued before any later update of the parameters
+        params = dict(('arg:%s' % k, v.copy()) for k, v in arg_params.items())
+        params.update(('aux:%s' % k, v.copy()) for k, v in aux_params.items())
+        states = None if self.trainer is None else self.trainer.get_optimizer_states()
+        self.thread = threading.Thread(target=self._write, args=(epoch + 1, symbol, params, states))
+        self.thread.start()
+
+    def wait(self):
+        """Wait for the checkpoint being written"""
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error[0], error[1], error[2]
+
+    def _write(self, epoch, symbol, params, states):
+        def write_states(name):
+            with open(name, 'wb') as f:
+                f.write(states)
+        try:
+            _replace('%s-symbol.json' % self.prefix, symbol.save)
+            if states is not None:
+                _replace('%s-%04d.states' % (self.prefix, epoch), write_states)
+            param_name = '%s-%04d.params' % (self.prefix, epoch)
+            _replace(param_name, lambda name: mx.nd.save(name, params))
+            logging.info('Saved checkpoint to "%s"', param_name)
+        except Exception:
+            logging.exception('Failed to save the checkpoint of epoch %d', epoch)
+            self.error = sys.exc_info()
+
+def _replace(filename, write):
+    """write(name) aside, then rename it to `filename`"""
+    tmp = filename + '.tmp'
+    write(tmp)
+    os.rename(tmp, filename)
+
+class Trainer(object):
+    """Train `symbol` with a Module bound once and reused by every call of fit.
+
+    Parameters
+    ----------
+    symbol: Symbol
+        the network, with inputs `data` and `softmax_label`
+    ctx: Context or list of Context
+        the devices
+    kvstore: KVStore or str
+        None for a single device
+    optimizer, optimizer_params:
+        as for Module.init_optimizer; rescale_grad defaults to 1/(batch_size*accumulate)
+    initializer, arg_params, aux_params:
+        the initial parameters, arg_params and aux_params are loaded over the initializer
+    optimizer_states: str
+        a .states file of Checkpoint, loaded into the optimizer when binding; resuming also needs
+        the begin_num_update of the optimizer
+    default_bucket_key: int
+        use a BucketingModule: batches carry a bucket key (e.g. the image size) and every key gets
+        its own executor, sharing the parameters and the memory of the default one
+    timer: utility.PhaseTimer
+        optional, times the phases of the loop
+    accumulate: int
+        sum the gradients of this many batches before every update, the effective batch size
+        is accumulate times the batch size of the iterator
+    fused: bool
+        update with utility.FusedNesterov: the executors are bound on its flat buffers and the
+        gradients of all parameters are reduced on the kvstore as one key; float32 parameters,
+        a Nesterov optimizer and a sync kvstore only
+    """
+    def __init__(self, symbol, ctx, kvstore=None, optimizer='Nesterov', optimizer_params=None,
+                 initializer=None, arg_params=None, aux_params=None, optimizer_states=None, default_bucket_key=None,
+                 timer=None, accumulate=1, fused=False):
+        self.symbol = symbol
+        self.ctx = ctx
+        self.kvstore = kvstore
+        self.optimizer = optimizer
+        self.optimizer_params = optimizer_params or {}
+        self.initializer = initializer or get_initializer()
+        self.arg_params = arg_params
+        self.aux_params = aux_params
+        self.optimizer_states = optimizer_states
+        self.timer = timer
+        self.accumulate = accumulate
+        self.accumulated = 0
+        self.fused = fused
+        self.fused_kvstore = None
+        if default_bucket_key is None:
+            self.module = mx.mod.Module(symbol, context=ctx)
+        else:
+            self.module = mx.mod.BucketingModule(lambda key: (symbol, ('data',), ('softmax_label',)),
+                                                 default_bucket_key, context=ctx)
+        self.eval_module = None
+        self.pending = None
+
+    def _phase(self, name, func, *args, **kwargs):
+        if self.timer is None:
+            return func(*args, **kwargs)
+        return self.timer.run(name, func, *args, **kwargs)
+
+    def _next(self, data_iter):
+        try:
+            return self._phase('data', data_iter.next)
+        except StopIteration:
+            return None
+
+    def bind(self, train):
+        """Bind the executors and set up the parameters and the optimizer, once"""
+        if self.module.binded:
+            return
+        self.module.bind(train.provide_data, train.provide_label, for_training=True,
+                         grad_req='write' if self.accumulate == 1 else 'add')
+        self.module.init_params(self.initializer, self.arg_params, self.aux_params, allow_missing=True)
+        optimizer_params = dict(self.optimizer_params)
+        if 'rescale_grad' not in optimizer_params:
+            batch_size = train.provide_data[0][1][0] * self.accumulate
+            if isinstance(self.kvstore, mx.kvstore.KVStore) and 'dist' in self.kvstore.type and '_sync' in self.kvstore.type:
+                batch_size *= self.kvstore.num_workers
+            optimizer_params['rescale_grad'] = 1.0/batch_size
+        #the fused update reduces the gradients itself, the module only creates the optimizer
+        self.module.init_optimizer(kvstore=None if self.fused else self.kvstore, optimizer=self.optimizer,
+                                   optimizer_params=optimizer_params)
+        if self.fused:
+            self._fuse()
+        if self.optimizer_states is not None:
+            with open(self.optimizer_states, 'rb') as f:
+                self.set_optimizer_states(f.read())
+        logging.info('memory planned by the executor of each device: %s MB', utility.memory(self._current()._exec_group.execs[0]))
+
+    def _fuse(self):
+        """Rebind the executors on the buffers of utility.FusedNesterov, they keep their memory pool"""
+        module = self._current()
+        group = module._exec_group
+        names = group.param_names
+        assert all(arrays[0].dtype == np.float32 for arrays in group.param_arrays), 'the fused update needs float32 parameters'
+        self.fused = utility.FusedNesterov(module._optimizer, names, [arrays[0].shape for arrays in group.param_arrays],
+                                           group.contexts)
+        for k, exe in enumerate(group.execs):
+            for name, view in zip(names, self.fused.weights[k]):
+                exe.arg_dict[name].copyto(view)
+            args = dict(exe.arg_dict)
+            args.update(zip(names, self.fused.weights[k]))
+            group.execs[k] = group.symbol.bind(group.contexts[k], args, args_grad=dict(zip(names, self.fused.grads[k])),
+                                               grad_req=group.grad_req, aux_states=exe.aux_dict, shared_exec=exe)
+        group._collect_arrays()
+        kvstore, _ = mx.model._create_kvstore(self.kvstore, len(group.contexts), module._arg_params)
+        if kvstore is not None and ('dist' in kvstore.type or len(group.contexts) > 1):
+            assert 'async' not in kvstore.type, 'the fused update needs a sync kvstore'
+            kvstore.init(0, self.fused.grad[0])
+            if 'dist' in kvstore.type: #the weights of the first worker
+                kvstore.init(1, self.fused.weight[0])
+                kvstore.pull(1, out=self.fused.weight)
+            self.fused_kvstore = kvstore
+
+    def _fused_update(self):
+        if self.fused_kvstore is not None:
+            self.fused_kvstore.push(0, self.fused.grad)
+            self.fused_kvstore.pull(0, out=self.fused.grad)
+        self.fused.update()
+        self.module._params_dirty = True #get_params copies from the devices
+
+    def _updater(self):
+        """The holder of the optimizer states: the fused update, the updater of the module or of its
+        kvstore; None when the parameter servers update"""
+        if self.fused:
+            return self.fused
+        module = self._current()
+        return module._kvstore._updater if module._update_on_kvstore else module._updater
+
+    def get_optimizer_states(self):
+        """The optimizer states (e.g., momenta) as a string, None when they are on the servers"""
+        updater = self._updater()
+        return None if updater is None else updater.get_states()
+
+    def set_optimizer_states(self, states):
+        updater = self._updater()
+        if updater is None:
+            logging.warning('the optimizer states are on the parameter servers, they are not restored')
+            return
+        updater.set_states(states)
+
+    def _current(self):
+        """The Module of the current bucket"""
+        return self.module._curr_module if isinstance(self.module, mx.mod.BucketingModule) else self.module
+
+    def _update(self):
+        """Update the parameters once `accumulate` batches have added their gradients"""
+        self.accumulated += 1
+        if self.accumulated < self.accumulate:
+            return
+        if self.fused:
+            self._phase('update', self._fused_update)
+        else:
+            self._phase('update', self.module.update)
+        if self.accumulate > 1 and self.fused:
+            for grad in self.fused.grad:
+                grad[:] = 0
+        elif self.accumulate > 1:
+            for grads in self._current()._exec_group.grad_arrays: #the buckets share the parameter gradients
+                for grad in grads:
+                    if grad is not None:
+                        grad[:] = 0
+        self.accumulated = 0
+
+    def _get_eval_module(self, val):
+        """The module evaluating `val`: its own executors, bound once, on the training parameters"""
+        if isinstance(self.module, mx.mod.BucketingModule):
+            return self.module #the batches carry their key
+        if self.eval_module is None:
+            self.eval_module = mx.mod.Module(self.symbol, context=self.ctx)
+            self.eval_module.bind(val.provide_data, val.provide_label, for_training=False, shared_module=self.module)
+        return self.eval_module
+
+    def _end_batch(self, epoch, nbatch, eval_metric, batch, batch_end_callback):
+        """Update the metric with the (labels, outputs) of `batch` and call the batch end callbacks"""
+        self._phase('metric', eval_metric.update, *batch)
+        params = mx.model.BatchEndParam(epoch=epoch, nbatch=nbatch, eval_metric=eval_metric, locals=locals())
+        for callback in _as_list(batch_end_callback):
+            callback(params)
+
+    def score(self, val, eval_metric):
+        """Evaluate on `val`, returns the (name, value) pairs of `eval_metric`"""
+        module = self._get_eval_module(val)
+        eval_metric.reset()
+        val.reset()
+        for batch in val:
+            self._phase('eval', module.forward, batch, is_train=False)
+            self._phase('eval', module.update_metric, eval_metric, batch.label)
+        return eval_metric.get_name_value()
+
+    def fit(self, train, val=None, eval_metric='acc', begin_epoch=0, num_epoch=1, epoch_size=None,
+            batch_end_callback=None, epoch_end_callback=None, eval_end_callback=None):
+        """Train from `begin_epoch` to `num_epoch`.
+        batch_end_callback(BatchEndParam), epoch_end_callback(epoch, symbol, arg_params, aux_params) and
+        eval_end_callback(epoch, [(name, value)]) take a callable or a list of them.
+        With `epoch_size`, an epoch is that many batches, resetting `train` when it runs out, and the next
+        epoch continues the iterator."""
+        self.bind(train)
+        if not isinstance(eval_metric, mx.metric.EvalMetric):
+            eval_metric = mx.metric.create(eval_metric)
+        module = self.module
+        for epoch in range(begin_epoch, num_epoch):
+            tic = time.time()
+            eval_metric.reset()
+            nbatch = 0
+            queued = 0
+            last = None
+            batch, self.pending = self.pending or self._next(train), None
+            while batch is not None:
+                self._phase('forward', module.forward, batch, is_train=True)
+                self._phase('backward', module.backward)
+                #gradients are pushed and pulled per parameter as soon as the engine has computed them
+                self._update()
+                outputs = [out.copy() for out in module.get_outputs()] #the next forward overwrites them
+                queued += 1
+                #the metric of the previous batch waits for its outputs, this batch is already queued
+                if last is not None:
+                    nbatch += 1
+                    self._end_batch(epoch, nbatch, eval_metric, last, batch_end_callback)
+                last = (batch.label, outputs)
+                batch = self._next(train) #read while the device works
+                if epoch_size is None:
+                    continue
+                if queued >= epoch_size:
+                    self.pending = batch
+                    break
+                if batch is None: #as FeedForward, an epoch of epoch_size batches goes on over the reset
+                    train.reset()
+                    batch = self._next(train)
+            if last is not None:
+                nbatch += 1
+                self._end_batch(epoch, nbatch, eval_metric, last, batch_end_callback)
+            for name, value in eval_metric.get_name_value():
+                logging.info('Epoch[%d] Train-%s=%f', epoch, name, value)
+            toc = time.time()-tic
+            logging.info('Epoch[%d] Time cost=%.3f', epoch, toc)
+            logging.info('Epoch[%d] Step time=%.1f ms, peak host memory=%d MB', epoch, 1000.0*toc/max(nbatch, 1), utility.peak_memory())
+
+            arg_params, aux_params = module.get_params()
+            for callback in _as_list(epoch_end_callback):
+                callback(epoch, self.symbol, arg_params, aux_params)
+            if val is not None:
+                name_value = self.score(val, eval_metric)
+                for name, value in name_value:
+                    logging.info('Epoch[%d] Validation-%s=%f', epoch, name, value)
+                for callback in _as_list(eval_end_callback):
+                    callback(epoch, name_value)
+            if self.pending is None:
+                train.reset()
@@ -0,0 +1,14 @@
+'''
+Helpers shared by the network builders
+'''
+import mxnet as mx
+
+def get_layout(op, layout):
+    #operator arguments of channels-last graphs, NCHW graphs keep the defaults
+    if layout=='NCHW':
+        return {}
+    return {'axis': 3} if op=='BatchNorm' else {'layout': layout}
+
+def get_mirror(mirror):
+    #the outputs of the layers built in this scope are recomputed in backward instead of being kept
+    return mx.AttrScope(force_mirroring='True') if mirror else mx.AttrScope()
@@ -2,33 +2,43 @@
 Plain network with interleaved group convolutions
 '''
 import mxnet as mx
+from common import get_layout, get_mirror
 
-def get_conv(name, data, kout, kernel, stride, pad):
+def get_conv(name, data, kout, kernel, stride, pad, layout='NCHW'):
     #Conv-BN-ReLU style
-    data = mx.symbol.Convolution(name=name+'_conv', data=data, num_filter=kout, kernel=kernel, stride=stride, pad=pad, no_bias=True)
-    data = mx.symbol.BatchNorm(name=name + '_bn', data=data, fix_gamma=False, momentum=0.99, eps=2e-5)
+    data = mx.symbol.Convolution(name=name+'_conv', data=data, num_filter=kout, kernel=kernel, stride=stride, pad=pad, no_bias=True, **get_layout('Convolution', layout))
+    data = mx.symbol.BatchNorm(name=name + '_bn', data=data, fix_gamma=False, momentum=0.99, eps=2e-5, **get_layout('BatchNorm', layout))
     data = mx.symbol.Activation(name=name + '_relu', data=data, act_type='relu')
     return data
 
-def get_igc(name, data, kin, kout, primary_partition, secondary_partition):
+def get_igc(name, data, kin, kout, primary_partition, secondary_partition, impl='default', layout='NCHW', mirror=False):
     #Interleaved group convolution block
-    data = mx.symbol.Convolution(name=name+'_conv1',data=data, num_filter=kout, kernel=(3,3), stride=(1,1) if kin==kout else (2,2),pad=(1,1), no_bias=True,num_group=primary_partition)
-    data = mx.symbol.Reorder(name=name+'_reorder1', data=data, branch_factor=primary_partition)
-    data = mx.symbol.Convolution(name=name+'_conv2',data=data, num_filter=kout, kernel=(1,1), stride=(1,1), pad=(0,0), no_bias=True, num_group=secondary_partition)
-    data = mx.symbol.Reorder(name=name+'_reorder2', data=data, branch_factor=secondary_partition)
-    data = mx.symbol.BatchNorm(name=name + '_bn',   data=data, fix_gamma=False, momentum=0.99, eps=2e-5)
+    with get_mirror(mirror): #only the block output is kept with mirror
+        if impl=='fused': #one IGC operator, same weights as the unfused graph
+            data = mx.symbol.IGC(name=name+'_igc', data=data, weight1=mx.symbol.Variable(name+'_conv1_weight'), weight2=mx.symbol.Variable(name+'_conv2_weight'),
+                                 num_filter=kout, kernel=(3,3), stride=(1,1) if kin==kout else (2,2), pad=(1,1), primary_partition=primary_partition, secondary_partition=secondary_partition)
+        else:
+            data = mx.symbol.Convolution(name=name+'_conv1',data=data, num_filter=kout, kernel=(3,3), stride=(1,1) if kin==kout else (2,2),pad=(1,1), no_bias=True,num_group=primary_partition, **get_layout('Convolution', layout))
+            data = mx.symbol.Reorder(name=name+'_reorder1', data=data, branch_factor=primary_partition, **get_layout('Reorder', layout))
+            if impl=='batched': #all groups of the 1x1 convolution as one batched matmul
+                data = mx.symbol.GroupPointwise(name=name+'_conv2', data=data, num_filter=kout, num_group=secondary_partition, no_bias=True)
+            else:
+                data = mx.symbol.Convolution(name=name+'_conv2',data=data, num_filter=kout, kernel=(1,1), stride=(1,1), pad=(0,0), no_bias=True, num_group=secondary_partition, **get_layout('Convolution', layout))
+            data = mx.symbol.Reorder(name=name+'_reorder2', data=data, branch_factor=secondary_partition, **get_layout('Reorder', layout))
+        data = mx.symbol.BatchNorm(name=name + '_bn',   data=data, fix_gamma=False, momentum=0.99, eps=2e-5, **get_layout('BatchNorm', layout))
     data=mx.symbol.Activation(name=name + '_relu',  data=data, act_type='relu')
     return data
     
 
-def get_group(name,data,num_block,kin,kout,primary_partition, secondary_partition):
+def get_group(name,data,num_block,kin,kout,primary_partition, secondary_partition, impl='default', layout='NCHW', mirror=False):
     for idx in range(num_block):
-        data = get_igc(name=name+'_b%d'%(idx+1), data=data, kin=kin, kout=kout,primary_partition=primary_partition, secondary_partition=secondary_partition)
+        data = get_igc(name=name+'_b%d'%(idx+1), data=data, kin=kin, kout=kout,primary_partition=primary_partition, secondary_partition=secondary_partition, impl=impl, layout=layout, mirror=mirror)
         kin=kout
     return data
 
 
-def get_symbol(num_classes, net_depth,primary_partition,secondary_partition):
+def get_symbol(num_classes, net_depth,primary_partition,secondary_partition, impl='default', layout='NCHW', mirror=()):
+    #mirror: the stages (1, 2, 3) whose blocks recompute their inner activations in backward
     # setup model parameters
     block3_num=(net_depth-2)/3
     block2_num=(net_depth-2)/3
@@ -39,15 +49,18 @@ def get_symbol(num_classes, net_depth,primary_partition,secondary_partition):
         return
     # start network definition
     data = mx.symbol.Variable(name='data')
+    if layout=='NHWC': #the input stays NCHW
+        assert impl=='default', 'the IGC and GroupPointwise operators only support NCHW'
+        data = mx.symbol.transpose(name='data_nhwc', data=data, axes=(0, 2, 3, 1))
     channel=1*secondary_partition*primary_partition
     
-    data=get_conv('g0', data, kout=channel, kernel=(3, 3), stride=(1, 1), pad=(1, 1))
+    data=get_conv('g0', data, kout=channel, kernel=(3, 3), stride=(1, 1), pad=(1, 1), layout=layout)
 
-    data=get_group('g1', data, num_block=blocks_num[0], kin=channel*1, kout=channel*1, primary_partition=primary_partition,secondary_partition=secondary_partition)
-    data=get_group('g2', data, num_block=blocks_num[1], kin=channel*1, kout=channel*2, primary_partition=primary_partition,secondary_partition=secondary_partition*2)
-    data=get_group('g3', data, num_block=blocks_num[2], kin=channel*2, kout=channel*4, primary_partition=primary_partition,secondary_partition=secondary_partition*4)
+    data=get_group('g1', data, num_block=blocks_num[0], kin=channel*1, kout=channel*1, primary_partition=primary_partition,secondary_partition=secondary_partition, impl=impl, layout=layout, mirror=1 in mirror)
+    data=get_group('g2', data, num_block=blocks_num[1], kin=channel*1, kout=channel*2, primary_partition=primary_partition,secondary_partition=secondary_partition*2, impl=impl, layout=layout, mirror=2 in mirror)
+    data=get_group('g3', data, num_block=blocks_num[2], kin=channel*2, kout=channel*4, primary_partition=primary_partition,secondary_partition=secondary_partition*4, impl=impl, layout=layout, mirror=3 in mirror)
 
-    avg = mx.symbol.Pooling(name='global_pool', data=data, kernel=(8,8), stride=(1, 1), pool_type='avg')
+    avg = mx.symbol.Pooling(name='global_pool', data=data, kernel=(8,8), stride=(1, 1), pool_type='avg', **get_layout('Pooling', layout))
     flatten = mx.sym.Flatten(name="flatten", data=avg)
     fc = mx.symbol.FullyConnected(name='fc_score', data=flatten, num_hidden=num_classes)
     softmax = mx.symbol.SoftmaxOutput(name='softmax', data=fc)
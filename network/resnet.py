@@ -2,42 +2,43 @@
 Resnet 
 '''
 import mxnet as mx
+from common import get_layout
 
-def get_conv(name, data, kout, kernel, stride, pad, relu=True):
+def get_conv(name, data, kout, kernel, stride, pad, relu=True, layout='NCHW'):
     #Conv-BN-ReLU style
-    data=mx.sym.Convolution(name=name+'_conv', data=data, num_filter=kout, kernel=kernel, stride=stride, pad=pad, no_bias=True)   
-    data=mx.sym.BatchNorm(name=name + '_bn', data=data, fix_gamma=False, momentum=0.9, eps=2e-5)
+    data=mx.sym.Convolution(name=name+'_conv', data=data, num_filter=kout, kernel=kernel, stride=stride, pad=pad, no_bias=True, **get_layout('Convolution', layout))
+    data=mx.sym.BatchNorm(name=name + '_bn', data=data, fix_gamma=False, momentum=0.9, eps=2e-5, **get_layout('BatchNorm', layout))
     if relu:
         data=mx.sym.Activation(name=name + '_relu', data=data, act_type='relu')
     return data
 
 
-def get_two(name, data, kin, kout):
-    data = get_conv(name+'_two1', data, kout, kernel=(3, 3), stride=(1,1) if kin==kout else (2, 2), pad=(1, 1))
-    data = get_conv(name+'_two2', data, kout, kernel=(3, 3), stride=(1,1), pad=(1, 1), relu=False)
+def get_two(name, data, kin, kout, layout='NCHW'):
+    data = get_conv(name+'_two1', data, kout, kernel=(3, 3), stride=(1,1) if kin==kout else (2, 2), pad=(1, 1), layout=layout)
+    data = get_conv(name+'_two2', data, kout, kernel=(3, 3), stride=(1,1), pad=(1, 1), relu=False, layout=layout)
     return data
 
 #identity shortcut
-def get_zero(name, data, kin, kout):
+def get_zero(name, data, kin, kout, layout='NCHW'):
     if kin!=kout:
-        data = get_conv(name+'_line', data, kout, kernel=(1, 1), stride=(2, 2), pad=(0, 0), relu=False)
+        data = get_conv(name+'_line', data, kout, kernel=(1, 1), stride=(2, 2), pad=(0, 0), relu=False, layout=layout)
     return data
 
-def get_fusion(name, data, kin, kout):
-    shortcut= get_zero(name+'_p0', data, kin, kout)
-    two = get_two(name+'_p2', data, kin, kout)
+def get_fusion(name, data, kin, kout, layout='NCHW'):
+    shortcut= get_zero(name+'_p0', data, kin, kout, layout=layout)
+    two = get_two(name+'_p2', data, kin, kout, layout=layout)
     #resnet style: identity + two convs
     data = shortcut+two
     data = mx.symbol.Activation(name=name+'_relu', data=data, act_type='relu')
     return data
 
-def get_group(name, data, count, kin, kout):
+def get_group(name, data, count, kin, kout, layout='NCHW'):
     for idx in range(count):
-        data = get_fusion(name=name+'_b%d'%(idx+1), data=data, kin=kin, kout=kout)
+        data = get_fusion(name=name+'_b%d'%(idx+1), data=data, kin=kin, kout=kout, layout=layout)
         kin=kout
     return data
 
-def get_symbol(num_classes, num_depth, primary_partition, secondary_partition=1):
+def get_symbol(num_classes, num_depth, primary_partition, secondary_partition=1, layout='NCHW'):
 	# setup model parameters  
     block_depth =2
     num_groups  =3
@@ -56,14 +57,16 @@ def get_symbol(num_classes, num_depth, primary_partition, secondary_partition=1)
 
 	# start network definition
     data = mx.symbol.Variable(name='data')
+    if layout=='NHWC': #the input stays NCHW
+        data = mx.symbol.transpose(name='data_nhwc', data=data, axes=(0, 2, 3, 1))
     # first convolution
-    data=get_conv('g0', data, kout=num_filters[0], kernel=(3, 3), stride=(1, 1), pad=(1, 1))
+    data=get_conv('g0', data, kout=num_filters[0], kernel=(3, 3), stride=(1, 1), pad=(1, 1), layout=layout)
     # different blocks
-    data=get_group('g1', data, num_blocks[0], num_filters[0], num_filters[1])
-    data=get_group('g2', data, num_blocks[1], num_filters[1], num_filters[2])
-    data=get_group('g3', data, num_blocks[2], num_filters[2], num_filters[3])
+    data=get_group('g1', data, num_blocks[0], num_filters[0], num_filters[1], layout=layout)
+    data=get_group('g2', data, num_blocks[1], num_filters[1], num_filters[2], layout=layout)
+    data=get_group('g3', data, num_blocks[2], num_filters[2], num_filters[3], layout=layout)
     # classification layer
-    avg = mx.sym.Pooling(name='pool', data=data, kernel=(8, 8), stride=(1, 1), pool_type='avg', global_pool=True)
+    avg = mx.sym.Pooling(name='pool', data=data, kernel=(8, 8), stride=(1, 1), pool_type='avg', global_pool=True, **get_layout('Pooling', layout))
     flatten = mx.sym.Flatten(name='flatten', data=avg)
     fc = mx.sym.FullyConnected(name='fc', data=flatten, num_hidden=num_classes)
     softmax = mx.sym.SoftmaxOutput(name='softmax', data=fc)
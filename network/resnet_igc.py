@@ -2,52 +2,62 @@
 Resnet with interleaved group convolutions
 '''
 import mxnet as mx
+from common import get_layout, get_mirror
 
-def get_conv(name, data, kout, kernel, stride, pad, num_group, relu=True):
+def get_conv(name, data, kout, kernel, stride, pad, num_group, relu=True, layout='NCHW'):
     #Conv-BN-ReLU style
-    data=mx.sym.Convolution(name=name+'_conv', data=data, num_filter=kout, kernel=kernel, stride=stride, pad=pad, no_bias=True, num_group=num_group)   
-    data=mx.sym.BatchNorm(name=name + '_bn', data=data, fix_gamma=False, momentum=0.9, eps=2e-5)
+    data=mx.sym.Convolution(name=name+'_conv', data=data, num_filter=kout, kernel=kernel, stride=stride, pad=pad, no_bias=True, num_group=num_group, **get_layout('Convolution', layout))
+    data=mx.sym.BatchNorm(name=name + '_bn', data=data, fix_gamma=False, momentum=0.9, eps=2e-5, **get_layout('BatchNorm', layout))
     if relu:
         data=mx.sym.Activation(name=name + '_relu', data=data, act_type='relu')
     return data
 
-def get_igc(name, data, kout, kernel, stride, pad, primary_partition, secondary_partition, relu=True):
+def get_igc(name, data, kout, kernel, stride, pad, primary_partition, secondary_partition, relu=True, impl='default', layout='NCHW'):
     #Conv-BN-ReLU style
-    data=mx.sym.Convolution(name=name+'_conv1', data=data, num_filter=kout, kernel=kernel, stride=stride, pad=pad, no_bias=True, num_group=primary_partition)
-    data = mx.symbol.Reorder(name=name+'_reorder1', data=data, branch_factor=primary_partition)
-    data=mx.sym.Convolution(name=name+'_conv2', data=data, num_filter=kout, kernel=(1,1), stride=(1,1), pad=(0,0), no_bias=True, num_group=secondary_partition)
-    data = mx.symbol.Reorder(name=name+'_reorder2', data=data, branch_factor=secondary_partition)
-    data=mx.sym.BatchNorm(name=name + '_bn', data=data, fix_gamma=False, momentum=0.9, eps=2e-5)
+    if impl=='fused': #one IGC operator, same weights as the unfused graph
+        data=mx.sym.IGC(name=name+'_igc', data=data, weight1=mx.sym.Variable(name+'_conv1_weight'), weight2=mx.sym.Variable(name+'_conv2_weight'),
+                        num_filter=kout, kernel=kernel, stride=stride, pad=pad, primary_partition=primary_partition, secondary_partition=secondary_partition)
+    else:
+        data=mx.sym.Convolution(name=name+'_conv1', data=data, num_filter=kout, kernel=kernel, stride=stride, pad=pad, no_bias=True, num_group=primary_partition, **get_layout('Convolution', layout))
+        data = mx.symbol.Reorder(name=name+'_reorder1', data=data, branch_factor=primary_partition, **get_layout('Reorder', layout))
+        if impl=='batched': #all groups of the 1x1 convolution as one batched matmul
+            data=mx.sym.GroupPointwise(name=name+'_conv2', data=data, num_filter=kout, num_group=secondary_partition, no_bias=True)
+        else:
+            data=mx.sym.Convolution(name=name+'_conv2', data=data, num_filter=kout, kernel=(1,1), stride=(1,1), pad=(0,0), no_bias=True, num_group=secondary_partition, **get_layout('Convolution', layout))
+        data = mx.symbol.Reorder(name=name+'_reorder2', data=data, branch_factor=secondary_partition, **get_layout('Reorder', layout))
+    data=mx.sym.BatchNorm(name=name + '_bn', data=data, fix_gamma=False, momentum=0.9, eps=2e-5, **get_layout('BatchNorm', layout))
     if relu:
         data=mx.sym.Activation(name=name + '_relu', data=data, act_type='relu')
     return data
 
-def get_two(name, data, kin, kout, primary_partition, secondary_partition):
-    data = get_igc(name+'_two1', data, kout, kernel=(3, 3), stride=(1,1) if kin==kout else (2, 2), pad=(1, 1), primary_partition=primary_partition, secondary_partition=kin/primary_partition)
-    data = get_igc(name+'_two2', data, kout, kernel=(3, 3), stride=(1,1), pad=(1, 1), primary_partition=primary_partition, secondary_partition=kout/primary_partition, relu=False)
+def get_two(name, data, kin, kout, primary_partition, secondary_partition, impl='default', layout='NCHW'):
+    data = get_igc(name+'_two1', data, kout, kernel=(3, 3), stride=(1,1) if kin==kout else (2, 2), pad=(1, 1), primary_partition=primary_partition, secondary_partition=kin/primary_partition, impl=impl, layout=layout)
+    data = get_igc(name+'_two2', data, kout, kernel=(3, 3), stride=(1,1), pad=(1, 1), primary_partition=primary_partition, secondary_partition=kout/primary_partition, relu=False, impl=impl, layout=layout)
     return data
 
 #identity shortcut
-def get_zero(name, data, kin, kout, primary_partition):
+def get_zero(name, data, kin, kout, primary_partition, layout='NCHW'):
     if kin!=kout:
-        data = get_conv(name+'_line', data, kout, kernel=(1, 1), stride=(2, 2), pad=(0, 0),num_group=primary_partition, relu=False)
+        data = get_conv(name+'_line', data, kout, kernel=(1, 1), stride=(2, 2), pad=(0, 0),num_group=primary_partition, relu=False, layout=layout)
     return data
 
-def get_fusion(name, data, kin, kout, primary_partition, secondary_partition):
-    shortcut= get_zero(name+'_p0', data, kin, kout, primary_partition)
-    two = get_two(name+'_p2', data, kin, kout, primary_partition, secondary_partition)
-    #resnet style: identity + two convs
-    data = shortcut+two
+def get_fusion(name, data, kin, kout, primary_partition, secondary_partition, impl='default', layout='NCHW', mirror=False):
+    with get_mirror(mirror): #only the block output is kept with mirror
+        shortcut= get_zero(name+'_p0', data, kin, kout, primary_partition, layout=layout)
+        two = get_two(name+'_p2', data, kin, kout, primary_partition, secondary_partition, impl, layout=layout)
+        #resnet style: identity + two convs
+        data = shortcut+two
     data = mx.symbol.Activation(name=name+'_relu', data=data, act_type='relu')
     return data
 
-def get_group(name, data, count, kin, kout, primary_partition, secondary_partition):
+def get_group(name, data, count, kin, kout, primary_partition, secondary_partition, impl='default', layout='NCHW', mirror=False):
     for idx in range(count):
-        data = get_fusion(name=name+'_b%d'%(idx+1), data=data, kin=kin, kout=kout, primary_partition=primary_partition, secondary_partition=secondary_partition)
+        data = get_fusion(name=name+'_b%d'%(idx+1), data=data, kin=kin, kout=kout, primary_partition=primary_partition, secondary_partition=secondary_partition, impl=impl, layout=layout, mirror=mirror)
         kin=kout
     return data
 
-def get_symbol(num_classes, num_depth, primary_partition, secondary_partition):
+def get_symbol(num_classes, num_depth, primary_partition, secondary_partition, impl='default', layout='NCHW', mirror=()):
+    #mirror: the stages (1, 2, 3) whose blocks recompute their inner activations in backward
 	# setup model parameters  
     block_depth =2
     num_groups  =3
@@ -66,14 +76,17 @@ def get_symbol(num_classes, num_depth, primary_partition, secondary_partition):
 
 	# start network definition
     data = mx.symbol.Variable(name='data')
+    if layout=='NHWC': #the input stays NCHW
+        assert impl=='default', 'the IGC and GroupPointwise operators only support NCHW'
+        data = mx.symbol.transpose(name='data_nhwc', data=data, axes=(0, 2, 3, 1))
     # first convolution
-    data=get_conv('g0', data, kout=num_filters[0], kernel=(3, 3), stride=(1, 1), pad=(1, 1),num_group=1)
+    data=get_conv('g0', data, kout=num_filters[0], kernel=(3, 3), stride=(1, 1), pad=(1, 1),num_group=1, layout=layout)
     # different blocks
-    data=get_group('g1', data, num_blocks[0], num_filters[0], num_filters[1], primary_partition, secondary_partition)
-    data=get_group('g2', data, num_blocks[1], num_filters[1], num_filters[2], primary_partition, secondary_partition)
-    data=get_group('g3', data, num_blocks[2], num_filters[2], num_filters[3], primary_partition, secondary_partition)
+    data=get_group('g1', data, num_blocks[0], num_filters[0], num_filters[1], primary_partition, secondary_partition, impl, layout=layout, mirror=1 in mirror)
+    data=get_group('g2', data, num_blocks[1], num_filters[1], num_filters[2], primary_partition, secondary_partition, impl, layout=layout, mirror=2 in mirror)
+    data=get_group('g3', data, num_blocks[2], num_filters[2], num_filters[3], primary_partition, secondary_partition, impl, layout=layout, mirror=3 in mirror)
     # classification layer
-    avg = mx.sym.Pooling(name='pool', data=data, kernel=(8, 8), stride=(1, 1), pool_type='avg', global_pool=True)
+    avg = mx.sym.Pooling(name='pool', data=data, kernel=(8, 8), stride=(1, 1), pool_type='avg', global_pool=True, **get_layout('Pooling', layout))
     flatten = mx.sym.Flatten(name='flatten', data=avg)
     fc = mx.sym.FullyConnected(name='fc', data=flatten, num_hidden=num_classes)
     softmax = mx.sym.SoftmaxOutput(name='softmax', data=fc)
@@ -1,49 +1,59 @@
 import mxnet as mx
+from common import get_layout, get_mirror
 
-def get_conv(name, data, kout, kernel, stride, pad, primary_partition=1,relu=True):
-    data = mx.symbol.Convolution(name=name+'_conv', data=data, num_filter=kout, kernel=kernel, stride=stride, pad=pad, no_bias=True,num_group=primary_partition)
-    data = mx.symbol.BatchNorm(name=name + '_bn', data=data, fix_gamma=False, momentum=0.9, eps=2e-5)
+def get_conv(name, data, kout, kernel, stride, pad, primary_partition=1,relu=True, layout='NCHW'):
+    data = mx.symbol.Convolution(name=name+'_conv', data=data, num_filter=kout, kernel=kernel, stride=stride, pad=pad, no_bias=True,num_group=primary_partition, **get_layout('Convolution', layout))
+    data = mx.symbol.BatchNorm(name=name + '_bn', data=data, fix_gamma=False, momentum=0.9, eps=2e-5, **get_layout('BatchNorm', layout))
     if relu:
         data=mx.symbol.Activation(name=name + '_relu', data=data, act_type='relu')
     return data
 
-def get_igc(name, data, kout, kernel, stride, pad, primary_partition=1,relu=True):
-    data = mx.symbol.Convolution(name=name+'_conv1', data=data, num_filter=kout, kernel=kernel, stride=stride, pad=pad, no_bias=True,num_group=primary_partition)
-    data = mx.symbol.Reorder(name=name+'_reorder1', data=data, branch_factor=primary_partition)
-    data = mx.symbol.Convolution(name=name+'_conv2', data=data, num_filter=kout, kernel=(1,1), stride=(1,1), pad=(0,0), no_bias=True,num_group=kout/primary_partition)
-    data = mx.symbol.Reorder(name=name+'_reorder2', data=data, branch_factor=kout/primary_partition)
-    data = mx.symbol.BatchNorm(name=name + '_bn', data=data, fix_gamma=False, momentum=0.9, eps=2e-5)
+def get_igc(name, data, kout, kernel, stride, pad, primary_partition=1,relu=True, impl='default', layout='NCHW'):
+    if impl=='fused': #one IGC operator, same weights as the unfused graph
+        data = mx.symbol.IGC(name=name+'_igc', data=data, weight1=mx.symbol.Variable(name+'_conv1_weight'), weight2=mx.symbol.Variable(name+'_conv2_weight'),
+                             num_filter=kout, kernel=kernel, stride=stride, pad=pad, primary_partition=primary_partition, secondary_partition=kout/primary_partition)
+    else:
+        data = mx.symbol.Convolution(name=name+'_conv1', data=data, num_filter=kout, kernel=kernel, stride=stride, pad=pad, no_bias=True,num_group=primary_partition, **get_layout('Convolution', layout))
+        data = mx.symbol.Reorder(name=name+'_reorder1', data=data, branch_factor=primary_partition, **get_layout('Reorder', layout))
+        if impl=='batched': #all groups of the 1x1 convolution as one batched matmul
+            data = mx.symbol.GroupPointwise(name=name+'_conv2', data=data, num_filter=kout, num_group=kout/primary_partition, no_bias=True)
+        else:
+            data = mx.symbol.Convolution(name=name+'_conv2', data=data, num_filter=kout, kernel=(1,1), stride=(1,1), pad=(0,0), no_bias=True,num_group=kout/primary_partition, **get_layout('Convolution', layout))
+        data = mx.symbol.Reorder(name=name+'_reorder2', data=data, branch_factor=kout/primary_partition, **get_layout('Reorder', layout))
+    data = mx.symbol.BatchNorm(name=name + '_bn', data=data, fix_gamma=False, momentum=0.9, eps=2e-5, **get_layout('BatchNorm', layout))
     if relu:
         data=mx.symbol.Activation(name=name + '_relu', data=data, act_type='relu')
     return data
 
-def get_deep(name, data, kin, kout, stride,primary_partition,relu=False):
-    data = get_igc(name=name+'_igc1', data=data, kout=kout, kernel=(3, 3), stride=stride, pad=(1, 1),primary_partition=primary_partition)
-    data = get_igc(name=name+'_igc2', data=data, kout=kout, kernel=(3, 3), stride=(1, 1), pad=(1, 1),primary_partition=primary_partition, relu=False)
+def get_deep(name, data, kin, kout, stride,primary_partition,relu=False, impl='default', layout='NCHW'):
+    data = get_igc(name=name+'_igc1', data=data, kout=kout, kernel=(3, 3), stride=stride, pad=(1, 1),primary_partition=primary_partition, impl=impl, layout=layout)
+    data = get_igc(name=name+'_igc2', data=data, kout=kout, kernel=(3, 3), stride=(1, 1), pad=(1, 1),primary_partition=primary_partition, relu=False, impl=impl, layout=layout)
     return data
     
-def get_shortcut(name, data, kin, kout, stride,primary_partition):
+def get_shortcut(name, data, kin, kout, stride,primary_partition, layout='NCHW'):
     if kin==kout:
         shortcut = data
     else:
-        shortcut = get_conv(name=name+'_proj', data=data, kout=kout, kernel=(1, 1), stride=stride, pad=(0, 0), primary_partition=primary_partition, relu=False)
+        shortcut = get_conv(name=name+'_proj', data=data, kout=kout, kernel=(1, 1), stride=stride, pad=(0, 0), primary_partition=primary_partition, relu=False, layout=layout)
     return shortcut
     
-def get_fusion(name, data, kin, kout, stride, primary_partition):
-    shortcut= get_shortcut(name, data, kin, kout, stride, primary_partition=primary_partition)
-    deep   = get_deep(name, data, kin, kout, stride, primary_partition=primary_partition)
-    fusion = shortcut + deep
+def get_fusion(name, data, kin, kout, stride, primary_partition, impl='default', layout='NCHW', mirror=False):
+    with get_mirror(mirror): #only the block output is kept with mirror
+        shortcut= get_shortcut(name, data, kin, kout, stride, primary_partition=primary_partition, layout=layout)
+        deep   = get_deep(name, data, kin, kout, stride, primary_partition=primary_partition, impl=impl, layout=layout)
+        fusion = shortcut + deep
     fusion = mx.symbol.Activation(name=name+'_relu', data=fusion, act_type='relu')
     return fusion
 
-def get_group(name,data,num_block,kin,kout,stride, primary_partition):
+def get_group(name,data,num_block,kin,kout,stride, primary_partition, impl='default', layout='NCHW', mirror=False):
     for idx in range(num_block):
-        data = get_fusion(name=name+'_b%d'%(idx+1), data=data, kin=kin, kout=kout, stride= stride if idx == 0 else (1, 1), primary_partition=primary_partition)
+        data = get_fusion(name=name+'_b%d'%(idx+1), data=data, kin=kin, kout=kout, stride= stride if idx == 0 else (1, 1), primary_partition=primary_partition, impl=impl, layout=layout, mirror=mirror)
         kin=kout
     return data
 
 
-def get_symbol(num_classes=1000, net_depth=18, primary_partition=1, secondary_partition=1):
+def get_symbol(num_classes=1000, net_depth=18, primary_partition=1, secondary_partition=1, impl='default', layout='NCHW', mirror=()):
+    #mirror: the stages (1, 2, 3, 4) whose blocks recompute their inner activations in backward
     # setup model parameters
     model_cfgs = {
         18: (2,2,2,2)
@@ -53,16 +63,19 @@ def get_symbol(num_classes=1000, net_depth=18, primary_partition=1, secondary_pa
     
     # start network definition
     data = mx.symbol.Variable(name='data')
+    if layout=='NHWC': #the input stays NCHW
+        assert impl=='default', 'the IGC and GroupPointwise operators only support NCHW'
+        data = mx.symbol.transpose(name='data_nhwc', data=data, axes=(0, 2, 3, 1))
     # stage conv1_x
-    conv1 = get_conv(name='g0', data=data, kout=channels, kernel=(7, 7), stride=(2, 2), pad=(3, 3))
-    pool1 = mx.symbol.Pooling(name='g0_pool', data=conv1, kernel=(3, 3), stride=(2, 2), pad=(1, 1), pool_type='max')
+    conv1 = get_conv(name='g0', data=data, kout=channels, kernel=(7, 7), stride=(2, 2), pad=(3, 3), layout=layout)
+    pool1 = mx.symbol.Pooling(name='g0_pool', data=conv1, kernel=(3, 3), stride=(2, 2), pad=(1, 1), pool_type='max', **get_layout('Pooling', layout))
     # stage conv2_x, conv3_x, conv4_x, conv5_x
-    conv2_x=get_group(name='g1', data=pool1  , num_block=blocks_num[0], kin=channels,  kout=channels*2, stride=(1,1),primary_partition=primary_partition)
-    conv3_x=get_group(name='g2', data=conv2_x, num_block=blocks_num[1], kin=channels*2, kout=channels*4, stride=(2,2), primary_partition=primary_partition*2)
-    conv4_x=get_group(name='g3', data=conv3_x, num_block=blocks_num[2], kin=channels*4, kout=channels*8, stride=(2,2), primary_partition=primary_partition*4)
-    conv5_x=get_group(name='g4', data=conv4_x, num_block=blocks_num[3], kin=channels*8, kout=channels*16, stride=(2,2), primary_partition=primary_partition*8)
+    conv2_x=get_group(name='g1', data=pool1  , num_block=blocks_num[0], kin=channels,  kout=channels*2, stride=(1,1),primary_partition=primary_partition, impl=impl, layout=layout, mirror=1 in mirror)
+    conv3_x=get_group(name='g2', data=conv2_x, num_block=blocks_num[1], kin=channels*2, kout=channels*4, stride=(2,2), primary_partition=primary_partition*2, impl=impl, layout=layout, mirror=2 in mirror)
+    conv4_x=get_group(name='g3', data=conv3_x, num_block=blocks_num[2], kin=channels*4, kout=channels*8, stride=(2,2), primary_partition=primary_partition*4, impl=impl, layout=layout, mirror=3 in mirror)
+    conv5_x=get_group(name='g4', data=conv4_x, num_block=blocks_num[3], kin=channels*8, kout=channels*16, stride=(2,2), primary_partition=primary_partition*8, impl=impl, layout=layout, mirror=4 in mirror)
     
-    avg = mx.symbol.Pooling(name='global_pool', data=conv5_x, kernel=(7, 7), stride=(1, 1), pool_type='avg')
+    avg = mx.symbol.Pooling(name='global_pool', data=conv5_x, kernel=(7, 7), stride=(1, 1), pool_type='avg', global_pool=True, **get_layout('Pooling', layout))
     flatten = mx.sym.Flatten(name="flatten", data=avg)
     fc = mx.symbol.FullyConnected(name='fc_score', data=flatten, num_hidden=num_classes)
     softmax = mx.symbol.SoftmaxOutput(name='softmax', data=fc)
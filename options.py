@@ -10,13 +10,21 @@ import numpy as np
 import utility
 
 def get_network(args):
-    import importlib
     import sys
-    sys.path.insert(0,'network')
-    net_module= importlib.import_module(args.network)
-    network= net_module.get_symbol(args.num_classes, args.depth, args.primary_partition, args.secondary_partition)
+    kwargs={'impl':args.igc_impl} if args.igc_impl!='default' else {} #only the igc networks accept `impl`
+    if args.layout!='NCHW':
+        kwargs['layout']=args.layout
+    if args.mirror:
+        kwargs['mirror']=tuple(int(stage) for stage in args.mirror.split(','))
     data_shape=(1, 3, args.data_shape, args.data_shape)
-    logging.warning('network parameters: %s',utility.cal_params(network,input_shapes={"data":data_shape}))
+    network, shapes, _= utility.load_network(args.network, (args.num_classes, args.depth, args.primary_partition, args.secondary_partition),
+                                              kwargs, data_shape, args.network_cache)
+    if args.compose_reorder:
+        sys.path.insert(0,'tools')
+        from compose_reorder import compose_symbol
+        network, _= compose_symbol(network)
+    network= utility.cast_network(network, args.dtype, args.loss_scale)
+    logging.warning('network parameters: %s',utility.cal_params(network, shapes=shapes)) #neither pass changes the weights
     return network
     
 #parse the arguments
@@ -30,7 +38,7 @@ def __dataset_args(args):
     if args.dataset=='cifar10':
         args.mean_rgb=[125.307, 122.950, 113.865]
         args.std_rgb=[62.993, 62.089, 66.705]
-        args.test_batch_size=400 if args.batch_size<400 else args.batch_size #mxnet issues: test_batch>=train_batch
+        args.test_batch_size=400
     elif args.dataset=='cifar100':
         args.num_classes=100
         args.mean_rgb=[129.304, 124.070, 112.434]
@@ -41,7 +49,7 @@ def __dataset_args(args):
         args.mean_rgb=[111.609, 113.161, 120.565]
         args.std_rgb=[50.498, 51.259, 50.244]
         args.aug_type=0 #no data augmentation
-        args.test_batch_size=280 if args.batch_size<280 else args.batch_size #26032 test images
+        args.test_batch_size=280 #26032 test images
     elif args.dataset=='imagenet': #TODO: imagenet training
         args.num_epochs=100
         args.data_shape=224
@@ -50,11 +58,16 @@ def __dataset_args(args):
         args.mean_rgb=[123.370, 112.757, 99.406] #calculated on the resized training data (short side = 480)
         args.std_rgb=[68.998, 66.093, 68.292]
         args.aug_type=2 #extreme data augmentation
-        args.test_batch_size=200 if args.batch_size<200 else args.batch_size
+        args.test_batch_size=200
     if args.data_dir is None:
         args.data_dir='../../../dataset/'+args.dataset+'/'
 
 def __logging_args(args):
+    #dist kvstores connect to the scheduler here, the rank of the worker is known from now on
+    args.kvstore=mx.kvstore.create(args.kv_store)
+    rank=args.kvstore.rank
+    #workers of a distributed job share the run name picked by rank 0
+    shared_name='dist' in args.kv_store and args.model_prefix is None
     #make directories
     args.log_dir+=args.dataset+'_noaug/' if args.aug_type==0 else args.dataset+'/'
     logfile_name='%s_d%dL%dM%d'%(args.network,args.depth,args.primary_partition,args.secondary_partition)
@@ -62,10 +75,12 @@ def __logging_args(args):
     if args.model_prefix is None:
         args.model_prefix=args.log_dir+args.network+'/'
         logfile_name+='_exp' if args.exp_name is None else '_'+args.exp_name
+        if shared_name and rank>0:
+            args.kvstore._barrier() #rank 0 has created the log file
         random_idx=1
         while os.path.isfile(args.model_prefix+logfile_name+str(random_idx)+'.txt'):
             random_idx+=1
-        if args.load_epoch is not None: #deprecated. Use `--model-prefix` to manually set the name
+        if args.load_epoch is not None or (shared_name and rank>0): #deprecated. Use `--model-prefix` to manually set the name
         	random_idx-=1
         logfile_name+=str(random_idx)
     #model related
@@ -74,13 +89,19 @@ def __logging_args(args):
     if args.rand_seed is None:
         import time     
         args.rand_seed=int(time.time()) #different random init for serveral runs
+        if 'dist' in args.kv_store: #the seed of rank 0, the workers shuffle the data with the same permutation
+            seed=mx.nd.array([args.rand_seed%(1<<24)]) #exact in float32
+            args.kvstore.init('rand_seed', seed)
+            args.kvstore.pull('rand_seed', out=seed)
+            args.rand_seed=int(seed.asscalar())
     mx.random.seed(args.rand_seed)      #cudnn conv backward is non-deterministic
     #logging
     log_file_full_name = args.model_prefix+logfile_name+'.txt'
+    args.log_file=log_file_full_name
     args.model_prefix+='weights/'+logfile_name+'/'
     utility.mkdir(args.model_prefix)
     args.model_prefix+=logfile_name
-    head = '%(asctime)-15s %(message)s'
+    head = '%(asctime)-15s %(message)s' if 'dist' not in args.kv_store else '%(asctime)-15s Node['+str(rank)+'] %(message)s'
     logger = logging.getLogger()
     map(logger.removeHandler, logger.handlers[:]) #reset
     handler = logging.FileHandler(log_file_full_name)
@@ -91,6 +112,8 @@ def __logging_args(args):
     handler.setFormatter(formatter)
     logger.addHandler(handler)
     logger.setLevel(logging.DEBUG)
+    if shared_name and rank==0:
+        args.kvstore._barrier()
     logger.info('%s',log_file_full_name)
     logger.info('start with arguments %s', args)
 
@@ -100,17 +123,13 @@ def __training_args(args):
     else:
         args.lr_steps=[int(v) for v in args.lr_steps.split(',')]
     if args.load_epoch is not None:
-        tmp = mx.model.FeedForward.load(args.model_prefix, args.load_epoch)
-        args.model_args = { 'arg_params': tmp.arg_params,
-                            'aux_params': tmp.aux_params,
+        _, arg_params, aux_params = mx.model.load_checkpoint(args.model_prefix, args.load_epoch)
+        args.model_args = { 'arg_params': arg_params,
+                            'aux_params': aux_params,
                             'begin_epoch': args.load_epoch}
-        origin_step=args.lr_steps[:]
-        args.lr_steps=[]
-        for tmp_lr in origin_step:
-            if tmp_lr<=args.load_epoch:
-                args.lr*=args.lr_factor
-            else:
-                args.lr_steps.append(tmp_lr-args.load_epoch)
+        states='%s-%04d.states'%(args.model_prefix, args.load_epoch)
+        if os.path.isfile(states): #optimizer states of engine.Checkpoint
+            args.model_args['optimizer_states']=states
     #gpus
     logging.info("Using gpus %s from:\n%s",args.gpus, os.popen("nvidia-smi -L").read())
     logging.info('training strategy: lr=%f, step=%s',args.lr,args.lr_steps)
@@ -124,14 +143,24 @@ def get_args(argv,parse=True):
     parser.add_argument('--dataset', type=str, default='cifar10', choices=['cifar10','cifar100','svhn', 'imagenet'], help='dataset name')
     parser.add_argument('--secondary-partition', type=int, default=1, help='secondary partition number')
     parser.add_argument('--primary-partition', type=int, default=1, help='primary partition number')
+    parser.add_argument('--igc-impl', type=str, default='default', choices=['default','batched','fused'],
+                        help='igc block implementation: Convolution/Reorder nodes, GroupPointwise for the 1x1 group convolution, or one fused IGC operator (the last two are cpu only)')
+    parser.add_argument('--compose-reorder', action='store_true', help='cancel Reorder operators against each other across channel-wise layers before training')
+    parser.add_argument('--layout', type=str, default='NCHW', choices=['NCHW','NHWC'], help='layout of the feature maps inside the network, the input data stays NCHW')
+    parser.add_argument('--mirror', type=str, help='stages whose igc blocks recompute their activations in backward to save memory, e.g., --mirror=1,2')
+    parser.add_argument('--network-cache', type=str, default='./cache/network/', help='directory caching built symbols and parameter shapes, empty to disable')
     #for logging experiments
     parser.add_argument('--log-dir', type=str, default='./snapshot/', help='directory of the log file')
     parser.add_argument('--exp-name', type=str, help='experiment description for logging same network')
     parser.add_argument('--checkpoint-epochs', type=int, help='save the model every N epochs')  
     parser.add_argument('--log-iters', type=int, default=50, help='logging info every N iterations')  
+    parser.add_argument('--phase-timing', action='store_true', help='log the time of data, forward, backward, update, metric and checkpoint, also to <model prefix>-phases.json')
+    parser.add_argument('--profile', type=str, help='profile the batches BEGIN+1 to END of the first epoch by igc block, e.g., --profile=20,30, writes <model prefix>-profile.txt and -profile.json')
     #training strategy
-    parser.add_argument('--gpus', type=str, default='0,1', help='the gpus will be used, e.g., --gpus=0,1')
+    parser.add_argument('--gpus', type=str, default='0,1', help='the gpus will be used, e.g., --gpus=0,1, empty for the cpu')
     parser.add_argument('--batch-size', type=int, default=64, help='the training batch size')
+    parser.add_argument('--accumulate', type=int, default=1, help='sum the gradients of N batches before every update, the effective batch size is N*batch-size')
+    parser.add_argument('--fused-update', action='store_true', help='update all parameters at once in flat buffers, float32 and a sync kvstore only')
     parser.add_argument('--test-batch-size', type=int, default=400, help='the testing batch size')
     parser.add_argument('--num-epochs', type=int, default=400, help='the number of training epochs')  
     parser.add_argument('--rand-seed', type=int, help='None for different random seed for each run')    
@@ -139,6 +168,8 @@ def get_args(argv,parse=True):
     parser.add_argument('--lr', type=float, default=0.1, help='the initial learning rate')
     parser.add_argument('--lr-factor', type=float, default=0.1, help='reduce the lr by a factor')
     parser.add_argument('--lr-steps', type=str, help='reduce the lr by a factor e.g., --lr-steps=100,150')
+    parser.add_argument('--lr-batch-size', type=int, help='the batch size --lr is given for, scaled linearly to the effective batch size of all workers')
+    parser.add_argument('--warmup-epochs', type=int, default=0, help='grow the lr linearly to the scaled lr over N epochs, from --lr if --lr-batch-size raises it, else from a tenth')
     #dataset locations
     parser.add_argument('--data-dir', type=str, help='the input data directory')
     parser.add_argument('--train-dataset', type=str, default="train.rec", help='train dataset name')
@@ -149,13 +180,25 @@ def get_args(argv,parse=True):
     parser.add_argument('--data-shape', type=int, default=32, help='set image\'s shape')
     parser.add_argument('--mean-rgb', type=list, default=[127, 127, 127], help='image mean values')
     parser.add_argument('--std-rgb', type=list, default=[60, 60, 60], help='image std values')
+    parser.add_argument('--data-cache', action='store_true', help='decode the .rec files once into memory-mapped arrays (next to them) and augment batches with numpy')
+    parser.add_argument('--data-index', action='store_true', help='read the .rec files by random access through their .idx (built if missing), shuffled globally every epoch')
+    parser.add_argument('--data-threads', type=int, default=4, help='threads augmenting each batch with --data-cache')
     parser.add_argument('--aug-type', type=int, default=1, choices=[0,1,2], help='data augmentation type: 0 (no aug), 1 (+), 2 (++)')
     #retrain
     parser.add_argument('--model-prefix', type=str, help='the prefix of the model to load')
     parser.add_argument('--load-epoch', type=int, help="load the model on an epoch using the model-prefix")
     parser.add_argument('--model-args', type=dict, default={}, help="internal usage for loading model")
     #mxnet for multi-gpu update
-    parser.add_argument('--kv-store', type=str, default='device', help='the kvstore type in mxnet')
+    parser.add_argument('--kv-store', type=str, default='device', help='the kvstore type in mxnet, dist_sync or dist_async with tools/launch.py')
+    parser.add_argument('--gc-type', type=str, default='none', choices=['none','2bit'], help='gradient compression of the kvstore')
+    parser.add_argument('--gc-threshold', type=float, default=0.5, help='the threshold of 2bit gradient compression')
+    #validation
+    parser.add_argument('--async-val', action='store_true', help='evaluate the checkpoints in a separate process instead of at the end of every epoch')
+    parser.add_argument('--val-gpus', type=str, help='the gpu of the validation process, cpu if not given')
+    parser.add_argument('--val-cores', type=str, help='cpu cores of the validation process, e.g., --val-cores=28,29,30,31')
+    #mixed precision
+    parser.add_argument('--dtype', type=str, default='float32', choices=['float32','float16'], help='data type of the activations and weights in the executors')
+    parser.add_argument('--loss-scale', type=float, default=1.0, help='multiply the loss gradient to keep float16 gradients in range, e.g., --loss-scale=128')
     args = parser.parse_args(argv)
     #parse arguments
     parse_args(args,parse)
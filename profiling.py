@@ -0,0 +1,212 @@
+'''
+Operator profile of the igc networks aggregated by stage and block.
+The layer names encode the position in the network, e.g. g2_b3_p2_two1_conv1 is a layer of block 3
+of stage 2, and the end of the name the part of the interleaved group convolution: the primary
+(group) convolution _conv1, the secondary convolution _conv2, _reorder1/_reorder2 and _bn.
+MXNet profiles the operators of an executor by type only, so the k-th event of a type on a device
+is given to the k-th layer of that type of a batch (in reverse order for the _backward_ events);
+types whose events do not add up to whole batches (the optimizer, layers recomputed by --mirror,
+backward operators of another name) are reported apart. With several engine threads, independent
+layers of the same type may be swapped, which stays within a block for the igc networks.
+Contact: Liming Zhao (zlmzju@gmail.com)
+'''
+import mxnet as mx
+import numpy as np
+import json
+import logging
+import os
+import re
+import time
+
+PARTS=['conv1', 'conv2', 'reorder', 'bn', 'other']
+#the fused IGC operator is counted as the primary convolution
+PART_PATTERNS=[('conv1', re.compile(r'_(conv1|igc)$')), ('conv2', re.compile(r'_conv2$')),
+               ('reorder', re.compile(r'_reorder\d*$')), ('bn', re.compile(r'_bn$'))]
+BLOCK_PATTERN=re.compile(r'^(g\d+)(?:_(b\d+))?_')
+#backward operators not named after their forward operator
+BACKWARD={'_backward_add': 'elemwise_add'}
+
+def get_nodes(symbol):
+    """(name, op, block, part) of the operator nodes of `symbol` in topological order.
+    Nodes of generated names, e.g. the residual additions, belong to the block of their last input."""
+    nodes=json.loads(symbol.tojson())['nodes']
+    blocks={}
+    result=[]
+    for i, node in enumerate(nodes):
+        if node['op']=='null':
+            continue
+        match=BLOCK_PATTERN.match(node['name'])
+        if match:
+            block='_'.join(g for g in match.groups() if g)
+        elif node['name'].startswith('_'):
+            owners=[blocks[j] for j in sorted(j for j, _, _ in node['inputs']) if j in blocks]
+            block=owners[-1] if owners else 'other'
+        else:
+            block='other' #input transpose, pooling, classifier, loss
+        blocks[i]=block
+        part=next((p for p, pattern in PART_PATTERNS if pattern.search(node['name'])), 'other')
+        result.append((node['name'], node['op'], block, part))
+    return result
+
+def get_activations(symbol, data_shape):
+    """Bytes of the float32 outputs of every node for a batch of `data_shape`"""
+    internals=symbol.get_internals()
+    _, shapes, _=internals.infer_shape(data=data_shape)
+    result={}
+    for name, shape in zip(internals.list_outputs(), shapes):
+        node=re.sub(r'_output\d*$', '', name)
+        result[node]=result.get(node, 0)+4*int(np.prod(shape))
+    return result
+
+def read_trace(filename):
+    """The operator events of a chrome trace of mx.profiler sorted by time, as
+    (device, op, begin, duration, raw events) with times in microseconds"""
+    with open(filename) as f:
+        trace=json.load(f)
+    opened={}
+    events=[]
+    for e in trace['traceEvents']:
+        if e.get('cat')!='operator':
+            continue
+        if e['ph']=='X':
+            events.append((e['pid'], e['name'], e['ts'], e['dur'], [e]))
+        elif e['ph']=='B':
+            opened[(e['pid'], e['tid'], e['name'])]=e
+        elif e['ph']=='E':
+            begin=opened.pop((e['pid'], e['tid'], e['name']), None)
+            if begin is not None:
+                events.append((e['pid'], e['name'], begin['ts'], e['ts']-begin['ts'], [begin, e]))
+    events.sort(key=lambda e: e[2])
+    return trace, events
+
+def attribute(nodes, events, batches):
+    """The node name of every event, None for the events which do not add up to whole batches"""
+    by_op={}
+    for name, op, _, _ in nodes:
+        by_op.setdefault(op, []).append(name)
+    def candidates(op):
+        if op in by_op:
+            return by_op[op]
+        if op.startswith('_backward_'):
+            return by_op.get(BACKWARD.get(op, op[len('_backward_'):]), [])[::-1]
+        return []
+    counts={}
+    for device, op, _, _, _ in events:
+        counts[(device, op)]=counts.get((device, op), 0)+1
+    seen={}
+    owners=[]
+    for device, op, _, _, _ in events:
+        names=candidates(op)
+        if not names or counts[(device, op)]!=batches*len(names):
+            owners.append(None)
+            continue
+        k=seen.get((device, op), 0)
+        seen[(device, op)]=k+1
+        owners.append(names[k%len(names)])
+    return owners
+
+def format_table(nodes, events, owners, batches, step_time, activations=None):
+    """Time per batch and device of every block and stage, its share of the step time and the
+    share of each part in it, and the activation memory of the batch"""
+    info=dict((name, (block, part)) for name, _, block, part in nodes)
+    #rows of the devices running the network, not e.g. the pinned memory copies
+    devices=max(len(set(e[0] for e, owner in zip(events, owners) if owner is not None)), 1)
+    scale=1.0/(batches*devices*1000.0) #us of all batches and devices to ms per batch
+    order=[]
+    times={}
+    unattributed={}
+    for (_, op, _, duration, _), owner in zip(events, owners):
+        if owner is None:
+            unattributed[op]=unattributed.get(op, 0)+duration
+            continue
+        block, part=info[owner]
+        if block not in times:
+            order.append(block)
+            times[block]=dict.fromkeys(PARTS, 0.0)
+        times[block][part]+=duration
+    memory={}
+    for name, _, block, _ in nodes:
+        memory[block]=memory.get(block, 0)+(activations or {}).get(name, 0)
+    stages=[]
+    for block in order:
+        stage=block.split('_')[0]
+        if '_' in block and stage+' total' not in times:
+            stages.append(stage)
+            times[stage+' total']=dict.fromkeys(PARTS, 0.0)
+            memory[stage+' total']=0
+        if '_' in block:
+            for part in PARTS:
+                times[stage+' total'][part]+=times[block][part]
+            memory[stage+' total']+=memory.get(block, 0)
+    rows=[]
+    for block in order+[stage+' total' for stage in stages]:
+        total=sum(times[block].values())
+        rows.append([block, '%.3f'%(total*scale), '%.1f'%(100.0*total*scale/(step_time*1000.0))]+
+                    ['%.0f'%(100.0*times[block][part]/total if total else 0) for part in PARTS]+
+                    ['%.1f'%(memory.get(block, 0)/1024.0**2)])
+    for op in sorted(unattributed, key=unattributed.get, reverse=True):
+        rows.append(['[%s]'%op, '%.3f'%(unattributed[op]*scale), '%.1f'%(100.0*unattributed[op]*scale/(step_time*1000.0))]+['']*(len(PARTS)+1))
+    head=['block', 'ms/batch', 'step %']+['%s %%'%part for part in PARTS]+['activations (MB)']
+    lines=['step time %.3f ms over %d batches, %d device(s)'%(step_time*1000.0, batches, devices), '\t'.join(head)]
+    return '\n'.join(lines+['\t'.join(row) for row in rows])
+
+class BlockProfiler(object):
+    """Batch end callback running mx.profiler over the batches `begin` to `end` of the first epoch.
+    It writes <prefix>-profile.json, the chrome trace (chrome://tracing) with the operators named
+    after their layers, and <prefix>-profile.txt, the table of format_table, which is also logged.
+    The executors bound afterwards do not bulk their operators, so every operator is visible.
+    """
+    def __init__(self, symbol, data_shape, prefix, begin, end):
+        assert 0<begin<end, 'the profiled batches are begin+1 to end'
+        os.environ['MXNET_EXEC_BULK_EXEC_TRAIN']='0'
+        self.symbol=symbol
+        self.data_shape=data_shape
+        self.prefix=prefix
+        self.begin=begin
+        self.end=end
+        self.tic=None
+        self.done=False
+
+    def __call__(self, param):
+        #the trainer has queued the next batch when it calls back, waitall makes the window whole batches
+        if self.done:
+            return
+        if param.nbatch==self.begin:
+            mx.nd.waitall()
+            mx.profiler.set_config(profile_symbolic=True, profile_imperative=True, profile_memory=False,
+                                   profile_api=False, filename=self.prefix+'-profile.json')
+            mx.profiler.set_state('run')
+            self.tic=time.time()
+        elif param.nbatch==self.end and self.tic is not None:
+            mx.nd.waitall()
+            step_time=(time.time()-self.tic)/(self.end-self.begin)
+            mx.profiler.set_state('stop')
+            mx.profiler.dump()
+            self.done=True
+            self.write(step_time)
+
+    def write(self, step_time):
+        batches=self.end-self.begin
+        nodes=get_nodes(self.symbol)
+        trace, events=read_trace(self.prefix+'-profile.json')
+        owners=attribute(nodes, events, batches)
+        info=dict((name, (op, block, part)) for name, op, block, part in nodes)
+        renamed={}
+        for event, owner in zip(events, owners):
+            if owner is not None:
+                _, block, part=info[owner]
+                name=owner if not event[1].startswith('_backward_') else owner+'_backward'
+                for e in event[4]:
+                    renamed[(e['tid'], e['ts'], e['ph'].lower(), e['name'])]=(name, {'op': event[1], 'block': block, 'part': part})
+        #the async copies of the events in the operator row share their thread and times
+        for e in trace['traceEvents']:
+            key=(e.get('tid'), e.get('ts'), e.get('ph', '').lower(), e.get('name'))
+            if e.get('cat')=='operator' and key in renamed:
+                e['name'], e['args']=renamed[key]
+        with open(self.prefix+'-profile.json', 'w') as f:
+            json.dump(trace, f)
+        table=format_table(nodes, events, owners, batches, step_time, get_activations(self.symbol, self.data_shape))
+        with open(self.prefix+'-profile.txt', 'w') as f:
+            f.write(table+'\n')
+        logging.info('profile of batches %d to %d, %s-profile.json in chrome://tracing:\n%s',
+                     self.begin+1, self.end, self.prefix, table)
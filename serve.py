@@ -0,0 +1,372 @@
+'''
+Inference server with dynamic batching for trained models, e.g., models/IGC-L16M16_ImageNet with its params.
+Requests are HTTP POSTs to /predict on --port or on the Unix socket --socket, carrying a jpeg/png image
+(decoded, resized, center cropped and normalized like the ImageNet validation images), a .npy array
+(Content-Type: application/x-npy) or raw float32 data (application/octet-stream) of preprocessed NCHW images.
+The answer is the --top-k classes and probabilities of every image, as json.
+
+Concurrent requests are queued and grouped into batches of at most --max-batch-size images; a batch
+leaves once it is full or its oldest request has waited --max-delay ms. --instances executor processes,
+each pinned to its own --cores-per-instance cores, take the batches as they become idle. Every instance
+binds one executor per power of two batch size up to --max-batch-size, sharing the memory of the largest.
+GET /stats returns the counters: requests, images, batches, mean batch size, throughput and the latency
+percentiles of the last --window requests, which are also logged every --report seconds.
+
+Usage: python serve.py --model-prefix=<prefix> --load-epoch=<epoch> --data-shape=224 --instances=2 --max-batch-size=16 --max-delay=5
+       curl --data-binary @cat.jpg -H 'Content-Type: image/jpeg' http://localhost:8080/predict
+'''
+import mxnet as mx
+import numpy as np
+import argparse
+import io
+import json
+import logging
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+from multiprocessing import cpu_count
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn, TCPServer
+    from urlparse import urlparse
+except ImportError:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn, TCPServer
+    from urllib.parse import urlparse
+import dataset
+
+#z-score of train_imagenet.py, --fb-mean selects the second one
+MEAN_STD={False: ([123.370, 112.757, 99.406], [68.998, 66.093, 68.292]),
+          True: ([123.675, 116.280, 103.530], [58.395, 57.12, 57.375])}
+
+def buckets(max_batch_size):
+    """Batch sizes of the executors of an instance"""
+    sizes=[]
+    size=1
+    while size<max_batch_size:
+        sizes.append(size)
+        size*=2
+    return sizes+[max_batch_size]
+
+def worker(config):
+    """Executor process: runs the batch of the first n rows of its input buffer for every `n` read on
+    stdin and answers `done` once the outputs are in its output buffer"""
+    dataset.pin(config['cores'])
+    max_batch_size=config['max_batch_size']
+    shape=(max_batch_size,)+tuple(config['data_shape'])
+    data=np.memmap(config['ring']+'.data', dtype=np.float32, mode='r+', shape=shape)
+    output=np.memmap(config['ring']+'.output', dtype=np.float32, mode='r+', shape=(max_batch_size, config['num_outputs']))
+    symbol, arg_params, aux_params=mx.model.load_checkpoint(config['prefix'], config['epoch'])
+    exe=symbol.simple_bind(ctx=mx.cpu(), grad_req='null', data=shape)
+    exe.copy_params_from(arg_params, aux_params, allow_extra_params=True)
+    executors=dict((size, exe if size==max_batch_size else exe.reshape(partial_shaping=True, data=(size,)+shape[1:]))
+                   for size in buckets(max_batch_size))
+    sys.stdout.write('ready\n')
+    sys.stdout.flush()
+    for line in iter(sys.stdin.readline, ''):
+        num=int(line)
+        size=min(s for s in executors if s>=num)
+        executors[size].arg_dict['data'][:]=data[:size]
+        executors[size].forward(is_train=False)
+        output[:num]=executors[size].outputs[0].asnumpy()[:num].reshape(num, -1)
+        sys.stdout.write('done\n')
+        sys.stdout.flush()
+
+class Request(object):
+    def __init__(self, data):
+        self.data=data
+        self.arrival=time.time()
+        self.done=threading.Event()
+        self.output=None
+        self.error=None
+
+class Batcher(object):
+    """Queue of the requests, handed out in batches of at most `max_batch_size` images once full
+    or once the oldest request has waited `max_delay` seconds"""
+    def __init__(self, max_batch_size, max_delay):
+        self.max_batch_size=max_batch_size
+        self.max_delay=max_delay
+        self.queue=deque()
+        self.cond=threading.Condition()
+
+    def submit(self, request):
+        with self.cond:
+            self.queue.append(request)
+            self.cond.notify_all()
+
+    def __len__(self):
+        return len(self.queue)
+
+    def next_batch(self):
+        with self.cond:
+            while True:
+                if not self.queue:
+                    self.cond.wait()
+                    continue
+                wait=self.queue[0].arrival+self.max_delay-time.time()
+                if sum(len(r.data) for r in self.queue)>=self.max_batch_size or wait<=0:
+                    batch=[self.queue.popleft()]
+                    num=len(batch[0].data)
+                    while self.queue and num+len(self.queue[0].data)<=self.max_batch_size:
+                        num+=len(self.queue[0].data)
+                        batch.append(self.queue.popleft())
+                    return batch
+                self.cond.wait(wait)
+
+class Stats(object):
+    """Counters of the server and the latencies of the last `window` requests"""
+    def __init__(self, window):
+        self.lock=threading.Lock()
+        self.start=time.time()
+        self.latencies=deque(maxlen=window)
+        self.completed=deque(maxlen=window) #(time, images) of the last batches
+        self.requests=0
+        self.images=0
+        self.batches=0
+        self.errors=0
+
+    def add(self, batch, error=False):
+        now=time.time()
+        with self.lock:
+            if error:
+                self.errors+=len(batch)
+                return
+            self.latencies.extend(now-r.arrival for r in batch)
+            self.completed.append((now, sum(len(r.data) for r in batch)))
+            self.requests+=len(batch)
+            self.images+=self.completed[-1][1]
+            self.batches+=1
+
+    def summary(self):
+        with self.lock:
+            now=time.time()
+            latencies=np.array(self.latencies)*1e3
+            recent=[n for t, n in self.completed if t>now-60]
+            result={'requests': self.requests, 'images': self.images, 'batches': self.batches, 'errors': self.errors,
+                    'mean_batch_size': float(self.images)/self.batches if self.batches else 0.0,
+                    'uptime_s': now-self.start, 'images_per_sec': self.images/(now-self.start),
+                    'images_per_sec_last_minute': sum(recent)/min(60.0, now-self.start)}
+            if len(latencies):
+                result['latency_ms']=dict(('p%d'%p, float(np.percentile(latencies, p))) for p in (50, 90, 99))
+                result['latency_ms']['max']=float(latencies.max())
+            return result
+
+class Instance(object):
+    """An executor process and the thread feeding it batches from the batcher"""
+    def __init__(self, args, cores, num_outputs, batcher, stats):
+        self.batcher=batcher
+        self.stats=stats
+        shm='/dev/shm' if os.path.isdir('/dev/shm') else None
+        fd, self.ring=tempfile.mkstemp(prefix='serve', dir=shm)
+        os.close(fd)
+        self.data=np.memmap(self.ring+'.data', dtype=np.float32, mode='w+', shape=(args.max_batch_size, 3, args.data_shape, args.data_shape))
+        self.output=np.memmap(self.ring+'.output', dtype=np.float32, mode='w+', shape=(args.max_batch_size, num_outputs))
+        config={'prefix': args.model_prefix, 'epoch': args.load_epoch, 'cores': cores, 'ring': self.ring,
+                'max_batch_size': args.max_batch_size, 'data_shape': self.data.shape[1:], 'num_outputs': num_outputs}
+        env=dict(os.environ, OMP_NUM_THREADS=str(len(cores)))
+        self.proc=subprocess.Popen([sys.executable, os.path.abspath(__file__), '--worker', json.dumps(config)],
+                                   stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=env)
+        ready=self.proc.stdout.readline().strip()==b'ready'
+        for suffix in ['', '.data', '.output']: #both processes have mapped the buffers
+            os.remove(self.ring+suffix)
+        if not ready:
+            raise RuntimeError('the executor process on cores %s failed to start'%cores)
+        thread=threading.Thread(target=self.run)
+        thread.daemon=True
+        thread.start()
+
+    def run(self):
+        while True:
+            batch=self.batcher.next_batch()
+            num=0
+            for r in batch:
+                self.data[num:num+len(r.data)]=r.data
+                num+=len(r.data)
+            try:
+                self.proc.stdin.write(b'%d\n'%num)
+                self.proc.stdin.flush()
+                done=self.proc.stdout.readline().strip()==b'done'
+            except (IOError, OSError): #broken pipe
+                done=False
+            if not done:
+                for r in batch:
+                    r.error='the executor process exited'
+                    r.done.set()
+                self.stats.add(batch, error=True)
+                logging.error('the executor process %d exited with status %s', self.proc.pid, self.proc.wait())
+                return
+            outputs=np.array(self.output[:num])
+            num=0
+            for r in batch:
+                r.output=outputs[num:num+len(r.data)]
+                num+=len(r.data)
+                r.done.set()
+            self.stats.add(batch)
+
+    def close(self):
+        if self.proc.poll() is None:
+            self.proc.terminate()
+            self.proc.wait()
+
+def preprocess(image, data_shape, fb_mean=False):
+    """An encoded image as (1, 3, data_shape, data_shape) float32, resized and cropped like the validation images"""
+    img=mx.image.imdecode(image)
+    img=mx.image.resize_short(img, int(round(256.0*data_shape/224)))
+    img, _=mx.image.center_crop(img, (data_shape, data_shape))
+    mean, std=MEAN_STD[fb_mean]
+    img=(img.astype('float32').asnumpy()-np.array(mean, dtype=np.float32))/np.array(std, dtype=np.float32)
+    return img.transpose(2, 0, 1)[np.newaxis]
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version='HTTP/1.1'
+
+    def reply(self, code, body):
+        body=json.dumps(body).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path=urlparse(self.path).path
+        if path=='/stats':
+            self.reply(200, dict(self.server.stats.summary(), queue=len(self.server.batcher)))
+        elif path=='/health':
+            self.reply(200, {'status': 'ok'})
+        else:
+            self.reply(404, {'error': 'unknown path %s'%path})
+
+    def do_POST(self):
+        if urlparse(self.path).path!='/predict':
+            self.reply(404, {'error': 'unknown path %s'%self.path})
+            return
+        body=self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        kind=self.headers.get('Content-Type', 'application/octet-stream')
+        size=self.server.data_shape
+        try:
+            if kind.startswith('image/'):
+                data=preprocess(body, size, self.server.fb_mean)
+            elif kind=='application/x-npy':
+                data=np.load(io.BytesIO(body)).astype(np.float32)
+            else:
+                data=np.frombuffer(body, dtype=np.float32)
+            data=data.reshape((-1, 3, size, size))
+        except Exception as e:
+            self.reply(400, {'error': 'cannot read the %s data as images of 3x%dx%d: %s'%(kind, size, size, e)})
+            return
+        if not 0<len(data)<=self.server.batcher.max_batch_size:
+            self.reply(400, {'error': '%d images, at most %d per request'%(len(data), self.server.batcher.max_batch_size)})
+            return
+        request=Request(data)
+        self.server.batcher.submit(request)
+        if not request.done.wait(self.server.timeout_s):
+            self.reply(503, {'error': 'timed out'})
+        elif request.error:
+            self.reply(500, {'error': request.error})
+        else:
+            k=self.server.top_k or request.output.shape[1]
+            top=np.argsort(-request.output, axis=1)[:, :k]
+            self.reply(200, {'predictions': [[[int(c), float(p[c])] for c in t] for t, p in zip(top, request.output)],
+                             'latency_ms': (time.time()-request.arrival)*1e3})
+
+    def address_string(self):
+        return self.client_address[0] if self.client_address else 'unix'
+
+    def log_message(self, format, *args):
+        logging.debug(format, *args)
+
+class Server(ThreadingMixIn, HTTPServer):
+    daemon_threads=True
+    request_queue_size=128 #bursts of concurrent clients
+
+class UnixServer(Server):
+    address_family=socket.AF_UNIX
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        TCPServer.server_bind(self)
+        self.server_name='localhost'
+        self.server_port=0
+
+def report(stats, batcher, period):
+    while True:
+        time.sleep(period)
+        s=stats.summary()
+        latency=s.get('latency_ms', {})
+        logging.info('%d requests, %d images in %d batches (mean %.1f), %.1f images/sec (last minute %.1f), '
+                     'latency p50 %.1fms p90 %.1fms p99 %.1fms, %d queued, %d errors', s['requests'], s['images'],
+                     s['batches'], s['mean_batch_size'], s['images_per_sec'], s['images_per_sec_last_minute'],
+                     latency.get('p50', 0), latency.get('p90', 0), latency.get('p99', 0), len(batcher), s['errors'])
+
+def main():
+    parser = argparse.ArgumentParser(description='serve a trained model with dynamic batching')
+    parser.add_argument('--model-prefix', type=str, help='the prefix of the model')
+    parser.add_argument('--load-epoch', type=int, default=0, help='the epoch of the params')
+    parser.add_argument('--data-shape', type=int, default=224, help='the image size')
+    parser.add_argument('--fb-mean', action='store_true', help='the mean/std normalization of --fb-mean in train_imagenet.py')
+    parser.add_argument('--port', type=int, default=8080, help='the http port on localhost')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='the address to listen on')
+    parser.add_argument('--socket', type=str, help='listen on this Unix socket instead of --port')
+    parser.add_argument('--max-batch-size', type=int, default=16, help='the largest batch of images')
+    parser.add_argument('--max-delay', type=float, default=5, help='ms a request waits for others to fill its batch')
+    parser.add_argument('--instances', type=int, default=1, help='the number of executor processes')
+    parser.add_argument('--cores-per-instance', type=int, help='cpu cores of each executor process, all cores split evenly if not given')
+    parser.add_argument('--top-k', type=int, default=5, help='the classes returned per image, 0 for all probabilities')
+    parser.add_argument('--timeout', type=float, default=30, help='seconds before a request is answered with 503')
+    parser.add_argument('--window', type=int, default=10000, help='the number of requests of the latency percentiles')
+    parser.add_argument('--report', type=float, default=60, help='seconds between two logs of the counters')
+    parser.add_argument('--worker', type=str, help='internal usage, run as an executor process with this json config')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)-15s %(message)s')
+    if args.worker:
+        worker(json.loads(args.worker))
+        return
+    if args.model_prefix is None:
+        parser.error('--model-prefix is required')
+
+    symbol=mx.sym.load('%s-symbol.json'%args.model_prefix)
+    _, out_shapes, _=symbol.infer_shape(data=(1, 3, args.data_shape, args.data_shape))
+    num_outputs=int(np.prod(out_shapes[0][1:]))
+    cores=args.cores_per_instance or max(1, cpu_count()//args.instances)
+    batcher=Batcher(args.max_batch_size, args.max_delay/1e3)
+    stats=Stats(args.window)
+    instances=[]
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0)) #stop the executor processes too
+    try:
+        for i in range(args.instances):
+            instances.append(Instance(args, [(i*cores+k) % cpu_count() for k in range(cores)], num_outputs, batcher, stats))
+        if args.socket:
+            server=UnixServer(args.socket, Handler)
+        else:
+            server=Server((args.host, args.port), Handler)
+        server.batcher=batcher
+        server.stats=stats
+        server.data_shape=args.data_shape
+        server.fb_mean=args.fb_mean
+        server.top_k=args.top_k
+        server.timeout_s=args.timeout
+        thread=threading.Thread(target=report, args=(stats, batcher, args.report))
+        thread.daemon=True
+        thread.start()
+        logging.info('serving %s-%04d on %s: %d instances of %d cores, batches of at most %d images within %gms',
+                     args.model_prefix, args.load_epoch, args.socket or '%s:%d'%(args.host, args.port), args.instances,
+                     cores, args.max_batch_size, args.max_delay)
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for instance in instances:
+            instance.close()
+        if args.socket and os.path.exists(args.socket):
+            os.remove(args.socket)
+
+if __name__ == '__main__':
+    main()
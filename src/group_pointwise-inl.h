@@ -0,0 +1,314 @@
+#ifndef MXNET_OPERATOR_GROUP_POINTWISE_INL_H_
+#define MXNET_OPERATOR_GROUP_POINTWISE_INL_H_
+
+#include <dmlc/logging.h>
+#include <dmlc/parameter.h>
+#include <dmlc/omp.h>
+#include <mxnet/operator.h>
+#include <algorithm>
+#include <map>
+#include <string>
+#include <vector>
+#include <utility>
+#include "./operator_common.h"
+
+namespace mxnet {
+namespace op {
+
+// 1x1 group convolution, e.g. the secondary convolution of an igc block.
+// Groups of at most kSmallGroup input and output channels are computed as one
+// batched matrix product over all (image, group) pairs with a register-tiled
+// kernel instead of one tiny gemm each; larger groups still run one BLAS gemm
+// per (image, group).
+namespace gpw {
+enum GroupPointwiseOpInputs {kData, kWeight, kBias};
+enum GroupPointwiseOpOutputs {kOut};
+// number of pixels processed at once by the small-group kernel
+const index_t kTile = 256;
+// groups with at most this many input and output channels use the small-group kernel
+const index_t kSmallGroup = 16;
+
+// out[o, p] (+)= bias[o] + sum_i w[o * wo + i * wi] * in[i, p] for one (image, group)
+template<typename DType>
+inline void SmallGemm(const DType *in, const DType *w, index_t wo, index_t wi,
+                      const DType *bias, index_t nin, index_t nout,
+                      index_t npixel, DType *out, OpReqType req) {
+  DType acc[kTile];
+  for (index_t begin = 0; begin < npixel; begin += kTile) {
+    const index_t len = std::min(kTile, npixel - begin);
+    for (index_t o = 0; o < nout; ++o) {
+      std::fill(acc, acc + len, bias == NULL ? DType(0) : bias[o]);
+      for (index_t i = 0; i < nin; ++i) {
+        const DType weight = w[o * wo + i * wi];
+        const DType *x = in + i * npixel + begin;
+        for (index_t t = 0; t < len; ++t) acc[t] += weight * x[t];
+      }
+      DType *y = out + o * npixel + begin;
+      if (req == kAddTo) {
+        for (index_t t = 0; t < len; ++t) y[t] += acc[t];
+      } else {
+        std::copy(acc, acc + len, y);
+      }
+    }
+  }
+}
+
+// gw[o, i] += sum_p grad[o, p] * in[i, p] for one (image, group)
+template<typename DType>
+inline void SmallGemmGradWeight(const DType *grad, const DType *in, index_t nin,
+                                index_t nout, index_t npixel, DType *gw) {
+  for (index_t o = 0; o < nout; ++o) {
+    for (index_t i = 0; i < nin; ++i) {
+      const DType *g = grad + o * npixel, *x = in + i * npixel;
+      DType sum = 0;
+      for (index_t p = 0; p < npixel; ++p) sum += g[p] * x[p];
+      gw[o * nin + i] += sum;
+    }
+  }
+}
+}  // gpw
+
+struct GroupPointwiseParam : public dmlc::Parameter<GroupPointwiseParam> {
+  uint32_t num_filter;
+  uint32_t num_group;
+  bool no_bias;
+  DMLC_DECLARE_PARAMETER(GroupPointwiseParam) {
+    DMLC_DECLARE_FIELD(num_filter).set_range(1, 100000)
+    .describe("output channel number.");
+    DMLC_DECLARE_FIELD(num_group).set_default(1).set_lower_bound(1)
+    .describe("Number of groups of the 1x1 convolution.");
+    DMLC_DECLARE_FIELD(no_bias).set_default(false)
+    .describe("Whether to disable bias parameter.");
+  }
+};
+
+template<typename xpu, typename DType>
+class GroupPointwiseOp : public Operator {
+ public:
+  explicit GroupPointwiseOp(GroupPointwiseParam param) : param_(param) {}
+
+  virtual void Forward(const OpContext &ctx,
+                       const std::vector<TBlob> &in_data,
+                       const std::vector<OpReqType> &req,
+                       const std::vector<TBlob> &out_data,
+                       const std::vector<TBlob> &aux_args) {
+    using namespace mshadow;
+    using namespace mshadow::expr;
+    CHECK_EQ(in_data.size(), static_cast<size_t>(param_.no_bias ? 2 : 3));
+    CHECK_EQ(out_data.size(), static_cast<size_t>(1));
+    if (req[gpw::kOut] == kNullOp) return;
+    Stream<xpu> *s = ctx.get_stream<xpu>();
+    Tensor<xpu, 4, DType> data = in_data[gpw::kData].get<xpu, 4, DType>(s);
+    Tensor<xpu, 4, DType> out = out_data[gpw::kOut].get<xpu, 4, DType>(s);
+    this->InitShape(data.shape_);
+    Tensor<xpu, 2, DType> wmat = in_data[gpw::kWeight].get_with_shape<xpu, 2, DType>(
+        Shape2(param_.num_filter, nin_), s);
+    const DType *bias = param_.no_bias ? NULL : in_data[gpw::kBias].dptr<DType>();
+    const int total = static_cast<int>(data.size(0) * param_.num_group);
+    if (this->SmallGroups()) {
+      #pragma omp parallel for
+      for (int k = 0; k < total; ++k) {
+        const index_t n = k / param_.num_group, g = k % param_.num_group;
+        gpw::SmallGemm(data[n].dptr_ + g * nin_ * npixel_, wmat[g * nout_].dptr_, nin_, 1,
+                       bias == NULL ? NULL : bias + g * nout_, nin_, nout_, npixel_,
+                       out[n].dptr_ + g * nout_ * npixel_, req[gpw::kOut]);
+      }
+      return;
+    }
+    for (int k = 0; k < total; ++k) {
+      const index_t n = k / param_.num_group, g = k % param_.num_group;
+      Tensor<xpu, 2, DType> x(data[n].dptr_ + g * nin_ * npixel_, Shape2(nin_, npixel_), s);
+      Tensor<xpu, 2, DType> y(out[n].dptr_ + g * nout_ * npixel_, Shape2(nout_, npixel_), s);
+      Assign(y, req[gpw::kOut], dot(wmat.Slice(g * nout_, (g + 1) * nout_), x));
+    }
+    if (!param_.no_bias) {
+      Tensor<xpu, 1, DType> vbias = in_data[gpw::kBias].get<xpu, 1, DType>(s);
+      Tensor<xpu, 3, DType> out3 = out_data[gpw::kOut].get_with_shape<xpu, 3, DType>(
+          Shape3(out.size(0), param_.num_filter, npixel_), s);
+      out3 += broadcast<1>(vbias, out3.shape_);
+    }
+  }
+
+  virtual void Backward(const OpContext &ctx,
+                        const std::vector<TBlob> &out_grad,
+                        const std::vector<TBlob> &in_data,
+                        const std::vector<TBlob> &out_data,
+                        const std::vector<OpReqType> &req,
+                        const std::vector<TBlob> &in_grad,
+                        const std::vector<TBlob> &aux_args) {
+    using namespace mshadow;
+    using namespace mshadow::expr;
+    CHECK_EQ(out_grad.size(), static_cast<size_t>(1));
+    Stream<xpu> *s = ctx.get_stream<xpu>();
+    Tensor<xpu, 4, DType> data = in_data[gpw::kData].get<xpu, 4, DType>(s);
+    Tensor<xpu, 4, DType> grad = out_grad[gpw::kOut].get<xpu, 4, DType>(s);
+    Tensor<xpu, 4, DType> gdata = in_grad[gpw::kData].get<xpu, 4, DType>(s);
+    this->InitShape(data.shape_);
+    Tensor<xpu, 2, DType> wmat = in_data[gpw::kWeight].get_with_shape<xpu, 2, DType>(
+        Shape2(param_.num_filter, nin_), s);
+    Tensor<xpu, 2, DType> gwmat = in_grad[gpw::kWeight].get_with_shape<xpu, 2, DType>(
+        Shape2(param_.num_filter, nin_), s);
+    const index_t nbatch = data.size(0);
+    const int ngroup = static_cast<int>(param_.num_group);
+    if (this->SmallGroups()) {
+      // data gradient: the transposed weight, batched over (image, group)
+      if (req[gpw::kData] != kNullOp) {
+        const int total = static_cast<int>(nbatch) * ngroup;
+        #pragma omp parallel for
+        for (int k = 0; k < total; ++k) {
+          const index_t n = k / ngroup, g = k % ngroup;
+          gpw::SmallGemm(grad[n].dptr_ + g * nout_ * npixel_, wmat[g * nout_].dptr_, 1, nin_,
+                         static_cast<DType*>(NULL), nout_, nin_, npixel_,
+                         gdata[n].dptr_ + g * nin_ * npixel_, req[gpw::kData]);
+        }
+      }
+      // weight gradient: each group reduces over the batch on its own thread
+      if (req[gpw::kWeight] != kNullOp) {
+        if (req[gpw::kWeight] != kAddTo) gwmat = scalar<DType>(0.0f);
+        #pragma omp parallel for
+        for (int g = 0; g < ngroup; ++g) {
+          for (index_t n = 0; n < nbatch; ++n) {
+            gpw::SmallGemmGradWeight(grad[n].dptr_ + g * nout_ * npixel_,
+                                     data[n].dptr_ + g * nin_ * npixel_,
+                                     nin_, nout_, npixel_, gwmat[g * nout_].dptr_);
+          }
+        }
+      }
+    } else {
+      for (index_t n = 0; n < nbatch; ++n) {
+        for (int g = 0; g < ngroup; ++g) {
+          Tensor<xpu, 2, DType> x(data[n].dptr_ + g * nin_ * npixel_, Shape2(nin_, npixel_), s);
+          Tensor<xpu, 2, DType> gx(gdata[n].dptr_ + g * nin_ * npixel_, Shape2(nin_, npixel_), s);
+          Tensor<xpu, 2, DType> gy(grad[n].dptr_ + g * nout_ * npixel_, Shape2(nout_, npixel_), s);
+          if (req[gpw::kWeight] != kNullOp) {
+            Tensor<xpu, 2, DType> gw = gwmat.Slice(g * nout_, (g + 1) * nout_);
+            Assign(gw, n == 0 ? req[gpw::kWeight] : kAddTo, dot(gy, x.T()));
+          }
+          Assign(gx, req[gpw::kData], dot(wmat.Slice(g * nout_, (g + 1) * nout_).T(), gy));
+        }
+      }
+    }
+    if (!param_.no_bias) {
+      Tensor<xpu, 1, DType> gbias = in_grad[gpw::kBias].get<xpu, 1, DType>(s);
+      Tensor<xpu, 3, DType> grad3 = out_grad[gpw::kOut].get_with_shape<xpu, 3, DType>(
+          Shape3(nbatch, param_.num_filter, npixel_), s);
+      Assign(gbias, req[gpw::kBias], sumall_except_dim<1>(grad3));
+    }
+  }
+
+ private:
+  inline void InitShape(const mshadow::Shape<4> &ishape) {
+    nin_ = ishape[1] / param_.num_group;
+    nout_ = param_.num_filter / param_.num_group;
+    npixel_ = ishape[2] * ishape[3];
+  }
+  inline bool SmallGroups() const {
+    return nin_ <= gpw::kSmallGroup && nout_ <= gpw::kSmallGroup;
+  }
+  GroupPointwiseParam param_;
+  // channels per group: input, output
+  index_t nin_, nout_;
+  index_t npixel_;
+};  // class GroupPointwiseOp
+
+// Decalre Factory function, used for dispatch specialization
+template<typename xpu>
+Operator* CreateOp(GroupPointwiseParam param, int dtype);
+
+#if DMLC_USE_CXX11
+class GroupPointwiseProp : public OperatorProperty {
+ public:
+  std::vector<std::string> ListArguments() const override {
+    if (!param_.no_bias) {
+      return {"data", "weight", "bias"};
+    } else {
+      return {"data", "weight"};
+    }
+  }
+
+  void Init(const std::vector<std::pair<std::string, std::string> >& kwargs) override {
+    param_.Init(kwargs);
+  }
+
+  std::map<std::string, std::string> GetParams() const override {
+    return param_.__DICT__();
+  }
+
+  bool InferShape(std::vector<TShape> *in_shape,
+                  std::vector<TShape> *out_shape,
+                  std::vector<TShape> *aux_shape) const override {
+    using namespace mshadow;
+    if (!param_.no_bias) {
+      CHECK_EQ(in_shape->size(), static_cast<size_t>(3)) << "Input:[data, weight, bias]";
+    } else {
+      CHECK_EQ(in_shape->size(), static_cast<size_t>(2)) << "Input:[data, weight]";
+    }
+    const TShape &dshape = (*in_shape)[gpw::kData];
+    if (dshape.ndim() == 0) return false;
+    CHECK_EQ(dshape.ndim(), 4) << "GroupPointwise only supports 4D input (batch, channel, y, x)";
+    CHECK_EQ(dshape[1] % param_.num_group, 0)
+        << "input channels must be divisible by num_group";
+    CHECK_EQ(param_.num_filter % param_.num_group, 0)
+        << "num_filter must be divisible by num_group";
+    // same weight layout as a 1x1 Convolution, so checkpoints are interchangeable
+    SHAPE_ASSIGN_CHECK(*in_shape, gpw::kWeight,
+                       Shape4(param_.num_filter, dshape[1] / param_.num_group, 1, 1));
+    if (!param_.no_bias) {
+      SHAPE_ASSIGN_CHECK(*in_shape, gpw::kBias, Shape1(param_.num_filter));
+    }
+    out_shape->clear();
+    out_shape->push_back(Shape4(dshape[0], param_.num_filter, dshape[2], dshape[3]));
+    return true;
+  }
+
+  bool InferType(std::vector<int> *in_type,
+                 std::vector<int> *out_type,
+                 std::vector<int> *aux_type) const override {
+    int dtype = (*in_type)[0];
+    CHECK_NE(dtype, -1) << "First input must have specified type";
+    for (index_t i = 0; i < in_type->size(); ++i) {
+      if ((*in_type)[i] == -1) {
+        (*in_type)[i] = dtype;
+      } else {
+        CHECK_EQ((*in_type)[i], dtype) << "This layer requires uniform type. "
+                                       << "Expected " << dtype << " v.s. given "
+                                       << (*in_type)[i] << " at " << ListArguments()[i];
+      }
+    }
+    out_type->clear();
+    out_type->push_back(dtype);
+    return true;
+  }
+
+  OperatorProperty* Copy() const override {
+    GroupPointwiseProp* ptr = new GroupPointwiseProp();
+    ptr->param_ = this->param_;
+    return ptr;
+  }
+
+  std::string TypeString() const override {
+    return "GroupPointwise";
+  }
+
+  std::vector<int> DeclareBackwardDependency(
+    const std::vector<int> &out_grad,
+    const std::vector<int> &in_data,
+    const std::vector<int> &out_data) const override {
+    return {out_grad[gpw::kOut], in_data[gpw::kData], in_data[gpw::kWeight]};
+  }
+
+  Operator* CreateOperator(Context ctx) const override {
+    LOG(FATAL) << "Not Implemented.";
+    return NULL;
+  }
+
+  Operator* CreateOperatorEx(Context ctx, std::vector<TShape> *in_shape,
+                             std::vector<int> *in_type) const override;
+
+ private:
+  GroupPointwiseParam param_;
+};  // class GroupPointwiseProp
+#endif
+}  // namespace op
+}  // namespace mxnet
+#endif  // MXNET_OPERATOR_GROUP_POINTWISE_INL_H_
@@ -0,0 +1,40 @@
+#include "./group_pointwise-inl.h"
+namespace mxnet {
+namespace op {
+template<>
+Operator* CreateOp<cpu>(GroupPointwiseParam param, int dtype) {
+  Operator *op = NULL;
+  switch (dtype) {
+  case mshadow::kFloat32:
+    op = new GroupPointwiseOp<cpu, float>(param);
+    break;
+  case mshadow::kFloat64:
+    op = new GroupPointwiseOp<cpu, double>(param);
+    break;
+  default:
+    LOG(FATAL) << "Unsupported type " << dtype;
+  }
+  return op;
+}
+
+// DO_BIND_DISPATCH comes from operator_common.h
+Operator *GroupPointwiseProp::CreateOperatorEx(Context ctx, std::vector<TShape> *in_shape,
+                                                std::vector<int> *in_type) const {
+  std::vector<TShape> out_shape, aux_shape;
+  std::vector<int> out_type, aux_type;
+  CHECK(InferType(in_type, &out_type, &aux_type));
+  CHECK(InferShape(in_shape, &out_shape, &aux_shape));
+  DO_BIND_DISPATCH(CreateOp, param_, (*in_type)[0]);
+}
+
+DMLC_REGISTER_PARAMETER(GroupPointwiseParam);
+
+MXNET_REGISTER_OP_PROPERTY(GroupPointwise, GroupPointwiseProp)
+.add_argument("data", "Symbol", "Input data to the 1x1 group convolution.")
+.add_argument("weight", "Symbol", "Weight matrix, same shape as the weight of a 1x1 Convolution.")
+.add_argument("bias", "Symbol", "Bias parameter.")
+.describe("1x1 group convolution computing all groups of all images as one batched matrix product.")
+.add_arguments(GroupPointwiseParam::__FIELDS__());
+
+}  // namespace op
+}  // namespace mxnet
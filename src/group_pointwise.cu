@@ -0,0 +1,11 @@
+#include "./group_pointwise-inl.h"
+namespace mxnet {
+namespace op {
+template<>
+Operator* CreateOp<gpu>(GroupPointwiseParam param, int dtype) {
+  LOG(FATAL) << "GroupPointwise is only implemented on cpu, "
+                "use Convolution with num_group for gpus.";
+  return NULL;
+}
+}  // namespace op
+}  // namespace mxnet
@@ -0,0 +1,382 @@
+#ifndef MXNET_OPERATOR_IGC_INL_H_
+#define MXNET_OPERATOR_IGC_INL_H_
+
+#include <dmlc/logging.h>
+#include <dmlc/parameter.h>
+#include <dmlc/omp.h>
+#include <mxnet/operator.h>
+#include <algorithm>
+#include <map>
+#include <string>
+#include <vector>
+#include <utility>
+#include "./operator_common.h"
+
+namespace mxnet {
+namespace op {
+
+// Interleaved group convolution block fused into one operator:
+//   Convolution(num_group=L) -> Reorder(L) -> 1x1 Convolution(num_group=M) -> Reorder(M)
+// The primary output is written straight into secondary-partition order and the
+// secondary convolution writes straight into the final channel order, one tile
+// of output pixels at a time, so no full-size intermediate tensor is kept.
+namespace igc {
+enum IGCOpInputs {kData, kWeight1, kWeight2};
+enum IGCOpOutputs {kOut};
+enum IGCOpResource {kTempSpace};
+}  // igc
+
+struct IGCParam : public dmlc::Parameter<IGCParam> {
+  TShape kernel;
+  TShape stride;
+  TShape pad;
+  uint32_t num_filter;
+  uint32_t primary_partition;
+  uint32_t secondary_partition;
+  uint32_t tile;
+  DMLC_DECLARE_PARAMETER(IGCParam) {
+    int shape[] = {1, 1};
+    DMLC_DECLARE_FIELD(kernel).describe("primary convolution kernel size: (y, x)");
+    DMLC_DECLARE_FIELD(stride).set_default(TShape(shape, shape + 2))
+    .describe("primary convolution stride: (y, x)");
+    shape[0] = shape[1] = 0;
+    DMLC_DECLARE_FIELD(pad).set_default(TShape(shape, shape + 2))
+    .describe("pad for the primary convolution: (y, x)");
+    DMLC_DECLARE_FIELD(num_filter).set_range(1, 100000)
+    .describe("output channel number of both convolutions.");
+    DMLC_DECLARE_FIELD(primary_partition).set_lower_bound(1)
+    .describe("Number of groups of the primary (spatial) convolution.");
+    DMLC_DECLARE_FIELD(secondary_partition).set_lower_bound(1)
+    .describe("Number of groups of the secondary (1x1) convolution.");
+    DMLC_DECLARE_FIELD(tile).set_default(256).set_lower_bound(1)
+    .describe("Number of output pixels processed at once by each thread.");
+  }
+};
+
+// Receptive fields of output pixels [begin, begin + col.size(1)) of one
+// image restricted to the channels of one primary partition.
+template<typename DType>
+inline void Im2ColTile(const DType *data, const mshadow::Shape<3> &ishape,
+                       index_t out_width, const IGCParam &param, index_t begin,
+                       mshadow::Tensor<cpu, 2, DType> col) {
+  const index_t kh = param.kernel[0], kw = param.kernel[1];
+  const int height = ishape[1], width = ishape[2];
+  for (index_t c = 0; c < ishape[0]; ++c) {
+    for (index_t i = 0; i < kh; ++i) {
+      for (index_t j = 0; j < kw; ++j) {
+        DType *row = col[(c * kh + i) * kw + j].dptr_;
+        for (index_t t = 0; t < col.size(1); ++t) {
+          const index_t p = begin + t;
+          const int y = (p / out_width) * param.stride[0] - param.pad[0] + i;
+          const int x = (p % out_width) * param.stride[1] - param.pad[1] + j;
+          row[t] = (y >= 0 && y < height && x >= 0 && x < width) ?
+                   data[(c * height + y) * width + x] : DType(0);
+        }
+      }
+    }
+  }
+}
+
+// Adjoint of Im2ColTile: accumulate col back into the image gradient.
+template<typename DType>
+inline void Col2ImTile(const mshadow::Tensor<cpu, 2, DType> &col,
+                       const mshadow::Shape<3> &ishape, index_t out_width,
+                       const IGCParam &param, index_t begin, DType *data) {
+  const index_t kh = param.kernel[0], kw = param.kernel[1];
+  const int height = ishape[1], width = ishape[2];
+  for (index_t c = 0; c < ishape[0]; ++c) {
+    for (index_t i = 0; i < kh; ++i) {
+      for (index_t j = 0; j < kw; ++j) {
+        const DType *row = col[(c * kh + i) * kw + j].dptr_;
+        for (index_t t = 0; t < col.size(1); ++t) {
+          const index_t p = begin + t;
+          const int y = (p / out_width) * param.stride[0] - param.pad[0] + i;
+          const int x = (p % out_width) * param.stride[1] - param.pad[1] + j;
+          if (y >= 0 && y < height && x >= 0 && x < width) {
+            data[(c * height + y) * width + x] += row[t];
+          }
+        }
+      }
+    }
+  }
+}
+
+template<typename xpu, typename DType>
+class IGCOp : public Operator {
+ public:
+  explicit IGCOp(IGCParam param) : param_(param) {}
+
+  virtual void Forward(const OpContext &ctx,
+                       const std::vector<TBlob> &in_data,
+                       const std::vector<OpReqType> &req,
+                       const std::vector<TBlob> &out_data,
+                       const std::vector<TBlob> &aux_args) {
+    using namespace mshadow;
+    using namespace mshadow::expr;
+    CHECK_EQ(in_data.size(), static_cast<size_t>(3));
+    CHECK_EQ(out_data.size(), static_cast<size_t>(1));
+    if (req[igc::kOut] == kNullOp) return;
+    Stream<xpu> *s = ctx.get_stream<xpu>();
+    Tensor<xpu, 4, DType> data = in_data[igc::kData].get<xpu, 4, DType>(s);
+    Tensor<xpu, 4, DType> out = out_data[igc::kOut].get<xpu, 4, DType>(s);
+    this->InitShape(data.shape_, out.shape_);
+    Tensor<xpu, 2, DType> wp = in_data[igc::kWeight1].get_with_shape<xpu, 2, DType>(
+        Shape2(channel_, kcol_), s);
+    Tensor<xpu, 2, DType> ws = in_data[igc::kWeight2].get_with_shape<xpu, 2, DType>(
+        Shape2(channel_, span_), s);
+    const index_t tile = param_.tile;
+    const index_t nsize = kcol_ * tile + channel_ * tile;
+    Tensor<xpu, 1, DType> workspace =
+        ctx.requested[igc::kTempSpace].get_space_typed<xpu, 1, DType>(
+            Shape1(nsize * omp_get_max_threads()), s);
+    const int nbatch = static_cast<int>(data.size(0));
+    #pragma omp parallel for
+    for (int n = 0; n < nbatch; ++n) {
+      DType *col_ptr = workspace.dptr_ + nsize * omp_get_thread_num();
+      DType *mid_ptr = col_ptr + kcol_ * tile;
+      DType *out_ptr = out[n].dptr_;
+      for (index_t begin = 0; begin < npixel_; begin += tile) {
+        const index_t len = std::min(tile, npixel_ - begin);
+        Tensor<xpu, 2, DType> col(col_ptr, Shape2(kcol_, len), tile, s);
+        // primary partition g writes its channel k to row k * L + g
+        for (index_t g = 0; g < param_.primary_partition; ++g) {
+          Im2ColTile(data[n].Slice(g * cin_, (g + 1) * cin_).dptr_,
+                     ishape_, out_width_, param_, begin, col);
+          Tensor<xpu, 2, DType> mid(mid_ptr + g * tile, Shape2(cout_, len),
+                                    param_.primary_partition * tile, s);
+          mid = dot(wp.Slice(g * cout_, (g + 1) * cout_), col);
+        }
+        // secondary partition m writes its channel k to output channel k * M + m
+        for (index_t m = 0; m < param_.secondary_partition; ++m) {
+          Tensor<xpu, 2, DType> mid(mid_ptr + m * span_ * tile, Shape2(span_, len), tile, s);
+          Tensor<xpu, 2, DType> dst(out_ptr + m * npixel_ + begin, Shape2(span_, len),
+                                    param_.secondary_partition * npixel_, s);
+          Assign(dst, req[igc::kOut], dot(ws.Slice(m * span_, (m + 1) * span_), mid));
+        }
+      }
+    }
+  }
+
+  virtual void Backward(const OpContext &ctx,
+                        const std::vector<TBlob> &out_grad,
+                        const std::vector<TBlob> &in_data,
+                        const std::vector<TBlob> &out_data,
+                        const std::vector<OpReqType> &req,
+                        const std::vector<TBlob> &in_grad,
+                        const std::vector<TBlob> &aux_args) {
+    using namespace mshadow;
+    using namespace mshadow::expr;
+    CHECK_EQ(out_grad.size(), static_cast<size_t>(1));
+    CHECK_EQ(in_grad.size(), static_cast<size_t>(3));
+    Stream<xpu> *s = ctx.get_stream<xpu>();
+    Tensor<xpu, 4, DType> data = in_data[igc::kData].get<xpu, 4, DType>(s);
+    Tensor<xpu, 4, DType> grad_out = out_grad[igc::kOut].get<xpu, 4, DType>(s);
+    Tensor<xpu, 4, DType> grad_data = in_grad[igc::kData].get<xpu, 4, DType>(s);
+    this->InitShape(data.shape_, grad_out.shape_);
+    Tensor<xpu, 2, DType> wp = in_data[igc::kWeight1].get_with_shape<xpu, 2, DType>(
+        Shape2(channel_, kcol_), s);
+    Tensor<xpu, 2, DType> ws = in_data[igc::kWeight2].get_with_shape<xpu, 2, DType>(
+        Shape2(channel_, span_), s);
+    Tensor<xpu, 2, DType> gwp = in_grad[igc::kWeight1].get_with_shape<xpu, 2, DType>(
+        Shape2(channel_, kcol_), s);
+    Tensor<xpu, 2, DType> gws = in_grad[igc::kWeight2].get_with_shape<xpu, 2, DType>(
+        Shape2(channel_, span_), s);
+    // per thread: col, dcol, primary output, its gradient and partial weight gradients
+    const index_t tile = param_.tile;
+    const index_t nsize = 2 * kcol_ * tile + 2 * channel_ * tile +
+                          channel_ * kcol_ + channel_ * span_;
+    const int nthread = omp_get_max_threads();
+    Tensor<xpu, 1, DType> workspace =
+        ctx.requested[igc::kTempSpace].get_space_typed<xpu, 1, DType>(
+            Shape1(nsize * nthread), s);
+    workspace = scalar<DType>(0.0f);
+    const int nbatch = static_cast<int>(data.size(0));
+    #pragma omp parallel for
+    for (int n = 0; n < nbatch; ++n) {
+      DType *col_ptr = workspace.dptr_ + nsize * omp_get_thread_num();
+      DType *dcol_ptr = col_ptr + kcol_ * tile;
+      DType *mid_ptr = dcol_ptr + kcol_ * tile;
+      DType *dmid_ptr = mid_ptr + channel_ * tile;
+      Tensor<xpu, 2, DType> dwp(dmid_ptr + channel_ * tile, Shape2(channel_, kcol_), s);
+      Tensor<xpu, 2, DType> dws(dwp.dptr_ + channel_ * kcol_, Shape2(channel_, span_), s);
+      DType *gout_ptr = grad_out[n].dptr_;
+      Tensor<xpu, 3, DType> gdata = grad_data[n];
+      if (req[igc::kData] == kWriteTo) gdata = scalar<DType>(0.0f);
+      for (index_t begin = 0; begin < npixel_; begin += tile) {
+        const index_t len = std::min(tile, npixel_ - begin);
+        Tensor<xpu, 2, DType> col(col_ptr, Shape2(kcol_, len), tile, s);
+        Tensor<xpu, 2, DType> dcol(dcol_ptr, Shape2(kcol_, len), tile, s);
+        // recompute the primary output of this tile in secondary-partition order
+        for (index_t g = 0; g < param_.primary_partition; ++g) {
+          Im2ColTile(data[n].Slice(g * cin_, (g + 1) * cin_).dptr_,
+                     ishape_, out_width_, param_, begin, col);
+          Tensor<xpu, 2, DType> mid(mid_ptr + g * tile, Shape2(cout_, len),
+                                    param_.primary_partition * tile, s);
+          mid = dot(wp.Slice(g * cout_, (g + 1) * cout_), col);
+        }
+        for (index_t m = 0; m < param_.secondary_partition; ++m) {
+          Tensor<xpu, 2, DType> gout(gout_ptr + m * npixel_ + begin,
+                                     Shape2(span_, len),
+                                     param_.secondary_partition * npixel_, s);
+          Tensor<xpu, 2, DType> mid(mid_ptr + m * span_ * tile, Shape2(span_, len), tile, s);
+          Tensor<xpu, 2, DType> dmid(dmid_ptr + m * span_ * tile, Shape2(span_, len), tile, s);
+          dws.Slice(m * span_, (m + 1) * span_) += dot(gout, mid.T());
+          dmid = dot(ws.Slice(m * span_, (m + 1) * span_).T(), gout);
+        }
+        for (index_t g = 0; g < param_.primary_partition; ++g) {
+          Tensor<xpu, 2, DType> dmid(dmid_ptr + g * tile, Shape2(cout_, len),
+                                     param_.primary_partition * tile, s);
+          Im2ColTile(data[n].Slice(g * cin_, (g + 1) * cin_).dptr_,
+                     ishape_, out_width_, param_, begin, col);
+          dwp.Slice(g * cout_, (g + 1) * cout_) += dot(dmid, col.T());
+          if (req[igc::kData] == kNullOp) continue;
+          dcol = dot(wp.Slice(g * cout_, (g + 1) * cout_).T(), dmid);
+          Col2ImTile(dcol, ishape_, out_width_, param_, begin,
+                     gdata.Slice(g * cin_, (g + 1) * cin_).dptr_);
+        }
+      }
+    }
+    // reduce the partial weight gradients of all threads
+    for (int i = 0; i < nthread; ++i) {
+      DType *part = workspace.dptr_ + nsize * i + 2 * kcol_ * tile + 2 * channel_ * tile;
+      Tensor<xpu, 2, DType> dwp(part, Shape2(channel_, kcol_), s);
+      Tensor<xpu, 2, DType> dws(part + channel_ * kcol_, Shape2(channel_, span_), s);
+      if (req[igc::kWeight1] != kNullOp) {
+        Assign(gwp, i == 0 ? req[igc::kWeight1] : kAddTo, dwp);
+      }
+      if (req[igc::kWeight2] != kNullOp) {
+        Assign(gws, i == 0 ? req[igc::kWeight2] : kAddTo, dws);
+      }
+    }
+  }
+
+ private:
+  inline void InitShape(const mshadow::Shape<4> &ishape, const mshadow::Shape<4> &oshape) {
+    cin_ = ishape[1] / param_.primary_partition;
+    channel_ = oshape[1];
+    cout_ = channel_ / param_.primary_partition;
+    span_ = channel_ / param_.secondary_partition;
+    kcol_ = cin_ * param_.kernel[0] * param_.kernel[1];
+    ishape_ = mshadow::Shape3(cin_, ishape[2], ishape[3]);
+    out_width_ = oshape[3];
+    npixel_ = oshape[2] * oshape[3];
+  }
+  IGCParam param_;
+  // channels per primary partition: input, output; channels per secondary partition
+  index_t cin_, cout_, span_;
+  index_t channel_, kcol_, out_width_, npixel_;
+  mshadow::Shape<3> ishape_;
+};  // class IGCOp
+
+// Decalre Factory function, used for dispatch specialization
+template<typename xpu>
+Operator* CreateOp(IGCParam param, int dtype);
+
+#if DMLC_USE_CXX11
+class IGCProp : public OperatorProperty {
+ public:
+  std::vector<std::string> ListArguments() const override {
+    return {"data", "weight1", "weight2"};
+  }
+
+  void Init(const std::vector<std::pair<std::string, std::string> >& kwargs) override {
+    param_.Init(kwargs);
+  }
+
+  std::map<std::string, std::string> GetParams() const override {
+    return param_.__DICT__();
+  }
+
+  bool InferShape(std::vector<TShape> *in_shape,
+                  std::vector<TShape> *out_shape,
+                  std::vector<TShape> *aux_shape) const override {
+    using namespace mshadow;
+    CHECK_EQ(in_shape->size(), static_cast<size_t>(3)) << "Input:[data, weight1, weight2]";
+    const TShape &dshape = (*in_shape)[igc::kData];
+    if (dshape.ndim() == 0) return false;
+    CHECK_EQ(dshape.ndim(), 4) << "IGC only supports 4D input (batch, channel, y, x)";
+    CHECK_EQ(param_.kernel.ndim(), 2) << "IGC only supports 2D kernels";
+    const index_t channel = param_.num_filter;
+    CHECK_EQ(dshape[1] % param_.primary_partition, 0)
+        << "input channels must be divisible by primary_partition";
+    CHECK_EQ(channel % param_.primary_partition, 0)
+        << "num_filter must be divisible by primary_partition";
+    CHECK_EQ(channel % param_.secondary_partition, 0)
+        << "num_filter must be divisible by secondary_partition";
+    SHAPE_ASSIGN_CHECK(*in_shape, igc::kWeight1,
+                       Shape4(channel, dshape[1] / param_.primary_partition,
+                              param_.kernel[0], param_.kernel[1]));
+    SHAPE_ASSIGN_CHECK(*in_shape, igc::kWeight2,
+                       Shape4(channel, channel / param_.secondary_partition, 1, 1));
+    const index_t ksize_y = param_.kernel[0], ksize_x = param_.kernel[1];
+    CHECK(ksize_y <= dshape[2] + 2 * param_.pad[0] && ksize_x <= dshape[3] + 2 * param_.pad[1])
+        << "kernel size exceed input";
+    out_shape->clear();
+    out_shape->push_back(Shape4(dshape[0], channel,
+        (dshape[2] + 2 * param_.pad[0] - ksize_y) / param_.stride[0] + 1,
+        (dshape[3] + 2 * param_.pad[1] - ksize_x) / param_.stride[1] + 1));
+    return true;
+  }
+
+  bool InferType(std::vector<int> *in_type,
+                 std::vector<int> *out_type,
+                 std::vector<int> *aux_type) const override {
+    int dtype = (*in_type)[0];
+    CHECK_NE(dtype, -1) << "First input must have specified type";
+    for (index_t i = 0; i < in_type->size(); ++i) {
+      if ((*in_type)[i] == -1) {
+        (*in_type)[i] = dtype;
+      } else {
+        CHECK_EQ((*in_type)[i], dtype) << "This layer requires uniform type. "
+                                       << "Expected " << dtype << " v.s. given "
+                                       << (*in_type)[i] << " at " << ListArguments()[i];
+      }
+    }
+    out_type->clear();
+    out_type->push_back(dtype);
+    return true;
+  }
+
+  OperatorProperty* Copy() const override {
+    IGCProp* ptr = new IGCProp();
+    ptr->param_ = this->param_;
+    return ptr;
+  }
+
+  std::string TypeString() const override {
+    return "IGC";
+  }
+
+  std::vector<int> DeclareBackwardDependency(
+    const std::vector<int> &out_grad,
+    const std::vector<int> &in_data,
+    const std::vector<int> &out_data) const override {
+    return {out_grad[igc::kOut], in_data[igc::kData],
+            in_data[igc::kWeight1], in_data[igc::kWeight2]};
+  }
+
+  std::vector<ResourceRequest> ForwardResource(
+      const std::vector<TShape> &in_shape) const override {
+    return {ResourceRequest::kTempSpace};
+  }
+
+  std::vector<ResourceRequest> BackwardResource(
+      const std::vector<TShape> &in_shape) const override {
+    return {ResourceRequest::kTempSpace};
+  }
+
+  Operator* CreateOperator(Context ctx) const override {
+    LOG(FATAL) << "Not Implemented.";
+    return NULL;
+  }
+
+  Operator* CreateOperatorEx(Context ctx, std::vector<TShape> *in_shape,
+                             std::vector<int> *in_type) const override;
+
+ private:
+  IGCParam param_;
+};  // class IGCProp
+#endif
+}  // namespace op
+}  // namespace mxnet
+#endif  // MXNET_OPERATOR_IGC_INL_H_
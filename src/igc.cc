@@ -0,0 +1,41 @@
+#include "./igc-inl.h"
+namespace mxnet {
+namespace op {
+template<>
+Operator* CreateOp<cpu>(IGCParam param, int dtype) {
+  Operator *op = NULL;
+  switch (dtype) {
+  case mshadow::kFloat32:
+    op = new IGCOp<cpu, float>(param);
+    break;
+  case mshadow::kFloat64:
+    op = new IGCOp<cpu, double>(param);
+    break;
+  default:
+    LOG(FATAL) << "Unsupported type " << dtype;
+  }
+  return op;
+}
+
+// DO_BIND_DISPATCH comes from operator_common.h
+Operator *IGCProp::CreateOperatorEx(Context ctx, std::vector<TShape> *in_shape,
+                                     std::vector<int> *in_type) const {
+  std::vector<TShape> out_shape, aux_shape;
+  std::vector<int> out_type, aux_type;
+  CHECK(InferType(in_type, &out_type, &aux_type));
+  CHECK(InferShape(in_shape, &out_shape, &aux_shape));
+  DO_BIND_DISPATCH(CreateOp, param_, (*in_type)[0]);
+}
+
+DMLC_REGISTER_PARAMETER(IGCParam);
+
+MXNET_REGISTER_OP_PROPERTY(IGC, IGCProp)
+.add_argument("data", "Symbol", "Input data to the IGC block.")
+.add_argument("weight1", "Symbol", "Weight of the primary group convolution.")
+.add_argument("weight2", "Symbol", "Weight of the secondary 1x1 group convolution.")
+.describe("Interleaved group convolution block: primary group convolution, "
+          "Reorder, secondary 1x1 group convolution and Reorder in one operator.")
+.add_arguments(IGCParam::__FIELDS__());
+
+}  // namespace op
+}  // namespace mxnet
@@ -0,0 +1,11 @@
+#include "./igc-inl.h"
+namespace mxnet {
+namespace op {
+template<>
+Operator* CreateOp<gpu>(IGCParam param, int dtype) {
+  LOG(FATAL) << "IGC is only implemented on cpu, "
+                "build the network without the fused option for gpus.";
+  return NULL;
+}
+}  // namespace op
+}  // namespace mxnet
@@ -23,16 +23,120 @@ namespace reord {
 enum WeightedFusionOpInputs {kData};
 enum WeightedFusionOpOutputs {kOut};
 enum WeightedFusionOpResource { kTempSpace };
+// number of H*W elements moved at once by the cpu kernels
+const index_t kTile = 512;
+
+// Reorder views the channels as a (group, channel/group) matrix and
+// transposes it, so output channel c reads input channel SrcChannel(c).
+// The backward pass is the same mapping with group = channel/group.
+inline index_t SrcChannel(index_t c, index_t channel, index_t group) {
+  return (c % group) * (channel / group) + c / group;
+}
+
+// Smallest channel of every permutation cycle, used by the in-place kernel.
+inline std::vector<index_t> CycleLeaders(index_t channel, index_t group) {
+  std::vector<index_t> leaders;
+  for (index_t c = 0; c < channel; ++c) {
+    index_t next = SrcChannel(c, channel, group);
+    while (next > c) next = SrcChannel(next, channel, group);
+    if (next == c && SrcChannel(c, channel, group) != c) leaders.push_back(c);
+  }
+  return leaders;
+}
+
+// Direct strided permutation: one pass over the data, no workspace.
+template<typename DType>
+inline void ReorderChannels(const DType *in, DType *out, index_t num,
+                            index_t channel, index_t spatial, index_t group,
+                            OpReqType req) {
+  const int total = static_cast<int>(num * channel);
+  #pragma omp parallel for
+  for (int i = 0; i < total; ++i) {
+    const index_t n = i / channel;
+    const DType *src = in + (n * channel +
+                             SrcChannel(i % channel, channel, group)) * spatial;
+    DType *dst = out + static_cast<index_t>(i) * spatial;
+    for (index_t j = 0; j < spatial; j += kTile) {
+      const index_t end = std::min(j + kTile, spatial);
+      if (req == kAddTo) {
+        for (index_t k = j; k < end; ++k) dst[k] += src[k];
+      } else {
+        std::copy(src + j, src + end, dst + j);
+      }
+    }
+  }
+}
+
+// In-place variant: follows the permutation cycles one H*W tile at a time,
+// so only a single tile per thread is held outside the tensor.
+template<typename DType>
+inline void ReorderChannelsInplace(DType *data, index_t num, index_t channel,
+                                   index_t spatial, index_t group,
+                                   const std::vector<index_t> &leaders) {
+  const index_t ntile = (spatial + kTile - 1) / kTile;
+  const int total = static_cast<int>(num * ntile);
+  #pragma omp parallel for
+  for (int i = 0; i < total; ++i) {
+    DType buf[kTile];
+    DType *base = data + (i / ntile) * channel * spatial;
+    const index_t j = (i % ntile) * kTile;
+    const index_t len = std::min(kTile, spatial - j);
+    for (size_t l = 0; l < leaders.size(); ++l) {
+      index_t c = leaders[l];
+      std::copy(base + c * spatial + j, base + c * spatial + j + len, buf);
+      for (index_t next = SrcChannel(c, channel, group); next != leaders[l];
+           c = next, next = SrcChannel(c, channel, group)) {
+        std::copy(base + next * spatial + j, base + next * spatial + j + len,
+                  base + c * spatial + j);
+      }
+      std::copy(buf, buf + len, base + c * spatial + j);
+    }
+  }
+}
+
+// Channels-last variant: every pixel holds a contiguous channel vector, so the
+// permutation is a gather inside each vector. In place, the vector is first
+// copied to a per-thread buffer.
+template<typename DType>
+inline void ReorderPixels(const DType *in, DType *out, index_t npixel,
+                          index_t channel, const std::vector<index_t> &src,
+                          OpReqType req) {
+  #pragma omp parallel
+  {
+    std::vector<DType> buf(in == out ? channel : 0);
+    #pragma omp for
+    for (int p = 0; p < static_cast<int>(npixel); ++p) {
+      const DType *x = in + static_cast<index_t>(p) * channel;
+      DType *y = out + static_cast<index_t>(p) * channel;
+      if (in == out) {
+        std::copy(x, x + channel, buf.begin());
+        x = &buf[0];
+      }
+      if (req == kAddTo) {
+        for (index_t c = 0; c < channel; ++c) y[c] += x[src[c]];
+      } else {
+        for (index_t c = 0; c < channel; ++c) y[c] = x[src[c]];
+      }
+    }
+  }
+}
 }  // reord
 
 struct ReorderParam : public dmlc::Parameter<ReorderParam> {
   uint32_t branch_factor;
   uint64_t workspace;
+  int layout;
   DMLC_DECLARE_PARAMETER(ReorderParam) {
 	  DMLC_DECLARE_FIELD(branch_factor).set_lower_bound(1)
 		  .describe("Number of branches to be summed.");
 	  DMLC_DECLARE_FIELD(workspace).set_default(1024).set_range(0, 8192)
-		  .describe("Tmp workspace for convolution (MB).");
+		  .describe("Tmp workspace for the gpu implementation (MB). "
+		            "The cpu implementation needs no workspace.");
+	  DMLC_DECLARE_FIELD(layout)
+		  .add_enum("NCHW", mshadow::kNCHW)
+		  .add_enum("NHWC", mshadow::kNHWC)
+		  .set_default(mshadow::kNCHW)
+		  .describe("Layout of the data: channels first (NCHW) or channels last (NHWC).");
   }
 };
 
@@ -41,7 +145,8 @@ template<typename xpu, typename DType>
 class ReorderOp : public Operator {
  public:
 	 explicit ReorderOp(ReorderParam param)
-		 : size_(param.branch_factor), workspace_((param.workspace << 20) / sizeof(DType))  {
+		 : size_(param.branch_factor), workspace_((param.workspace << 20) / sizeof(DType)),
+		   layout_(param.layout)  {
   }
 
   virtual void Forward(const OpContext &ctx,
@@ -58,6 +163,14 @@ class ReorderOp : public Operator {
 	Tensor<xpu, 4, DType> data = in_data[reord::kData].get<xpu, 4, DType>(s);
 	Shape<4> data_shape = data.shape_;
 	Tensor<xpu, 4, DType> out = out_data[reord::kOut].get<xpu, 4, DType>(s);
+	if (layout_ == mshadow::kNHWC) {
+		this->PermuteNHWC(ctx, data, out, size_, req[reord::kOut]);
+		return;
+	}
+	if (xpu::kDevCPU) {
+		this->Permute(data, out, size_, fwd_leaders_, req[reord::kOut]);
+		return;
+	}
 
 	Tensor<xpu, 1, DType> workspace =
 		ctx.requested[reord::kTempSpace].get_space_typed<xpu, 1, DType>(
@@ -87,9 +200,20 @@ class ReorderOp : public Operator {
     using namespace mshadow;
     using namespace mshadow::expr;
     CHECK_EQ(in_grad.size(), static_cast<size_t>(1));
+    if (req[reord::kData] == kNullOp) return;
     Stream<xpu> *s = ctx.get_stream<xpu>();
 	Tensor<xpu, 4, DType> grad_data = in_grad[reord::kData].get<xpu, 4, DType>(s);
 	Tensor<xpu, 4, DType> grad_out = out_grad[reord::kOut].get<xpu, 4, DType>(s);
+	if (layout_ == mshadow::kNHWC) {
+		this->PermuteNHWC(ctx, grad_out, grad_data, grad_out.size(3) / size_,
+		                  req[reord::kData]);
+		return;
+	}
+	if (xpu::kDevCPU) {
+		this->Permute(grad_out, grad_data, grad_out.size(1) / size_, bwd_leaders_,
+		              req[reord::kData]);
+		return;
+	}
 
 
 	Tensor<xpu, 1, DType> workspace =
@@ -121,6 +245,67 @@ class ReorderOp : public Operator {
   }
 
  private:
+	 // cpu path: single pass from src to dst, or cycle-following when the
+	 // executor has granted the in-place option (src and dst share memory)
+	 inline void Permute(const mshadow::Tensor<xpu, 4, DType> &src,
+		 const mshadow::Tensor<xpu, 4, DType> &dst, index_t group,
+		 std::vector<index_t> &leaders, OpReqType req) {
+		 const index_t channel = src.size(1);
+		 const index_t spatial = src.size(2) * src.size(3);
+		 if (src.dptr_ != dst.dptr_) {
+			 reord::ReorderChannels(src.dptr_, dst.dptr_, src.size(0), channel,
+				 spatial, group, req);
+			 return;
+		 }
+		 CHECK_NE(req, kAddTo) << "Reorder cannot accumulate in place";
+		 if (leaders_channel_ != channel) {
+			 fwd_leaders_ = reord::CycleLeaders(channel, size_);
+			 bwd_leaders_ = reord::CycleLeaders(channel, channel / size_);
+			 leaders_channel_ = channel;
+		 }
+		 reord::ReorderChannelsInplace(dst.dptr_, src.size(0), channel, spatial,
+			 group, leaders);
+	 }
+	 // channels-last: each pixel's channels form a (group, channel/group) matrix
+	 // which is transposed; on gpus through the workspace, a chunk of pixels at a time
+	 inline void PermuteNHWC(const OpContext &ctx,
+		 const mshadow::Tensor<xpu, 4, DType> &src,
+		 const mshadow::Tensor<xpu, 4, DType> &dst, index_t group, OpReqType req) {
+		 using namespace mshadow;
+		 using namespace mshadow::expr;
+		 const index_t channel = src.size(3);
+		 const index_t npixel = src.shape_.Size() / channel;
+		 if (xpu::kDevCPU) {
+			 if (src_channel_.size() != channel || src_group_ != group) {
+				 src_channel_.resize(channel);
+				 for (index_t c = 0; c < channel; ++c) {
+					 src_channel_[c] = reord::SrcChannel(c, channel, group);
+				 }
+				 src_group_ = group;
+			 }
+			 CHECK(src.dptr_ != dst.dptr_ || req != kAddTo)
+				 << "Reorder cannot accumulate in place";
+			 reord::ReorderPixels(src.dptr_, dst.dptr_, npixel, channel, src_channel_, req);
+			 return;
+		 }
+		 Stream<xpu> *s = ctx.get_stream<xpu>();
+		 CHECK_GE(workspace_, channel)
+			 << "\nMinimum workspace size: " << channel * sizeof(DType) << " Bytes\n"
+			 << "Given: " << workspace_ * sizeof(DType) << " Bytes";
+		 const index_t step = std::min(static_cast<index_t>(workspace_ / channel), npixel);
+		 Tensor<xpu, 1, DType> workspace =
+			 ctx.requested[reord::kTempSpace].get_space_typed<xpu, 1, DType>(
+			 Shape1(step * channel), s);
+		 Tensor<xpu, 3, DType> in3(src.dptr_, Shape3(npixel, group, channel / group), s);
+		 Tensor<xpu, 3, DType> out3(dst.dptr_, Shape3(npixel, channel / group, group), s);
+		 for (index_t i = 0; i < npixel; i += step) {
+			 const index_t len = std::min(step, npixel - i);
+			 Tensor<xpu, 3, DType> temp(workspace.dptr_, Shape3(len, channel / group, group), s);
+			 temp = swapaxis<2, 1>(in3.Slice(i, i + len));
+			 Tensor<xpu, 3, DType> out_slice = out3.Slice(i, i + len);
+			 Assign(out_slice, req, temp);
+		 }
+	 }
 	 inline index_t InitTemp(const mshadow::Shape<4> &ishape,
 		 const mshadow::Shape<4> &oshape) {
 		 shape_dstunit_ = mshadow::Shape3(size_,
@@ -143,8 +328,15 @@ class ReorderOp : public Operator {
 	 }
 	 uint32_t size_;
 	 uint64_t workspace_;
+	 int layout_;
+	 // input channel of every output channel, channels-last cpu path
+	 std::vector<index_t> src_channel_;
+	 index_t src_group_ = 0;
 	 mshadow::Shape<3> shape_dstunit_;
 	 index_t nstep_;
+	 std::vector<index_t> fwd_leaders_;
+	 std::vector<index_t> bwd_leaders_;
+	 index_t leaders_channel_ = 0;
 };  // class ReorderOp
 
 // Decalre Factory function, used for dispatch specialization
@@ -174,7 +366,9 @@ class ReorderProp : public OperatorProperty {
 	CHECK_EQ(in_shape->size(), static_cast<size_t>(1));
 	TShape dshape = in_shape->at(reord::kData);
 	if (dshape.ndim() == 0) return false;
-	CHECK_EQ(dshape[1] % param_.branch_factor, 0);
+	CHECK_EQ(dshape.ndim(), 4) << "Reorder only supports 4D input";
+	const index_t channel = dshape[param_.layout == mshadow::kNHWC ? 3 : 1];
+	CHECK_EQ(channel % param_.branch_factor, 0);
     //setup the output shape
     out_shape->clear();
     out_shape->push_back(in_shape->at(0));
@@ -12,8 +12,8 @@ Operator* CreateOp<cpu>(ReorderParam param, int dtype) {
 	  op = new ReorderOp<cpu, double>(param);
     break;
   case mshadow::kFloat16:
-    LOG(FATAL) << "float16 fully connected layer is currently"
-                  "only supported by CuDNN version.";
+    // the cpu kernel only moves elements (and adds them for kAddTo)
+    op = new ReorderOp<cpu, mshadow::half::half_t>(param);
     break;
   default:
     LOG(FATAL) << "Unsupported type " << dtype;
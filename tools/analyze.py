@@ -0,0 +1,244 @@
+'''
+Analytical cost of a network: multiply-adds, parameters, memory traffic and activation memory of
+every layer and of the whole network, for a given input shape, without running or binding anything.
+Works on the raw symbol json (tools/graph.py), so the shipped models/*/*-symbol.json files with
+Reorder operators are analysed by a stock MXNet build; --network builds network/<network>.py instead.
+
+Per layer, on the forward pass:
+ - MACs: multiply-adds of Convolution (num_group included), FullyConnected, GroupPointwise and IGC
+   (both convolutions); the other operators count none. The FLOPs of the README table are MACs.
+ - bytes: activations and parameters read plus outputs written. A Reorder is a gather, it moves
+   its input once each way; Flatten and Reshape are views and move nothing.
+ - FLOPs/byte: arithmetic intensity, 2*MACs/bytes.
+Activation memory at inference is the peak of the outputs alive at once when the layers run in
+order, each freed after its last reader. In training every output is kept for the backward pass,
+except the layers under force_mirroring (--mirror), which are recomputed instead: their MACs are
+added to the training MACs, three times the forward ones (data and weight gradients). In-place
+operators and the memory sharing of the MXNet planner are not modelled, so both are upper bounds.
+
+Usage: python tools/analyze.py --symbol=models/IGC-L16M16_ImageNet/resnet_gcwf_noshare_imagenet_d18b16-symbol.json --data-shape=224
+       python tools/analyze.py --network=resnet_igc --depth=38 --primary-partition=4 --secondary-partition=8 --data-shape=32
+'''
+import numpy as np
+import argparse
+import json
+import logging
+from graph import Graph
+
+VIEW_OPS=('Flatten', 'flatten', 'Reshape', 'reshape')
+
+def _true(value):
+    return value in ('True', 'true', '1')
+
+def _channel_axis(graph, idx):
+    attrs=graph.attrs(idx)
+    if graph.op(idx)=='BatchNorm':
+        return int(attrs.get('axis', 1))
+    return 3 if attrs.get('layout', 'NCHW')=='NHWC' else 1
+
+def _spatial(graph, idx, shape):
+    """(N, H, W, C) of a 4d shape in the layout of `idx`"""
+    if _channel_axis(graph, idx)==3:
+        return shape
+    return (shape[0], shape[2], shape[3], shape[1])
+
+def _shape(graph, idx, n, h, w, c):
+    return (n, h, w, c) if _channel_axis(graph, idx)==3 else (n, c, h, w)
+
+def _window(size, kernel, stride, pad, dilate=1, ceil=False):
+    span=dilate*(kernel-1)+1
+    if ceil:
+        return int(np.ceil(float(size+2*pad-span)/stride))+1
+    return (size+2*pad-span)//stride+1
+
+def _conv(graph, idx, shape, num_filter):
+    """Output shape of a spatial convolution of `idx` reading `shape`"""
+    n, h, w, _=_spatial(graph, idx, shape)
+    kernel=graph.tuple_attr(idx, 'kernel')
+    stride=graph.tuple_attr(idx, 'stride', (1, 1))
+    pad=graph.tuple_attr(idx, 'pad', (0, 0))
+    dilate=graph.tuple_attr(idx, 'dilate', (1, 1))
+    ho=_window(h, kernel[0], stride[0], pad[0], dilate[0])
+    wo=_window(w, kernel[1], stride[1], pad[1], dilate[1])
+    return _shape(graph, idx, n, ho, wo, num_filter)
+
+def _layer(graph, idx, shapes):
+    """(output shape, MACs, parameter count) of node `idx` with input shapes `shapes`"""
+    op=graph.op(idx)
+    attrs=graph.attrs(idx)
+    shape=shapes[0]
+    if op=='Convolution':
+        groups=graph.int_attr(idx, 'num_group', 1)
+        num_filter=graph.int_attr(idx, 'num_filter')
+        out=_conv(graph, idx, shape, num_filter)
+        kernel=graph.tuple_attr(idx, 'kernel')
+        weights=num_filter*shape[_channel_axis(graph, idx)]//groups*int(np.prod(kernel))
+        params=weights+(0 if _true(attrs.get('no_bias', 'False')) else num_filter)
+        return out, int(np.prod(out))//num_filter*weights, params
+    if op=='IGC': #primary group convolution and secondary 1x1 group convolution in one operator
+        num_filter=graph.int_attr(idx, 'num_filter')
+        out=_conv(graph, idx, shape, num_filter)
+        kernel=graph.tuple_attr(idx, 'kernel')
+        weights=num_filter*shape[1]//graph.int_attr(idx, 'primary_partition')*int(np.prod(kernel))
+        weights+=num_filter*num_filter//graph.int_attr(idx, 'secondary_partition')
+        return out, int(np.prod(out))//num_filter*weights, weights
+    if op=='GroupPointwise':
+        num_filter=graph.int_attr(idx, 'num_filter')
+        out=(shape[0], num_filter)+tuple(shape[2:])
+        weights=num_filter*shape[1]//graph.int_attr(idx, 'num_group', 1)
+        params=weights+(0 if _true(attrs.get('no_bias', 'False')) else num_filter)
+        return out, int(np.prod(out))//num_filter*weights, params
+    if op=='FullyConnected':
+        num_hidden=graph.int_attr(idx, 'num_hidden')
+        inputs=int(np.prod(shape[1:])) if attrs.get('flatten', 'True')!='False' else shape[-1]
+        out=(shape[0], num_hidden) if attrs.get('flatten', 'True')!='False' else tuple(shape[:-1])+(num_hidden,)
+        params=num_hidden*inputs+(0 if _true(attrs.get('no_bias', 'False')) else num_hidden)
+        return out, int(np.prod(out))*inputs, params
+    if op=='Pooling':
+        n, h, w, c=_spatial(graph, idx, shape)
+        if _true(attrs.get('global_pool', 'False')):
+            return _shape(graph, idx, n, 1, 1, c), 0, 0
+        kernel=graph.tuple_attr(idx, 'kernel')
+        stride=graph.tuple_attr(idx, 'stride', (1, 1))
+        pad=graph.tuple_attr(idx, 'pad', (0, 0))
+        ceil=attrs.get('pooling_convention', 'valid')=='full'
+        return _shape(graph, idx, n, _window(h, kernel[0], stride[0], pad[0], ceil=ceil),
+                      _window(w, kernel[1], stride[1], pad[1], ceil=ceil), c), 0, 0
+    if op=='BatchNorm':
+        return shape, 0, 2*shape[_channel_axis(graph, idx)] #gamma and beta, the moving statistics are auxiliary states
+    if op in VIEW_OPS:
+        if op in ('Flatten', 'flatten'):
+            return (shape[0], int(np.prod(shape[1:]))), 0, 0
+        target=graph.tuple_attr(idx, 'shape')
+        if target and all(d>0 for d in target):
+            return target, 0, 0
+        raise ValueError('unsupported reshape %s of %s'%(attrs.get('shape'), graph.name(idx)))
+    if op=='transpose':
+        axes=graph.tuple_attr(idx, 'axes') or tuple(reversed(range(len(shape))))
+        return tuple(shape[a] for a in axes), 0, 0
+    if op=='Concat':
+        dim=graph.int_attr(idx, 'dim', 1)
+        out=list(shape)
+        out[dim]=sum(s[dim] for s in shapes)
+        return tuple(out), 0, 0
+    #elementwise: Reorder, Activation, Dropout, SoftmaxOutput, Cast, the adds, ...
+    return shape, 0, 0
+
+def analyze(graph, data_shape, dtype_size=4):
+    """Cost of every layer of `graph` (a tools/graph.py Graph) for a `data_shape` input.
+    Returns (layers, totals): layers is a list of dicts with the name, op, output shape, params,
+    macs, bytes and activation (output bytes) of each operator node, in execution order."""
+    shapes={}
+    sizes={} #bytes of the buffer of each node, 0 for views
+    alias={} #views point to the node owning their buffer
+    layers=[]
+    for idx, node in enumerate(graph.nodes):
+        if node['op']=='null':
+            if node['name']=='data':
+                shapes[idx]=tuple(data_shape)
+                sizes[idx]=dtype_size*int(np.prod(data_shape))
+            continue
+        #parameters and labels are variables the shape of which follows from the layer
+        inputs=[e[0] for e in node['inputs'] if e[0] in shapes]
+        out, macs, params=_layer(graph, idx, [shapes[i] for i in inputs])
+        shapes[idx]=out
+        read=sum(sizes[i] if graph.op(i) not in VIEW_OPS else sizes[alias[i]] for i in inputs)
+        if node['op'] in VIEW_OPS:
+            alias[idx]=alias.get(inputs[0], inputs[0])
+            sizes[idx]=0
+            moved=0
+        else:
+            sizes[idx]=dtype_size*int(np.prod(out))
+            moved=read+dtype_size*params+sizes[idx]
+        layers.append({'name': node['name'], 'op': node['op'], 'shape': out, 'params': params, 'macs': macs,
+                       'bytes': moved, 'activation': sizes[idx], 'inputs': inputs,
+                       'mirror': _true(graph.attrs(idx).get('__force_mirroring__', 'False'))})
+    return layers, _totals(graph, layers, sizes, alias)
+
+def _totals(graph, layers, sizes, alias):
+    owner=lambda i: alias.get(i, i)
+    #inference: run the layers in order, free a buffer after its last reader
+    last={}
+    for step, layer in enumerate(layers):
+        for i in layer['inputs']:
+            last[owner(i)]=step
+    for h in graph.graph['heads']:
+        last[owner(h[0])]=len(layers)
+    data=[i for i, n in enumerate(graph.nodes) if n['op']=='null' and n['name']=='data']
+    live=sum(sizes[i] for i in data)
+    peak=live
+    for step, layer in enumerate(layers):
+        live+=layer['activation']
+        peak=max(peak, live)
+        for i in set(owner(i) for i in layer['inputs']):
+            if last.get(i)==step:
+                live-=sizes[i]
+    #training: every output not recomputed stays until the backward pass
+    saved=sum(sizes[i] for i in data)+sum(l['activation'] for l in layers if not l['mirror'])
+    macs=sum(l['macs'] for l in layers)
+    moved=sum(l['bytes'] for l in layers)
+    return {'params': sum(l['params'] for l in layers), 'macs': macs,
+            'training_macs': 3*macs+sum(l['macs'] for l in layers if l['mirror']),
+            'bytes': moved, 'intensity': 2.0*macs/moved if moved else 0.0,
+            'inference_activations': peak, 'training_activations': saved}
+
+def analyze_symbol(symbol, data_shape, dtype_size=4):
+    """analyze() of an mx.sym.Symbol"""
+    return analyze(Graph(json.loads(symbol.tojson())), data_shape, dtype_size)
+
+def format_table(layers, totals, data_shape):
+    MB=1024.0**2
+    lines=['layer\top\toutput\tparams\tMACs (M)\tbytes (MB)\tFLOPs/byte\tactivation (MB)']
+    for l in layers:
+        lines.append('%s\t%s\t%s\t%d\t%.2f\t%.2f\t%.1f\t%.2f'%(l['name'], l['op']+(' (mirror)' if l['mirror'] else ''),
+                     'x'.join(str(d) for d in l['shape']), l['params'], l['macs']/1e6, l['bytes']/MB,
+                     2.0*l['macs']/l['bytes'] if l['bytes'] else 0.0, l['activation']/MB))
+    lines.append('input %s: %.4fM params, %.3f GMACs forward, %.3f GMACs training, %.1f MB moved forward (%.1f FLOPs/byte), '
+                 'activations %.1f MB at inference, %.1f MB in training'%('x'.join(str(d) for d in data_shape),
+                 totals['params']/1e6, totals['macs']/1e9, totals['training_macs']/1e9, totals['bytes']/MB,
+                 totals['intensity'], totals['inference_activations']/MB, totals['training_activations']/MB))
+    return '\n'.join(lines)
+
+def load_graph(args):
+    if args.symbol:
+        return Graph.load(args.symbol)
+    import importlib
+    import sys
+    sys.path.insert(0, 'network')
+    kwargs={'impl': args.igc_impl} if args.igc_impl!='default' else {}
+    if args.layout!='NCHW':
+        kwargs['layout']=args.layout
+    if args.mirror:
+        kwargs['mirror']=tuple(int(stage) for stage in args.mirror.split(','))
+    symbol=importlib.import_module(args.network).get_symbol(args.num_classes, args.depth, args.primary_partition,
+                                                            args.secondary_partition, **kwargs)
+    return Graph(json.loads(symbol.tojson()))
+
+def main():
+    parser = argparse.ArgumentParser(description='count the MACs, memory traffic and activation memory of a network')
+    parser.add_argument('--symbol', type=str, help='a symbol json file, e.g., of models/')
+    parser.add_argument('--network', type=str, help='a network of network/ to build instead')
+    parser.add_argument('--depth', type=int, default=38, help='the network depth')
+    parser.add_argument('--primary-partition', type=int, default=4, help='primary partition number')
+    parser.add_argument('--secondary-partition', type=int, default=8, help='secondary partition number')
+    parser.add_argument('--num-classes', type=int, default=10, help='the number of classes')
+    parser.add_argument('--igc-impl', type=str, default='default', choices=['default', 'batched', 'fused'], help='the igc block implementation')
+    parser.add_argument('--layout', type=str, default='NCHW', choices=['NCHW', 'NHWC'], help='the feature map layout')
+    parser.add_argument('--mirror', type=str, default='', help='the stages recomputed in backward, e.g., 1,2')
+    parser.add_argument('--data-shape', type=int, default=32, help='the image size')
+    parser.add_argument('--batch-size', type=int, default=1, help='the batch size')
+    parser.add_argument('--dtype', type=str, default='float32', choices=['float32', 'float16'], help='the type of activations and weights')
+    parser.add_argument('--output', type=str, help='also write the layers and totals as json')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    if not args.symbol and not args.network:
+        parser.error('--symbol or --network is required')
+    data_shape=(args.batch_size, 3, args.data_shape, args.data_shape)
+    layers, totals=analyze(load_graph(args), data_shape, np.dtype(args.dtype).itemsize)
+    logging.info(format_table(layers, totals, data_shape))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'data_shape': data_shape, 'layers': layers, 'totals': totals}, f, indent=2)
+
+if __name__ == '__main__':
+    main()
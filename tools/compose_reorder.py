@@ -0,0 +1,223 @@
+'''
+Cancel Reorder operators against each other across channel-wise layers.
+Works on training graphs (symbol only) as well as trained models (symbol and params).
+
+A channel permutation commutes with BatchNorm, Activation, Dropout and Pooling, and
+with an elementwise add whose inputs are all permuted the same way. The pass
+ 1. drops Reorders that are the identity,
+ 2. merges Reorders applying the same permutation to the same tensor into one gather,
+ 3. moves Reorders forward through channel-wise layers and elementwise adds when
+    this lets them meet another Reorder (or a Pooling, which shrinks the moved data),
+ 4. composes two consecutive Reorders into one, or drops both if the product is the identity.
+Every removed Reorder is one gather less in the forward pass and one less in the backward pass.
+
+Usage: python tools/compose_reorder.py --model-prefix=<prefix> [--load-epoch=100] --save-prefix=<prefix>-composed
+'''
+import mxnet as mx
+import numpy as np
+import argparse
+import json
+import logging
+from graph import Graph, CHANNEL_WISE, reorder_perm, inverse_perm, load_params, save_params
+
+#elementwise sums, old and new operator names
+ADD_OPS=('_Plus', '_plus', 'elemwise_add', 'ElementWiseSum', 'add_n')
+
+def _same_kind(graph, a, b):
+    return graph.attrs(a).get('layout', 'NCHW')==graph.attrs(b).get('layout', 'NCHW')
+
+def _redirect(graph, old, new, skip=None):
+    """Make every reader of output 0 of `old` (except `skip`) read `new` instead"""
+    for i, n in enumerate(graph.nodes):
+        if i==skip or i in graph.removed:
+            continue
+        for e in n['inputs']:
+            if e[0]==old and e[1]==0:
+                e[0]=new
+    for h in graph.graph['heads']:
+        if h[0]==old and h[1]==0:
+            h[0]=new
+
+def _swap(graph, idx, node, arg_params, aux_params):
+    """x -> Reorder -> node -> users  becomes  x -> node -> Reorder -> users"""
+    if graph.op(node)=='BatchNorm':
+        inv=inverse_perm(graph.permutation(idx))
+        args, auxs=graph.bn_names(node)
+        for params, names in [(arg_params, args), (aux_params, auxs)]:
+            for name in names:
+                if name in params:
+                    params[name]=params[name][inv]
+    _redirect(graph, node, idx)
+    entry=graph.nodes[idx]['inputs'][0]
+    graph.nodes[node]['inputs'][0]=list(entry)
+    graph.nodes[idx]['inputs'][0]=[node, 0]+[0]*(len(entry)-2)
+
+def _channel_wise(graph, idx, node):
+    """`node` is a channel-wise layer reading nothing but `idx` as data"""
+    return node is not None and graph.op(node) in CHANNEL_WISE and graph.input(node)==idx
+
+def _chain(graph, idx):
+    """Channel-wise layers after `idx` and the first node that is not one"""
+    chain=[]
+    cur=idx
+    while True:
+        nxt=graph.sole_consumer(cur)
+        if not _channel_wise(graph, cur, nxt):
+            return chain, nxt
+        chain.append(nxt)
+        cur=nxt
+
+def _source(graph, entry):
+    """The Reorder producing `entry` through single-consumer channel-wise layers, or None"""
+    idx=entry[0]
+    while graph.op(idx) in CHANNEL_WISE:
+        if graph.sole_consumer(idx) is None:
+            return None
+        idx=graph.input(idx)
+    if graph.op(idx)!='Reorder' or graph.sole_consumer(idx) is None:
+        return None
+    return idx
+
+def _same_permutation(graph, reorders):
+    first=reorders[0]
+    return all(_same_kind(graph, first, r) and np.array_equal(graph.permutation(first), graph.permutation(r))
+               for r in reorders[1:])
+
+def _add_ready(graph, add):
+    """Reorders feeding `add` if all of its inputs are permuted the same way"""
+    reorders=[_source(graph, e) for e in graph.nodes[add]['inputs']]
+    if None in reorders or len(set(reorders))<len(reorders) or not _same_permutation(graph, reorders):
+        return None
+    return reorders
+
+#each step returns whether it changed the graph
+def drop_identity(graph, idx, arg_params, aux_params):
+    channels=graph.channels(idx)
+    if channels is None or graph.int_attr(idx, 'branch_factor') not in (1, channels):
+        return False
+    graph.bypass(idx)
+    return True
+
+def merge_siblings(graph, idx, arg_params, aux_params):
+    """Reorders of the same tensor with the same permutation become one gather"""
+    entry=graph.nodes[idx]['inputs'][0]
+    merged=False
+    for other in graph.ops('Reorder'):
+        e=graph.nodes[other]['inputs'][0]
+        if (other!=idx and e[0]==entry[0] and e[1]==entry[1] and _same_kind(graph, idx, other)
+                and graph.int_attr(other, 'branch_factor')==graph.int_attr(idx, 'branch_factor')):
+            _redirect(graph, other, idx)
+            graph.removed.add(other)
+            merged=True
+    return merged
+
+def compose(graph, idx, arg_params, aux_params):
+    """Reorder followed by Reorder: one gather, or none if they cancel"""
+    nxt=graph.sole_consumer(idx)
+    if nxt is None or graph.op(nxt)!='Reorder' or not _same_kind(graph, idx, nxt):
+        return False
+    #out[c] = mid[second[c]] = in[first[second[c]]]
+    total=graph.permutation(idx)[graph.permutation(nxt)]
+    if np.array_equal(total, np.arange(len(total))):
+        graph.bypass(nxt)
+        graph.bypass(idx)
+        return True
+    for factor in range(2, len(total)):
+        if len(total)%factor==0 and np.array_equal(total, reorder_perm(len(total), factor)):
+            graph.attrs(nxt)['branch_factor']=str(factor)
+            graph.bypass(idx)
+            return True
+    return False
+
+def sink(graph, idx, arg_params, aux_params):
+    """Move a Reorder after the channel-wise layers following it when it meets something there"""
+    chain, end=_chain(graph, idx)
+    if end is None or not chain:
+        return False
+    useful=graph.op(end)=='Reorder' or any(graph.op(n)=='Pooling' for n in chain)
+    if graph.op(end) in ADD_OPS:
+        useful=_add_ready(graph, end) is not None
+    if not useful:
+        return False
+    for node in chain:
+        _swap(graph, idx, node, arg_params, aux_params)
+    return True
+
+def hoist(graph, idx, arg_params, aux_params):
+    """add(P a, P b) becomes P add(a, b)"""
+    add=graph.sole_consumer(idx)
+    if add is None or graph.op(add) not in ADD_OPS:
+        return False
+    reorders=_add_ready(graph, add)
+    if reorders is None or any(graph.sole_consumer(r)!=add for r in reorders):
+        return False
+    inputs=graph.nodes[add]['inputs']
+    for k, r in enumerate(reorders):
+        inputs[k]=list(graph.nodes[r]['inputs'][0])
+    keep=reorders[0]
+    _redirect(graph, add, keep)
+    entry=graph.nodes[keep]['inputs'][0]
+    graph.nodes[keep]['inputs'][0]=[add, 0]+[0]*(len(entry)-2)
+    graph.removed.update(reorders[1:])
+    return True
+
+STEPS=[('identity', drop_identity), ('merged', merge_siblings), ('composed', compose),
+       ('added', hoist), ('moved', sink)]
+
+def compose_reorders(graph, arg_params, aux_params):
+    """Remove Reorder nodes in place, returns the number of removed nodes per step"""
+    stats={name: 0 for name, _ in STEPS if name!='moved'}
+    changed=True
+    while changed:
+        changed=False
+        for idx in graph.ops('Reorder'):
+            if idx in graph.removed:
+                continue
+            for name, func in STEPS:
+                count=len(graph.ops('Reorder'))
+                if func(graph, idx, arg_params, aux_params):
+                    changed=True
+                    if name in stats:
+                        stats[name]+=count-len(graph.ops('Reorder'))
+                    break
+    return stats
+
+def compose_symbol(symbol):
+    """Apply the pass to a symbol built for training, returns (symbol, removed Reorders)"""
+    graph=Graph(json.loads(symbol.tojson()))
+    total=len(graph.ops('Reorder'))
+    stats=compose_reorders(graph, {}, {})
+    removed=total-len(graph.ops('Reorder'))
+    logging.info('removed %d of %d Reorder nodes (%d gathers per forward-backward pass): %s',
+                 removed, total, 2*removed, stats)
+    return mx.sym.load_json(graph.tojson()), removed
+
+def main():
+    parser = argparse.ArgumentParser(description='cancel Reorder operators against each other across channel-wise layers')
+    parser.add_argument('--model-prefix', type=str, required=True, help='the prefix of the model to rewrite')
+    parser.add_argument('--load-epoch', type=int, help='the epoch of the params to rewrite; only the symbol is rewritten if not given')
+    parser.add_argument('--save-prefix', type=str, required=True, help='the prefix of the rewritten model')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    graph=Graph.load(args.model_prefix+'-symbol.json')
+    arg_params, aux_params={}, {}
+    if args.load_epoch is not None:
+        arg_params, aux_params=load_params(args.model_prefix, args.load_epoch)
+    total=len(graph.ops('Reorder'))
+    stats=compose_reorders(graph, arg_params, aux_params)
+    removed=total-len(graph.ops('Reorder'))
+    logging.info('removed %d of %d Reorder nodes (%d gathers per forward-backward pass): %s',
+                 removed, total, 2*removed, stats)
+    stages={}
+    for idx in graph.ops('Reorder'):
+        stage=graph.name(idx).split('_')[0]
+        stages[stage]=stages.get(stage, 0)+1
+    logging.info('remaining Reorder nodes per stage: %s', ', '.join('%s: %d'%kv for kv in sorted(stages.items())))
+
+    graph.save(args.save_prefix+'-symbol.json')
+    if args.load_epoch is not None:
+        save_params(args.save_prefix, args.load_epoch, arg_params, aux_params)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,37 @@
+'''
+Convert the convolution weights of a checkpoint between the NCHW and NHWC networks.
+NCHW graphs store the weights as (out, in, kh, kw), NHWC graphs as (out, kh, kw, in);
+every other parameter is shared. The symbol of the converted model is not written:
+build it with the `layout` argument of get_symbol (--layout for the training scripts).
+
+Usage: python tools/convert_layout.py --model-prefix=<prefix> --load-epoch=100 --save-prefix=<prefix>-nhwc --layout=NHWC
+'''
+import argparse
+import logging
+from graph import load_params, save_params
+
+AXES={'NHWC': (0, 2, 3, 1), 'NCHW': (0, 3, 1, 2)}
+
+def convert_params(arg_params, layout):
+    """Transpose the 4d weights of `arg_params` to `layout`, returns the converted names"""
+    names=[k for k, v in arg_params.items() if v.ndim==4]
+    for name in names:
+        arg_params[name]=arg_params[name].transpose(AXES[layout]).copy()
+    return names
+
+def main():
+    parser = argparse.ArgumentParser(description='convert a checkpoint between NCHW and NHWC networks')
+    parser.add_argument('--model-prefix', type=str, required=True, help='the prefix of the model to convert')
+    parser.add_argument('--load-epoch', type=int, required=True, help='the epoch of the params to convert')
+    parser.add_argument('--save-prefix', type=str, required=True, help='the prefix of the converted model')
+    parser.add_argument('--layout', type=str, default='NHWC', choices=['NHWC', 'NCHW'], help='the layout of the converted model')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    arg_params, aux_params=load_params(args.model_prefix, args.load_epoch)
+    names=convert_params(arg_params, args.layout)
+    save_params(args.save_prefix, args.load_epoch, arg_params, aux_params)
+    logging.info('transposed %d weights to %s, saved to %s-%04d.params', len(names), args.layout, args.save_prefix, args.load_epoch)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,191 @@
+'''
+Fold the Reorder operators of a trained network into the weights of the neighbouring layers.
+The folded symbol/params pair computes the same outputs without any Reorder node,
+so it can be deployed on a stock MXNet build.
+
+A Reorder is removed, in this order, when
+ 1. it is the identity (branch_factor is 1 or the channel number),
+ 2. only channel-wise layers (BatchNorm, Activation, Pooling, Flatten) separate it from a
+    dense Convolution/FullyConnected reading it: their parameters absorb the permutation,
+ 3. only channel-wise layers separate it from a dense Convolution producing it,
+ 4. it feeds or follows a 1x1 group convolution (the secondary convolution of an igc block):
+    the convolution and its Reorders become one dense 1x1 convolution.
+Step 4 trades the two copies for more multiply-adds and can be disabled with --no-densify.
+
+Usage: python tools/fold_reorder.py --model-prefix=<prefix> --load-epoch=100 --save-prefix=<prefix>-folded
+'''
+import mxnet as mx
+import numpy as np
+import argparse
+import logging
+from graph import Graph, CHANNEL_WISE, reorder_perm, inverse_perm, load_params, save_params
+
+def _permute(params, name, func):
+    if name in params:
+        params[name]=func(params[name])
+
+def _perm(graph, idx):
+    channels=graph.channels(idx)
+    assert channels is not None, 'unknown channel number of %s'%graph.name(idx)
+    return reorder_perm(channels, graph.int_attr(idx, 'branch_factor'))
+
+def _is_dense(graph, idx):
+    return graph.op(idx)=='FullyConnected' or (graph.op(idx)=='Convolution' and graph.int_attr(idx, 'num_group', 1)==1)
+
+def fold_identity(graph, idx, arg_params, aux_params):
+    channels=graph.channels(idx)
+    if channels is None or graph.int_attr(idx, 'branch_factor') not in (1, channels):
+        return False
+    graph.bypass(idx)
+    return True
+
+def fold_forward(graph, idx, arg_params, aux_params):
+    """Move the permutation into the consumers: out[c]=in[perm[c]]"""
+    chain=[]
+    cur=idx
+    while True:
+        nxt=graph.sole_consumer(cur)
+        if nxt is None or graph.input(nxt)!=cur:
+            return False
+        if graph.op(nxt) in CHANNEL_WISE or graph.op(nxt)=='Flatten':
+            chain.append(nxt)
+            cur=nxt
+        elif _is_dense(graph, nxt):
+            break
+        else:
+            return False
+    inv=inverse_perm(_perm(graph, idx))
+    for node in chain:
+        if graph.op(node)=='BatchNorm':
+            args, auxs=graph.bn_names(node)
+            for name in args:
+                _permute(arg_params, name, lambda v: v[inv])
+            for name in auxs:
+                _permute(aux_params, name, lambda v: v[inv])
+    weight=graph.weight_name(nxt)
+    if graph.op(nxt)=='Convolution':
+        _permute(arg_params, weight, lambda v: v[:, inv])
+    else: #flattened (channel, y, x) features
+        def fc(v):
+            return v.reshape(v.shape[0], len(inv), -1)[:, inv, :].reshape(v.shape)
+        _permute(arg_params, weight, fc)
+    graph.bypass(idx)
+    return True
+
+def fold_backward(graph, idx, arg_params, aux_params):
+    """Move the permutation into the producer"""
+    chain=[]
+    cur=idx
+    while True:
+        prev=graph.input(cur)
+        if graph.sole_consumer(prev)!=cur:
+            return False
+        if graph.op(prev) in CHANNEL_WISE:
+            chain.append(prev)
+            cur=prev
+        elif graph.op(prev)=='Convolution' and _is_dense(graph, prev):
+            break
+        else:
+            return False
+    perm=_perm(graph, idx)
+    for node in chain:
+        if graph.op(node)=='BatchNorm':
+            args, auxs=graph.bn_names(node)
+            for name in args:
+                _permute(arg_params, name, lambda v: v[perm])
+            for name in auxs:
+                _permute(aux_params, name, lambda v: v[perm])
+    _permute(arg_params, graph.weight_name(prev), lambda v: v[perm])
+    if graph.bias_name(prev) is not None:
+        _permute(arg_params, graph.bias_name(prev), lambda v: v[perm])
+    graph.bypass(idx)
+    return True
+
+def densify(graph, conv, arg_params, aux_params):
+    """Merge a 1x1 group convolution with the Reorder before and/or after it"""
+    if graph.op(conv)!='Convolution' or graph.tuple_attr(conv, 'kernel')!=(1, 1):
+        return 0
+    groups=graph.int_attr(conv, 'num_group', 1)
+    before=graph.input(conv)
+    after=graph.sole_consumer(conv)
+    before=before if graph.op(before)=='Reorder' and graph.sole_consumer(before)==conv else None
+    after=after if after is not None and graph.op(after)=='Reorder' else None
+    if before is None and after is None:
+        return 0
+    num_in=graph.channels(graph.input(conv))
+    num_out=graph.int_attr(conv, 'num_filter')
+    s1=_perm(graph, before) if before is not None else np.arange(num_in)
+    s2=_perm(graph, after) if after is not None else np.arange(num_out)
+    #out[o] = sum_i w[s2[o], i] * in[s1[g*span_in + i]], g the group of channel s2[o]
+    span_in, span_out=num_in//groups, num_out//groups
+    cols=s1[(s2//span_out*span_in)[:, None]+np.arange(span_in)[None, :]]
+    def dense(v):
+        w=np.zeros((num_out, num_in)+v.shape[2:], dtype=v.dtype)
+        w[np.arange(num_out)[:, None], cols]=v[s2]
+        return w
+    _permute(arg_params, graph.weight_name(conv), dense)
+    if graph.bias_name(conv) is not None:
+        _permute(arg_params, graph.bias_name(conv), lambda v: v[s2])
+    graph.attrs(conv)['num_group']='1'
+    for idx in [before, after]:
+        if idx is not None:
+            graph.bypass(idx)
+    logging.info('densified %s: %d -> %d multiply-adds per pixel', graph.name(conv), num_out*span_in, num_out*num_in)
+    return (before is not None)+(after is not None)
+
+def fold_reorders(graph, arg_params, aux_params, densify_conv=True):
+    """Remove Reorder nodes in place, returns the number of removed nodes per step"""
+    stats={}
+    for name, func in [('identity', fold_identity), ('forward', fold_forward), ('backward', fold_backward)]:
+        stats[name]=sum(func(graph, idx, arg_params, aux_params) for idx in graph.ops('Reorder'))
+    stats['densify']=0
+    if densify_conv:
+        stats['densify']=sum(densify(graph, idx, arg_params, aux_params) for idx in graph.ops('Convolution'))
+    return stats
+
+def check(original, folded, data_shape):
+    """Max absolute difference between the outputs of two (json, arg_params, aux_params) models on random data"""
+    data=mx.nd.array(np.random.uniform(-1, 1, data_shape))
+    outputs=[]
+    for js, args, auxs in [original, folded]:
+        symbol=mx.sym.load_json(js)
+        exe=symbol.simple_bind(ctx=mx.cpu(), grad_req='null', data=data_shape)
+        exe.copy_params_from({k: mx.nd.array(v) for k, v in args.items()},
+                             {k: mx.nd.array(v) for k, v in auxs.items()}, allow_extra_params=True)
+        exe.arg_dict['data'][:]=data
+        outputs.append(exe.forward(is_train=False)[0].asnumpy())
+    return np.abs(outputs[0]-outputs[1]).max()
+
+def main():
+    parser = argparse.ArgumentParser(description='fold Reorder operators into the weights of neighbouring layers')
+    parser.add_argument('--model-prefix', type=str, required=True, help='the prefix of the model to fold')
+    parser.add_argument('--load-epoch', type=int, help='the epoch of the params to fold; only the symbol is rewritten if not given')
+    parser.add_argument('--save-prefix', type=str, required=True, help='the prefix of the folded model')
+    parser.add_argument('--no-densify', action='store_true', help='keep the Reorders around 1x1 group convolutions')
+    parser.add_argument('--check', action='store_true', help='compare both graphs on random data (needs the Reorder operator)')
+    parser.add_argument('--data-shape', type=int, default=224, help='image size used by --check')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    graph=Graph.load(args.model_prefix+'-symbol.json')
+    original=graph.tojson()
+    arg_params, aux_params={}, {}
+    if args.load_epoch is not None:
+        arg_params, aux_params=load_params(args.model_prefix, args.load_epoch)
+    else:
+        logging.warning('no params given: only the symbol is rewritten')
+    source=({k: v.copy() for k, v in arg_params.items()}, {k: v.copy() for k, v in aux_params.items()})
+    total=len(graph.ops('Reorder'))
+    stats=fold_reorders(graph, arg_params, aux_params, not args.no_densify)
+    logging.info('removed %d of %d Reorder nodes: %s', total-len(graph.ops('Reorder')), total, stats)
+
+    graph.save(args.save_prefix+'-symbol.json')
+    if args.load_epoch is not None:
+        save_params(args.save_prefix, args.load_epoch, arg_params, aux_params)
+        if args.check:
+            diff=check((original,)+source, (graph.tojson(), arg_params, aux_params),
+                       (2, 3, args.data_shape, args.data_shape))
+            logging.info('max abs difference of the outputs: %g', diff)
+
+if __name__ == '__main__':
+    main()
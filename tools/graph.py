@@ -0,0 +1,199 @@
+'''
+Helpers to rewrite saved symbol json files and their parameters.
+Works on the raw json, so graphs containing Reorder (or other custom operators)
+can be rewritten by an MXNet build without them.
+'''
+import mxnet as mx
+import numpy as np
+import json
+
+#channel-wise operators: a channel permutation commutes with them
+CHANNEL_WISE=('BatchNorm', 'Activation', 'LeakyReLU', 'Dropout', 'Pooling')
+
+def reorder_perm(channels, branch_factor):
+    """Permutation applied by Reorder: out[:, c] = in[:, perm[c]]"""
+    c=np.arange(channels)
+    return (c%branch_factor)*(channels//branch_factor)+c//branch_factor
+
+def inverse_perm(perm):
+    inv=np.empty_like(perm)
+    inv[perm]=np.arange(len(perm))
+    return inv
+
+def load_params(prefix, epoch):
+    save_dict=mx.nd.load('%s-%04d.params'%(prefix, epoch))
+    arg_params={}
+    aux_params={}
+    for k, v in save_dict.items():
+        tp, name=k.split(':', 1)
+        if tp=='arg':
+            arg_params[name]=v.asnumpy()
+        if tp=='aux':
+            aux_params[name]=v.asnumpy()
+    return arg_params, aux_params
+
+def save_params(prefix, epoch, arg_params, aux_params):
+    save_dict={('arg:%s'%k): mx.nd.array(v, dtype=v.dtype) for k, v in arg_params.items()}
+    save_dict.update({('aux:%s'%k): mx.nd.array(v, dtype=v.dtype) for k, v in aux_params.items()})
+    mx.nd.save('%s-%04d.params'%(prefix, epoch), save_dict)
+
+class Graph(object):
+    """Symbol json with the operations needed by the rewrite passes"""
+    def __init__(self, graph):
+        self.graph=graph
+        self.nodes=graph['nodes']
+        #old mxnet json stores operator arguments in `param`, newer ones in `attr`/`attrs`
+        for key in ['param', 'attrs', 'attr']:
+            if any(key in n for n in self.nodes):
+                self.attr_key=key
+                break
+        else:
+            self.attr_key='attrs'
+        self.removed=set()
+
+    @staticmethod
+    def load(fname):
+        with open(fname) as f:
+            return Graph(json.load(f))
+
+    def save(self, fname):
+        self.compact()
+        with open(fname, 'w') as f:
+            json.dump(self.graph, f, indent=2, sort_keys=True)
+
+    def tojson(self):
+        self.compact()
+        return json.dumps(self.graph)
+
+    def attrs(self, idx):
+        return self.nodes[idx].setdefault(self.attr_key, {})
+
+    def op(self, idx):
+        return self.nodes[idx]['op']
+
+    def name(self, idx):
+        return self.nodes[idx]['name']
+
+    def input(self, idx, k=0):
+        return self.nodes[idx]['inputs'][k][0]
+
+    def input_name(self, idx, k):
+        return self.name(self.input(idx, k))
+
+    def ops(self, op):
+        return [i for i, n in enumerate(self.nodes) if n['op']==op and i not in self.removed]
+
+    def consumers(self, idx):
+        """Nodes reading an output of `idx`; a graph head counts as a consumer (-1)"""
+        users=[i for i, n in enumerate(self.nodes) if i not in self.removed
+               and any(e[0]==idx for e in n['inputs'])]
+        if any(h[0]==idx for h in self.graph['heads']):
+            users.append(-1)
+        return users
+
+    def sole_consumer(self, idx):
+        users=self.consumers(idx)
+        return users[0] if len(users)==1 and users[0]>=0 else None
+
+    def bypass(self, idx):
+        """Remove a single-input node by wiring its consumers to its input"""
+        src=self.nodes[idx]['inputs'][0]
+        for n in self.nodes:
+            for e in n['inputs']:
+                if e[0]==idx:
+                    e[0], e[1]=src[0], src[1]
+        for h in self.graph['heads']:
+            if h[0]==idx:
+                h[0], h[1]=src[0], src[1]
+        self.removed.add(idx)
+
+    def int_attr(self, idx, key, default=None):
+        value=self.attrs(idx).get(key)
+        return default if value is None else int(value)
+
+    def tuple_attr(self, idx, key, default=()):
+        value=self.attrs(idx).get(key)
+        if value is None:
+            return default
+        return tuple(int(v) for v in value.strip('()[] ').split(',') if v.strip())
+
+    def channels(self, idx):
+        """Channel number of the first output of `idx`, None if unknown"""
+        op=self.op(idx)
+        if op=='Convolution':
+            return self.int_attr(idx, 'num_filter')
+        if op=='FullyConnected':
+            return self.int_attr(idx, 'num_hidden')
+        if op=='IGC':
+            return self.int_attr(idx, 'num_filter')
+        if op=='null' or len(self.nodes[idx]['inputs'])==0:
+            return None
+        return self.channels(self.input(idx))
+
+    def topo_order(self, nodes):
+        """`nodes` sorted so that every node comes after its inputs, otherwise in index order"""
+        order=[]
+        done=set()
+        for root in nodes:
+            stack=[root]
+            while stack:
+                idx=stack[-1]
+                if idx in done:
+                    stack.pop()
+                    continue
+                todo=[e[0] for e in self.nodes[idx]['inputs'] if e[0] not in done]
+                if todo:
+                    stack.extend(reversed(todo))
+                else:
+                    done.add(idx)
+                    order.append(idx)
+                    stack.pop()
+        return order
+
+    def permutation(self, idx):
+        """Permutation applied by the Reorder node `idx`"""
+        channels=self.channels(idx)
+        assert channels is not None, 'unknown channel number of %s'%self.name(idx)
+        return reorder_perm(channels, self.int_attr(idx, 'branch_factor'))
+
+    def compact(self):
+        """Drop removed and unused variable nodes and renumber the graph in topological order"""
+        used=set(h[0] for h in self.graph['heads'])
+        for i, n in enumerate(self.nodes):
+            if i not in self.removed:
+                used.update(e[0] for e in n['inputs'])
+        keep=self.topo_order([i for i, n in enumerate(self.nodes) if i not in self.removed and (n['op']!='null' or i in used)])
+        new_idx={old: new for new, old in enumerate(keep)}
+        nodes=[self.nodes[i] for i in keep]
+        for n in nodes:
+            for e in n['inputs']:
+                e[0]=new_idx[e[0]]
+            if n.get('backward_source_id', -1)>=0:
+                n['backward_source_id']=new_idx.get(n['backward_source_id'], -1)
+        for h in self.graph['heads']:
+            h[0]=new_idx[h[0]]
+        self.graph['nodes']=nodes
+        self.graph['arg_nodes']=[i for i, n in enumerate(nodes) if n['op']=='null']
+        #node_row_ptr counts every (hidden) output of each node; mxnet rebuilds it on load
+        self.graph.pop('node_row_ptr', None)
+        self.nodes=nodes
+        self.removed=set()
+
+    #parameter names of the layers touched by the passes
+    def weight_name(self, idx):
+        return self.input_name(idx, 1)
+
+    def bias_name(self, idx):
+        if self.attrs(idx).get('no_bias', 'False') in ('True', 'true', '1') or len(self.nodes[idx]['inputs'])<3:
+            return None
+        return self.input_name(idx, 2)
+
+    def bn_names(self, idx):
+        """(arg names, aux names) of a BatchNorm node"""
+        inputs=self.nodes[idx]['inputs']
+        args=[self.name(e[0]) for e in inputs[1:3]]
+        if len(inputs)>=5:
+            auxs=[self.name(e[0]) for e in inputs[3:5]]
+        else: #old json: auxiliary states are not graph nodes
+            auxs=[self.name(idx)+'_moving_mean', self.name(idx)+'_moving_var']
+        return args, auxs
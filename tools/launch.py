@@ -0,0 +1,83 @@
+'''
+Run a distributed training job on one machine: a scheduler, --num-servers parameter servers and
+--num-workers workers, each a process running the given command with the DMLC_* variables of its role.
+MXNet turns the scheduler and server processes into the parameter server when they import mxnet,
+so all roles run the same command. With --gpus, the devices are split evenly between the workers and
+passed to each as --gpus; --cores-per-worker limits the OpenMP threads of each process.
+The launcher exits with the first non-zero status of a worker, after stopping the other processes.
+
+Usage: python tools/launch.py --num-workers=4 python train_model.py --kv-store=dist_sync --network=resnet_igc ...
+'''
+import argparse
+import logging
+import os
+import socket
+import subprocess
+import sys
+import time
+
+def free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+def launch(command, num_workers, num_servers=1, gpus=None, cores_per_worker=None, env=None):
+    """Start the processes of the job, returns the Popen objects of the workers and of the other roles"""
+    base = dict(os.environ if env is None else env)
+    base.update(DMLC_PS_ROOT_URI='127.0.0.1', DMLC_PS_ROOT_PORT=str(free_port()),
+                DMLC_NUM_WORKER=str(num_workers), DMLC_NUM_SERVER=str(num_servers))
+    #the servers unpickle the optimizer (e.g., of utility.py) when they import mxnet, before any script sets its path
+    base['PYTHONPATH'] = os.pathsep.join(filter(None, [os.getcwd(), base.get('PYTHONPATH')]))
+    if cores_per_worker:
+        base['OMP_NUM_THREADS'] = str(cores_per_worker)
+    servers = []
+    for role in ['scheduler']+['server']*num_servers:
+        servers.append(subprocess.Popen(command, env=dict(base, DMLC_ROLE=role)))
+    devices = gpus.split(',') if gpus else []
+    if devices:
+        assert len(devices) % num_workers == 0, 'the gpus must be split evenly between the workers'
+    per_worker = len(devices) // num_workers
+    workers = []
+    for i in range(num_workers):
+        worker_command = list(command)
+        if devices:
+            worker_command.append('--gpus='+','.join(devices[i*per_worker:(i+1)*per_worker]))
+        workers.append(subprocess.Popen(worker_command, env=dict(base, DMLC_ROLE='worker')))
+    return workers, servers
+
+def wait(workers, servers):
+    """Wait for the workers, stop everything at the first failure, returns the exit status"""
+    status = 0
+    running = list(workers)
+    while running and status == 0:
+        for p in list(running):
+            if p.poll() is not None:
+                running.remove(p)
+                status = status or p.returncode
+        time.sleep(0.5)
+    for p in running+servers:
+        if p.poll() is None:
+            if status != 0:
+                p.terminate()
+            p.wait()
+    return status
+
+def main():
+    parser = argparse.ArgumentParser(description='launch a distributed job on the local machine')
+    parser.add_argument('-n', '--num-workers', type=int, required=True, help='the number of worker processes')
+    parser.add_argument('-s', '--num-servers', type=int, default=1, help='the number of parameter server processes')
+    parser.add_argument('--gpus', type=str, help='gpus split between the workers, e.g., --gpus=0,1,2,3 gives two to each of two workers')
+    parser.add_argument('--cores-per-worker', type=int, help='OMP_NUM_THREADS of every process')
+    parser.add_argument('command', nargs=argparse.REMAINDER, help='the command of every process')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    if not args.command:
+        parser.error('no command given')
+    logging.info('%d workers and %d servers: %s', args.num_workers, args.num_servers, ' '.join(args.command))
+    workers, servers = launch(args.command, args.num_workers, args.num_servers, args.gpus, args.cores_per_worker)
+    sys.exit(wait(workers, servers))
+
+if __name__ == '__main__':
+    main()
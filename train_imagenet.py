@@ -11,6 +11,12 @@ import os
 import logging
 import time
 import numpy as np
+import utility
+import dataset
+import validate
+import engine
+import profiling
+from multiprocessing import cpu_count
 
 parser = argparse.ArgumentParser(description='train an image classifer on ImageNet')
 parser.add_argument('--network', type=str, default='resnet_origin',
@@ -20,7 +26,7 @@ parser.add_argument('--depth', type=int, default=26,
 parser.add_argument('--data-dir', type=str, default='D:/v-tinz/dataset/imagenet/',
                     help='the input data directory')
 parser.add_argument('--gpus', type=str, default='0,1,2,3',
-                    help='the gpus will be used, e.g "0,1,2,3"')
+                    help='the gpus will be used, e.g "0,1,2,3", empty for the cpu')
 parser.add_argument('--batch-size', type=int, default=256,
                     help='the batch size')
 parser.add_argument('--model-prefix', type=str, default='./imagenet/',
@@ -35,12 +41,24 @@ parser.add_argument('--lr', type=float, default=0.1,
                     help='the initial learning rate')
 parser.add_argument('--lr-factor', type=float, default=0.1,
                     help='times the lr with a factor for every lr-factor-epoch epoch')
+parser.add_argument('--accumulate', type=int, default=1,
+                    help='sum the gradients of N batches before every update, the effective batch size is N*batch-size')
+parser.add_argument('--fused-update', action='store_true',
+                    help='update all parameters at once in flat buffers, float32 and a sync kvstore only')
+parser.add_argument('--lr-batch-size', type=int,
+                    help='the batch size --lr is given for, scaled linearly to the effective batch size of all workers')
+parser.add_argument('--warmup-epochs', type=int, default=0,
+                    help='grow the lr linearly to the scaled lr over N epochs, from --lr if --lr-batch-size raises it, else from a tenth')
 parser.add_argument('--lr-epoch-step', type=int, default=30,
                     help='the number of epoch to factor the lr, could be 10')
 parser.add_argument('--load-epoch', type=int,
                     help="load the model on an epoch using the model-prefix")
 parser.add_argument('--kv-store', type=str, default='device',
-                    help='the kvstore type')
+                    help='the kvstore type, dist_sync or dist_async with tools/launch.py')
+parser.add_argument('--gc-type', type=str, default='none', choices=['none','2bit'],
+                    help='gradient compression of the kvstore')
+parser.add_argument('--gc-threshold', type=float, default=0.5,
+                    help='the threshold of 2bit gradient compression')
 parser.add_argument('--num-examples', type=int, default=1281167,
                     help='the number of training examples')
 parser.add_argument('--num-classes', type=int, default=1000,
@@ -53,6 +71,22 @@ parser.add_argument('--data-shape', type=int, default=224,
                     help='set image\'s shape')
 parser.add_argument('--aug-type', type=int, default=1,
                     help='augmentation type')
+parser.add_argument('--phase-timing', action='store_true',
+                    help='log the time of data, forward, backward, update, metric and checkpoint, also to <model prefix>-phases.json')
+parser.add_argument('--profile', type=str,
+                    help='profile the batches BEGIN+1 to END of the first epoch by igc block, e.g., --profile=20,30, writes <model prefix>-profile.txt and -profile.json')
+parser.add_argument('--async-val', action='store_true',
+                    help='evaluate the checkpoints in a separate process instead of at the end of every epoch')
+parser.add_argument('--val-gpus', type=str,
+                    help='the gpu of the validation process, cpu if not given')
+parser.add_argument('--val-cores', type=str,
+                    help='cpu cores of the validation process, e.g., --val-cores=28,29,30,31')
+parser.add_argument('--data-workers', type=int, default=0,
+                    help='decoding processes of the training data, 0 to calibrate on a few batches')
+parser.add_argument('--data-prefetch', type=int, default=2,
+                    help='batches kept ready by every decoding process')
+parser.add_argument('--data-report', type=int, default=100,
+                    help='log the time spent waiting for training data every N batches')
 parser.add_argument('--rand_seed', type=int, 
                     help='random seed for initialization')
 parser.add_argument('--fb-mean', type=bool, default=False,
@@ -61,14 +95,37 @@ parser.add_argument('--primary-partition', type=int, default=1,
                     help='primary partition number')
 parser.add_argument('--secondary-partition', type=int, default=4,
                     help='secondary partition number')
+parser.add_argument('--igc-impl', type=str, default='default', choices=['default','batched','fused'],
+                    help='igc block implementation: Convolution/Reorder nodes, GroupPointwise for the 1x1 group convolution, or one fused IGC operator (the last two are cpu only)')
+parser.add_argument('--layout', type=str, default='NCHW', choices=['NCHW','NHWC'],
+                    help='layout of the feature maps inside the network, the input data stays NCHW')
+parser.add_argument('--mirror', type=str,
+                    help='stages whose igc blocks recompute their activations in backward to save memory, e.g., --mirror=1,2')
+parser.add_argument('--network-cache', type=str, default='./cache/network/',
+                    help='directory caching built symbols and parameter shapes, empty to disable')
+parser.add_argument('--dtype', type=str, default='float32', choices=['float32','float16'],
+                    help='data type of the activations and weights in the executors')
+parser.add_argument('--loss-scale', type=float, default=1.0,
+                    help='multiply the loss gradient to keep float16 gradients in range, e.g., --loss-scale=128')
+parser.add_argument('--resolution-schedule', type=str,
+                    help='image size by epoch, e.g., --resolution-schedule=0:128,40:160,80:224 (first epoch:size)')
 args = parser.parse_args()
+if args.resolution_schedule:
+    args.resolution_schedule = [tuple(int(v) for v in step.split(':')) for step in args.resolution_schedule.split(',')]
+    if min(args.resolution_schedule)[0] > 0:
+        args.resolution_schedule.append((0, args.data_shape))
 
 # network
-import importlib
-import sys
-sys.path.insert(0,'network')
-net = importlib.import_module(args.network).get_symbol(args.num_classes,args.depth,args.primary_partition,args.secondary_partition)
-os.environ["CUDA_VISIBLE_DEVICES"]=args.gpus
+net_kwargs = {'impl': args.igc_impl} if args.igc_impl != 'default' else {} #only the igc networks accept `impl`
+if args.layout != 'NCHW':
+    net_kwargs['layout'] = args.layout
+if args.mirror:
+    net_kwargs['mirror'] = tuple(int(stage) for stage in args.mirror.split(','))
+net, _, _ = utility.load_network(args.network, (args.num_classes,args.depth,args.primary_partition,args.secondary_partition),
+                                 net_kwargs, (1, 3, args.data_shape, args.data_shape), args.network_cache)
+net = utility.cast_network(net, args.dtype, args.loss_scale)
+if args.gpus:
+    os.environ["CUDA_VISIBLE_DEVICES"]=args.gpus
 os.environ["MXNET_CUDNN_AUTOTUNE_DEFAULT"]='1'
 if args.rand_seed is None:
     import time     
@@ -77,9 +134,9 @@ mx.random.seed(args.rand_seed)      #cudnn conv backward is non-deterministic
 exp_name=args.log_file[:args.log_file.rfind('.')]
 args.network='net_d%dL%dM%d_'%(args.depth,args.primary_partition,args.secondary_partition)+args.network+'/'+args.network+'_'+exp_name+'/'+args.network
 
-def get_iterator(args, kv):
-    kargs = dict(
-        data_shape=(3, args.data_shape, args.data_shape),
+def get_kargs(args, size):
+    return dict(
+        data_shape=(3, size, size),
         #zscore
         mean_r=123.675 if args.fb_mean else 123.370,
         mean_g=116.280 if args.fb_mean else 112.757,
@@ -91,16 +148,20 @@ def get_iterator(args, kv):
         scale_g=(1.0 / 57.12) if args.fb_mean else (1.0 / 66.093),
         scale_b=(1.0 / 57.375) if args.fb_mean else (1.0 / 68.292),
     )
-    train = mx.io.ImageRecordIter(
+
+def get_train_iterator(args, kv, size):
+    # the resize is scaled with the crop size, smaller images keep the same field of view
+    ratio = float(size) / args.data_shape
+    train_kargs = dict(
         path_imgrec = os.path.join(args.data_dir, args.train_dataset),
         batch_size=args.batch_size,
         shuffle=True,
         #data augmentation: affine transformation->random crop
         rand_crop=True,
         rand_mirror=True,
-        min_random_scale=0.533,  #480*0.533=255.84
-        max_random_scale=1.0 if args.aug_type>0 else 0.533,
-        min_img_size=256,		#255.84->256; [256,480]
+        min_random_scale=0.533*ratio,  #480*0.533=255.84
+        max_random_scale=(1.0 if args.aug_type>0 else 0.533)*ratio,
+        min_img_size=int(round(256*ratio)),		#255.84->256; [256,480]
         max_aspect_ratio=0.25 if args.aug_type>0 else 0, #aspect [0.75,1.25]
         #random color jitter
         random_h=36 if args.aug_type>0 else 0,
@@ -110,11 +171,22 @@ def get_iterator(args, kv):
         inter_method=9, #auto select resize method: bilinear, cubic, etc.
         num_parts=kv.num_workers,
         part_index=kv.rank,
-        # Preprocessing thread number
-        preprocess_threads=8,
-        **kargs
+        **get_kargs(args, size)
     )
-    val = mx.io.ImageRecordIter(
+    # decoding and augmentation run in worker processes, each with its share of the cores
+    if not args.data_workers:
+        args.data_workers = dataset.calibrate(**train_kargs)
+        logging.info('input pipeline: %d worker processes', args.data_workers)
+    return dataset.PipelineIter(args.data_workers, prefetch=args.data_prefetch, report=args.data_report, **train_kargs)
+
+def get_iterator(args, kv):
+    if args.resolution_schedule:
+        # the batches carry their size as bucket key, see fit
+        train = dataset.ProgressiveIter(args.resolution_schedule, lambda size: get_train_iterator(args, kv, size),
+                                        begin_epoch=args.load_epoch or 0)
+    else:
+        train = get_train_iterator(args, kv, args.data_shape)
+    val_kargs = dict(
         path_imgrec = os.path.join(args.data_dir, args.val_dataset),
         shuffle=False,
         rand_crop=False,    #center crop
@@ -127,142 +199,27 @@ def get_iterator(args, kv):
         num_parts=kv.num_workers,
         part_index=kv.rank,
         # Preprocessing thread number
-        preprocess_threads=8,
-        **kargs
+        preprocess_threads=cpu_count(),
+        **get_kargs(args, args.data_shape)
     )
+    # --async-val builds the validation iterator in the validation process
+    args.val_config = {'iterator': 'ImageRecordIter', 'kwargs': dict(val_kargs, num_parts=1, part_index=0)}
+    val = None if args.async_val else mx.io.ImageRecordIter(**val_kargs)
+    if args.resolution_schedule and val is not None:
+        val = dataset.BucketIter(val, args.data_shape)
     return (train, val)
 
-class Init(mx.init.Xavier):
-    def __init__(self,rnd_type="uniform", factor_type="avg", magnitude=3):
-        self.rnd_type = rnd_type
-        self.factor_type = factor_type
-        self.magnitude = float(magnitude)
-
-    def __call__(self, name, arr):
-        """Override () function to do Initialization
-
-        Parameters
-        ----------
-        name : str
-            name of corrosponding ndarray
-
-        arr : NDArray
-            ndarray to be Initialized
-        """
-        if not isinstance(name, mx.base.string_types):
-            raise TypeError('name must be string')
-        if not isinstance(arr, mx.ndarray.NDArray):
-            raise TypeError('arr must be NDArray')
-        if name.endswith('upsampling'):
-            self._init_bilinear(name, arr)
-        elif name.endswith('bias'):
-            self._init_bias(name, arr)
-        elif name.endswith('gamma'):
-            self._init_gamma(name, arr)
-        elif name.endswith('beta'):
-            self._init_beta(name, arr)
-        elif name.endswith('weight'):
-            self._init_weight(name, arr)
-        elif name.endswith("moving_mean"):
-            self._init_zero(name, arr)
-        elif name.endswith("moving_var"):
-            self._init_zero(name, arr)
-        elif name.endswith("moving_inv_var"):
-            self._init_zero(name, arr)
-        elif name.endswith("moving_avg"):
-            self._init_zero(name, arr)
-        else:
-            self._init_default(name, arr)
-
-        
-class Scheduler(mx.lr_scheduler.MultiFactorScheduler):
-
-    def __init__(self, epoch_step, factor, epoch_size):
-        super(Scheduler, self).__init__(
-            step=[epoch_size * s for s in epoch_step],
-            factor=factor
-        )
-
-
-@mx.optimizer.Optimizer.register
-class Nesterov(mx.optimizer.NAG):
-    def set_wd_mult(self, args_wd_mult):
-        self.wd_mult = {}
-        for n in self.idx2name.values():
-            if not (
-                n.endswith('_weight')
-                or n.endswith('_bias')
-                or n.endswith('_gamma')
-                or n.endswith('_beta')
-                or n.endswith('weightfuse')
-            ):
-                self.wd_mult[n] = 0.0
-        if self.sym is not None:
-            attr = self.sym.list_attr(recursive=True)
-            for k, v in attr.items():
-                if k.endswith('_wd_mult'):
-                    self.wd_mult[k[:-len('_wd_mult')]] = float(v)
-        self.wd_mult.update(args_wd_mult)
-
-class InfoCallback(mx.callback.Speedometer):
-    """Calculate training speed in frequent
-
-    Parameters
-    ----------
-    batch_size: int
-        batch_size of data
-    frequent: int
-        calculation frequent
-    """
-    def __init__(self, batch_size, frequent=50):
-        mx.callback.Speedometer.__init__(self, batch_size, frequent)
-        self.total_top1=0.0
-        self.total_top5=0.0
-        self.total_loss=0.0
-
-    def __call__(self, param):
-        """Callback to Show speed."""
-        count = param.nbatch
-        if self.last_count > count:
-            self.init = False
-        self.last_count = count
-
-        if self.init:
-            if count % self.frequent == 0:
-                speed = self.frequent * self.batch_size / (time.time() - self.tic)
-                if param.eval_metric is not None:
-                    name_value = param.eval_metric.get_name_value()
-                    param.eval_metric.reset()
-                    log_info='Epoch[%d] Batch [%d]\tSpeed: %.0f'%(param.epoch, count, speed)
-                    for name, value in name_value:
-                    	value=value if not np.isinf(value) else 10.0 #log(0)=inf
-                        if name=='cross-entropy':
-                            self.total_loss+=1.0*value*self.frequent
-                            log_info=log_info+'\tloss: %.4f(%.4f)'%(value,self.total_loss/count)
-                        elif name=='accuracy':
-                            self.total_top1+=1.0*value*self.frequent
-                            log_info=log_info+'\ttop1: %.4f(%.4f)'%(100.0*value,100.0*self.total_top1/count)
-                        elif 'top_k' in name:
-                            self.total_top5+=1.0*value*self.frequent
-                            log_info=log_info+'\ttop5: %.4f(%.4f)'%(100.0*value,100.0*self.total_top5/count)
-                    logging.info(log_info)
-                else:
-                    logging.info("Iter[%d] Batch [%d]\tSpeed: %.2f samples/sec",
-                                 param.epoch, count, speed)
-                self.tic = time.time()
-        else:
-            self.init = True
-            self.tic = time.time()
-            self.total_top1=0.0
-            self.total_top5=0.0
-            self.total_loss=0.0
-            
 def fit(args, network, data_loader, batch_end_callback=None):
     # kvstore
     kv = mx.kvstore.create(args.kv_store)
+    num_workers = kv.num_workers
+    rank = kv.rank # kv is None on a single device from the optimizer on
+    if args.gc_type != 'none': # quantized gradients between the devices and the servers
+        kv.set_gradient_compression({'type': args.gc_type, 'threshold': args.gc_threshold})
 
     # logging
     head = '%(asctime)-15s Node[' + str(kv.rank) + '] %(message)s'
+    log_file_full_name = None
     if 'log_file' in args and args.log_file is not None:
         log_file = args.network+'.txt'
         log_dir = args.log_dir
@@ -292,16 +249,15 @@ def fit(args, network, data_loader, batch_end_callback=None):
     model_prefix +=args.network
     print model_prefix
     model_args = {}
-    start_epoch_step=args.lr_epoch_step
     if args.load_epoch is not None:
         assert model_prefix is not None
-        tmp = mx.model.FeedForward.load(model_prefix, args.load_epoch)
-        model_args = {'arg_params': tmp.arg_params,
-                      'aux_params': tmp.aux_params,
+        _, arg_params, aux_params = mx.model.load_checkpoint(model_prefix, args.load_epoch)
+        model_args = {'arg_params': arg_params,
+                      'aux_params': aux_params,
                       'begin_epoch': args.load_epoch}
-        stage=int(args.load_epoch/args.lr_epoch_step)
-        args.lr*=args.lr_factor**stage
-        start_epoch_step=(1+stage)*args.lr_epoch_step-args.load_epoch
+        states = '%s-%04d.states' % (model_prefix, args.load_epoch)
+        if os.path.isfile(states): # optimizer states of engine.Checkpoint
+            model_args['optimizer_states'] = states
     if args.load_model is not None:
         save_dict = mx.nd.load('%s.params' % (args.model_prefix+args.load_model))
         tmp_arg_params = {}
@@ -315,57 +271,47 @@ def fit(args, network, data_loader, batch_end_callback=None):
         model_args = {'arg_params': tmp_arg_params,
                       'aux_params': tmp_aux_params}
 
-    # save model
-    checkpoint = mx.callback.do_checkpoint(model_prefix,1)
-
     # data
     (train, val) = data_loader(args, kv)
+    if args.async_val and kv.rank == 0: # the checkpoints are evaluated by another process, training does not wait
+        validate.launch(model_prefix, args.val_config, log_file_full_name, args.val_gpus, args.val_cores,
+                        model_args.get('begin_epoch', 0))
+    timer = None
+    if args.phase_timing: #synchronizes every phase, slightly slower
+        timer = utility.PhaseTimer(model_prefix+'-phases.json')
 
     # train
-    devs = mx.cpu() if args.gpus is None else [
+    devs = mx.cpu() if not args.gpus else [
         mx.gpu(i) for i in range(len(args.gpus.split(',')))]
 
     epoch_size = args.num_examples / args.batch_size
+    optimizer_params = {'learning_rate': args.lr, 'momentum': 0.9, 'wd': 0.0001,
+                        'loss_scale': args.loss_scale} #fp32 master weights are kept for float16 parameters
 
-    if args.kv_store == 'dist_sync':
-        epoch_size /= kv.num_workers
+    if 'dist' in args.kv_store: # every worker reads 1/num_workers of the data, in the same number of batches
+        epoch_size /= num_workers
         model_args['epoch_size'] = epoch_size
 
     if 'clip_gradient' in args and args.clip_gradient is not None:
-        model_args['clip_gradient'] = args.clip_gradient
+        optimizer_params['clip_gradient'] = args.clip_gradient
+
+    # effective batch size of an update, over all workers
+    batch_size = args.batch_size * args.accumulate * (num_workers if 'dist' in kv.type else 1)
 
     # disable kvstore for single device
     if 'local' in kv.type and (
-            args.gpus is None or len(args.gpus.split(',')) is 1):
+            not args.gpus or len(args.gpus.split(',')) is 1):
         kv = None
         
-    epoch_step=range(start_epoch_step,args.num_epochs,args.lr_epoch_step)
-    model_args['lr_scheduler'] = Scheduler(epoch_step=epoch_step,
-                                                factor=args.lr_factor, epoch_size=epoch_size)   
-
-    logger.info('training parameters: lr=%f, epoch_size=%d, epoch_step=%s',args.lr,epoch_size,epoch_step)
+    epoch_step=range(args.lr_epoch_step,args.num_epochs,args.lr_epoch_step)
+    updates_per_epoch = epoch_size * (num_workers if 'async' in args.kv_store else 1) / args.accumulate
+    optimizer_params['lr_scheduler'] = utility.Scheduler(epoch_step=epoch_step,
+                                                factor=args.lr_factor, epoch_size=updates_per_epoch,
+                                                scale=1.0 * batch_size / args.lr_batch_size if args.lr_batch_size else 1.0, # linear scaling rule
+                                                warmup_epochs=args.warmup_epochs)
+    optimizer_params['begin_num_update'] = model_args.get('begin_epoch', 0) * updates_per_epoch # the lr schedule goes on when resuming
 
-    model = mx.model.FeedForward(
-        ctx=devs,
-        symbol=network,
-        num_epoch=args.num_epochs,
-        learning_rate=args.lr,
-        momentum=0.9,
-        wd=0.0001,
-        optimizer='Nesterov',
-        # Note we initialize BatchNorm beta and gamma as that in
-        # https://github.com/facebook/fb.resnet.torch/
-        # i.e. constant 0 and 1, rather than
-        # https://github.com/gcr/torch-residual-networks/blob/master/residual-layers.lua
-        # FC layer is initialized as that in torch default
-        # https://github.com/torch/nn/blob/master/Linear.lua
-        initializer=mx.init.Mixed(
-            ['.*fc.*', '.*'],
-            [mx.init.Xavier(rnd_type='uniform',  factor_type='in', magnitude=1),
-             Init(rnd_type='gaussian', factor_type='in', magnitude=2)]
-        ),
-        #lr_scheduler=Scheduler(epoch_step=[30, 60, 90, 120, 150, 180], factor=0.1, epoch_size=epoch_size),
-        **model_args)
+    logger.info('training parameters: lr=%f, epoch_size=%d, epoch_step=%s, effective batch size=%d',args.lr,epoch_size,epoch_step,batch_size)
 
     eval_metrics = ['ce','accuracy']
     ## TopKAccuracy only allows top_k > 1
@@ -377,16 +323,43 @@ def fit(args, network, data_loader, batch_end_callback=None):
             batch_end_callback = [batch_end_callback]
     else:
         batch_end_callback = []
-    batch_end_callback.append(InfoCallback(args.batch_size, 10))
-
-    model.fit(
-        X=train,
-        eval_data=val,
-        eval_metric=eval_metrics,
+    batch_end_callback.append(utility.InfoCallback(args.batch_size, 10, timer))
+    if args.profile and rank == 0: # operator time and memory by stage and block, activations at --data-shape
+        begin, end = [int(v) for v in args.profile.split(',')]
+        batch_end_callback.append(profiling.BlockProfiler(network, (args.batch_size, 3, args.data_shape, args.data_shape),
+                                                          model_prefix, begin, end))
+
+    # with --resolution-schedule, one executor per image size, sharing the parameters and the memory
+    # of the largest one; the optimizer states are kept across the size changes
+    trainer = engine.Trainer(
+        network,
+        ctx=devs,
         kvstore=kv,
+        optimizer='wdwfNesterov',
+        optimizer_params=optimizer_params,
+        arg_params=model_args.get('arg_params'),
+        aux_params=model_args.get('aux_params'),
+        optimizer_states=model_args.get('optimizer_states'),
+        default_bucket_key=max(size for _, size in args.resolution_schedule) if args.resolution_schedule else None,
+        timer=timer,
+        accumulate=args.accumulate,
+        fused=args.fused_update)
+
+    # save model in the background, the workers hold the same weights
+    checkpoint = engine.Checkpoint(model_prefix, 1, trainer) if rank == 0 else None
+    epoch_end_callback = checkpoint if timer is None else timer.checkpoint(checkpoint)
+    trainer.fit(
+        train,
+        val,
+        eval_metric=eval_metrics,
+        begin_epoch=model_args.get('begin_epoch', 0),
+        num_epoch=args.num_epochs,
+        epoch_size=model_args.get('epoch_size'),
         batch_end_callback=batch_end_callback,
-        epoch_end_callback=checkpoint
+        epoch_end_callback=epoch_end_callback
     )
+    if checkpoint is not None: # the last checkpoint is complete, or its error raised
+        checkpoint.wait()
 
 # train
 fit(args, net, get_iterator)
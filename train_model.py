@@ -10,6 +10,10 @@ import logging
 import numpy as np
 import options
 import utility
+import dataset
+import validate
+import engine
+import profiling
 
 def get_iterator(args, kv):
     base_args=dict(
@@ -28,100 +32,109 @@ def get_iterator(args, kv):
         scale_g=1.0 / args.std_rgb[1],
         scale_b=1.0 / args.std_rgb[2],
     )
-    train = mx.io.ImageRecordIter(
-        path_imgrec = args.data_dir+args.train_dataset,
-        batch_size=args.batch_size,
-        shuffle=True,
-        #image augmentation
-        pad=4 if args.aug_type==1 else 0,
-        rand_crop=True if args.aug_type!=0 else False,
-        rand_mirror=True if args.aug_type!=0 else False,
-        **base_args #base arguments for mxnet
-    )
-    val = mx.io.ImageRecordIter(
+    #validation iterator as json, --async-val builds it in the validation process
+    args.val_config={'iterator': 'ImageRecordIter', 'kwargs': dict(
         path_imgrec = args.data_dir+args.val_dataset,
         batch_size=args.test_batch_size,
         shuffle=False,
         rand_crop=False,
         rand_mirror=False,
         **base_args #base arguments for mxnet
-    )
+    )}
+    if args.data_cache or args.data_index:
+        #decoded once into memory-mapped arrays, or read by random access through the .idx files
+        source=dataset.load if args.data_cache else dataset.load_indexed
+        train = dataset.CachedIter(
+            *source(args.data_dir+args.train_dataset),
+            batch_size=args.batch_size,
+            shuffle=True,
+            pad=4 if args.aug_type==1 else 0,
+            rand_crop=True if args.aug_type!=0 else False,
+            rand_mirror=True if args.aug_type!=0 else False,
+            num_threads=args.data_threads,
+            seed=args.rand_seed, #the same on all workers, see options.py
+            begin_epoch=args.model_args.get('begin_epoch', 0),
+            **base_args
+        )
+        args.val_config['iterator']='cache' if args.data_cache else 'index'
+        args.val_config['kwargs']['num_threads']=args.data_threads
+    else:
+        train = mx.io.ImageRecordIter(
+            path_imgrec = args.data_dir+args.train_dataset,
+            batch_size=args.batch_size,
+            shuffle=True,
+            #image augmentation
+            pad=4 if args.aug_type==1 else 0,
+            rand_crop=True if args.aug_type!=0 else False,
+            rand_mirror=True if args.aug_type!=0 else False,
+            **base_args #base arguments for mxnet
+        )
+    val = None if args.async_val else dataset.create_iterator(args.val_config)
     return (train, val)
 
-class Init(mx.init.Xavier):
-    def __init__(self, rnd_type="uniform", factor_type="avg", magnitude=3):
-        self.rnd_type = rnd_type
-        self.factor_type = factor_type
-        self.magnitude = float(magnitude)
-
-
-    def __call__(self, name, arr):
-        """Override () function to do Initialization
-
-        Parameters
-        ----------
-        name : str
-            name of corrosponding ndarray
-
-        arr : NDArray
-            ndarray to be Initialized
-        """
-        if not isinstance(name, mx.base.string_types):
-            raise TypeError('name must be string')
-        if not isinstance(arr, mx.ndarray.NDArray):
-            raise TypeError('arr must be NDArray')
-        if name.endswith('upsampling'):
-            self._init_bilinear(name, arr)
-        elif name.endswith('bias'):
-            self._init_bias(name, arr)
-        elif name.endswith('gamma'):
-            self._init_gamma(name, arr)
-        elif name.endswith('beta'):
-            self._init_beta(name, arr)
-        elif name.endswith('weight'):
-            self._init_weight(name, arr)
-        elif name.endswith("moving_mean"):
-            self._init_zero(name, arr)
-        elif name.endswith("moving_var"):
-            self._init_zero(name, arr)
-        elif name.endswith("moving_inv_var"):
-            self._init_zero(name, arr)
-        elif name.endswith("moving_avg"):
-            self._init_zero(name, arr)
-        else:
-            self._init_default(name, arr)
-
-
 def train(args):
     network=options.get_network(args)
     #device
-    kv = mx.kvstore.create(args.kv_store)    
-    devs = [mx.gpu(i) for i in range(len(args.gpus.split(',')))]
+    kv = args.kvstore #created with the log, see options.py
+    if args.gc_type!='none': #quantized gradients between the devices and the servers
+        kv.set_gradient_compression({'type': args.gc_type, 'threshold': args.gc_threshold})
+    devs = [mx.gpu(i) for i in range(len(args.gpus.split(',')))] if args.gpus else [mx.cpu()]
+    #batches per epoch of every worker, the iterators read 1/num_workers of the data
+    epoch_size=args.num_examples/(args.batch_size*kv.num_workers)
     #training data
     (train_data, val_data)=get_iterator(args, kv)
+    timer=None
+    if args.phase_timing: #synchronizes every phase, slightly slower
+        timer=utility.PhaseTimer(args.model_prefix+'-phases.json')
+    if args.async_val and kv.rank==0: #the checkpoints are evaluated by another process, training does not wait
+        args.val_config['kwargs'].update(num_parts=1, part_index=0) #on the whole validation set
+        validate.launch(args.model_prefix, args.val_config, args.log_file, args.val_gpus, args.val_cores,
+                        args.model_args.get('begin_epoch', 0))
+    #effective batch size of an update, over all workers
+    batch_size=args.batch_size*args.accumulate*(kv.num_workers if 'dist' in kv.type else 1)
+    updates_per_epoch=epoch_size*(1 if 'async' not in kv.type else kv.num_workers)/args.accumulate
     #model
-    model = mx.model.FeedForward(
+    trainer = engine.Trainer(
+        network,
         ctx=devs,
-        symbol=network,
-        num_epoch=args.num_epochs,
-        learning_rate=args.lr,
-        momentum=0.9,
-        wd=0.0001,
+        kvstore=kv,
         optimizer='Nesterov', #'nag',
-        initializer=mx.init.Mixed(['.*fc.*','.*'],
-            [mx.init.Xavier(rnd_type='uniform', factor_type='in', magnitude=1),
-            Init(rnd_type='gaussian', factor_type='in', magnitude=2)]),
-        lr_scheduler=utility.Scheduler(epoch_step=args.lr_steps, factor=args.lr_factor, epoch_size=args.num_examples / args.batch_size),
-        **args.model_args #for retrain
+        optimizer_params=dict(
+            learning_rate=args.lr,
+            momentum=0.9,
+            wd=0.0001,
+            loss_scale=args.loss_scale, #fp32 master weights are kept for float16 parameters
+            lr_scheduler=utility.Scheduler(epoch_step=args.lr_steps, factor=args.lr_factor, epoch_size=updates_per_epoch,
+                scale=1.0*batch_size/args.lr_batch_size if args.lr_batch_size else 1.0, #linear scaling rule
+                warmup_epochs=args.warmup_epochs),
+            begin_num_update=args.model_args.get('begin_epoch', 0)*updates_per_epoch, #the lr schedule goes on when resuming
+        ),
+        arg_params=args.model_args.get('arg_params'), #for retrain
+        aux_params=args.model_args.get('aux_params'),
+        optimizer_states=args.model_args.get('optimizer_states'), #the momenta
+        timer=timer,
+        accumulate=args.accumulate,
+        fused=args.fused_update,
     )
-    model.fit(
-        X=train_data,
-        eval_data=val_data,
+    callbacks=[utility.InfoCallback(args.batch_size, args.log_iters, timer)]
+    if args.profile and kv.rank==0: #operator time and memory by stage and block
+        begin, end=[int(v) for v in args.profile.split(',')]
+        callbacks.append(profiling.BlockProfiler(network, (args.batch_size, 3, args.data_shape, args.data_shape),
+                                                 args.model_prefix, begin, end))
+    #written in the background, the workers hold the same weights
+    checkpoint=engine.Checkpoint(args.model_prefix, args.checkpoint_epochs, trainer) if kv.rank==0 else None
+    trainer.fit(
+        train_data,
+        val_data,
         eval_metric=['ce','acc'] if args.dataset!='imagenet' else ['ce','acc',mx.metric.create('top_k_accuracy',top_k=5)],
-        kvstore=kv,
-        batch_end_callback=utility.InfoCallback(args.batch_size, args.log_iters),
-        epoch_end_callback=mx.callback.do_checkpoint(args.model_prefix,args.checkpoint_epochs),
+        begin_epoch=args.model_args.get('begin_epoch', 0),
+        num_epoch=args.num_epochs,
+        epoch_size=epoch_size if 'dist' in kv.type else None, #the same number of batches on every worker
+        batch_end_callback=callbacks,
+        epoch_end_callback=checkpoint if timer is None else timer.checkpoint(checkpoint),
     )
+    if checkpoint is not None: #the last checkpoint is complete, or its error raised
+        checkpoint.wait()
 
 def main(argv):
     args = options.get_args(argv)
@@ -5,7 +5,9 @@ Contact: Liming Zhao (zlmzju@gmail.com)
 import mxnet as mx
 import numpy as np
 import time
+import json
 import logging
+import re
 
 #utility functions
 def mkdir(dirname,clean=False):
@@ -16,31 +18,137 @@ def mkdir(dirname,clean=False):
     if not os.path.exists(dirname):
         os.makedirs(dirname)
 
-def cal_params(symbol,input_shapes={"data":(1, 3, 32, 32)}):
-    """Initialize weight parameters and auxiliary states"""
+def param_shapes(symbol,input_shapes={"data":(1, 3, 32, 32)}):
+    """Shapes of the weight parameters"""
     arg_shapes, _, _ = symbol.infer_shape(**input_shapes)
     assert(arg_shapes is not None)
 
     arg_names = symbol.list_arguments()
     input_names = input_shapes.keys()
-    param_names = [key for key in arg_names if key not in input_names]
+    return dict((k, tuple(s)) for k, s in zip(arg_names, arg_shapes) if k not in input_names)
 
-    param_name_shapes = [x for x in zip(arg_names, arg_shapes) if x[0] in param_names]
-    import numpy as np
+def cal_params(symbol,input_shapes={"data":(1, 3, 32, 32)}, shapes=None):
+    """Initialize weight parameters and auxiliary states"""
+    if shapes is None:
+        shapes=param_shapes(symbol, input_shapes)
     params_num=0
-    for k, s in param_name_shapes:
+    for k, s in shapes.items():
         params_num+=np.prod(s)
     return '%.4fM'%(params_num/1000000.0)
 
+def memory(exe):
+    """Memory planned by the executor in MB, None if not reported"""
+    match = re.search(r'Total (\d+) MB allocated', exe.debug_str())
+    return int(match.group(1)) if match else None
+
+def peak_memory():
+    """Peak resident memory of this process in MB"""
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024
+
+def load_network(network, args, kwargs={}, data_shape=(1, 3, 32, 32), cache_dir=None):
+    """Build network/<network>.py get_symbol(*args, **kwargs), returns (symbol, param shapes, number of params).
+    With `cache_dir`, the symbol json, parameter shapes and count are stored in a file keyed by the hash
+    of the module source and the arguments, so later runs skip the import, the build and the shape inference."""
+    import hashlib
+    import importlib
+    import json
+    import os
+    import sys
+    with open(os.path.join('network', network+'.py')) as f:
+        source = f.read()
+    with open(os.path.join('network', 'common.py')) as f: #the helpers of all builders
+        source += f.read()
+    key = json.dumps([hashlib.sha1(source).hexdigest(), list(args), sorted(kwargs.items()), list(data_shape)])
+    cache_file = None
+    if cache_dir:
+        cache_file = os.path.join(cache_dir, '%s-%s.json'%(network, hashlib.sha1(key).hexdigest()[:16]))
+        if os.path.isfile(cache_file):
+            with open(cache_file) as f:
+                entry = json.load(f)
+            if entry['key'] == key: #hash collision or a stale file otherwise
+                logging.info('network loaded from %s', cache_file)
+                shapes = dict((k, tuple(s)) for k, s in entry['param_shapes'].items())
+                return mx.sym.load_json(entry['symbol']), shapes, entry['num_params']
+    sys.path.insert(0,'network')
+    symbol = importlib.import_module(network).get_symbol(*args, **kwargs)
+    shapes = param_shapes(symbol, {'data': data_shape})
+    num_params = int(sum(np.prod(s) for s in shapes.values()))
+    if cache_file is not None:
+        mkdir(cache_dir)
+        tmp = '%s.%d.tmp'%(cache_file, os.getpid()) #concurrent jobs of a sweep may write the same entry
+        with open(tmp, 'w') as f:
+            json.dump({'key': key, 'symbol': symbol.tojson(), 'param_shapes': shapes, 'num_params': num_params}, f)
+        os.rename(tmp, cache_file)
+    return symbol, shapes, num_params
+
 class Scheduler(mx.lr_scheduler.MultiFactorScheduler):
-    def __init__(self, epoch_step, factor, epoch_size):
+    """Multiply the lr by `factor` at every epoch of `epoch_step`, `epoch_size` updates per epoch.
+    `scale` multiplies the lr, e.g., by the effective batch size over the batch size the lr was
+    tuned for (linear scaling). Over the first `warmup_epochs` the lr then grows linearly from
+    `warmup_begin_lr` to the scaled one; by default from the unscaled lr when `scale` raises it,
+    and from a tenth of the scaled lr otherwise, so the warmup never starts at its end. Updates are counted from
+    the beginning of training, a resumed run sets the `begin_num_update` of the optimizer."""
+    def __init__(self, epoch_step, factor, epoch_size, scale=1.0, warmup_epochs=0, warmup_begin_lr=None):
         super(Scheduler, self).__init__(
             step=[epoch_size * s for s in epoch_step],
             factor=factor
         )
+        self.scale = scale
+        self.warmup_updates = warmup_epochs * epoch_size
+        self.warmup_begin_lr = warmup_begin_lr
+
+    def __call__(self, num_update):
+        lr = super(Scheduler, self).__call__(num_update) * self.scale
+        if num_update < self.warmup_updates:
+            begin = self.warmup_begin_lr
+            if begin is None:
+                begin = self.base_lr if self.scale > 1 else self.base_lr * self.scale / 10
+            lr = begin + (lr - begin) * float(num_update) / self.warmup_updates
+        return lr
+
+def cast_network(symbol, dtype, loss_scale=1.0):
+    """Run `symbol` in `dtype`: cast the data after the input and the scores before the loss
+    The loss gradient is multiplied by `loss_scale`; the optimizer divides it out again.
+    """
+    if dtype=='float32' and loss_scale==1.0:
+        return symbol
+    import json
+    nodes=json.loads(symbol.tojson())['nodes']
+    head=nodes[-1] #SoftmaxOutput
+    attr_key='param' if 'param' in head else 'attrs' if 'attrs' in head else 'attr'
+    attrs=dict(head.get(attr_key, {}))
+    attrs['grad_scale']=float(attrs.get('grad_scale', 1.0))*loss_scale
+    scores=symbol.get_internals()[nodes[head['inputs'][0][0]]['name']+'_output']
+    scores=scores(data=mx.symbol.Cast(name='data_cast', data=mx.symbol.Variable('data'), dtype=dtype))
+    scores=mx.symbol.Cast(name='score_cast', data=scores, dtype='float32')
+    return getattr(mx.symbol, head['op'])(name=head['name'], data=scores, **attrs)
+
+class MultiPrecisionNAG(mx.optimizer.NAG):
+    """NAG keeping a float32 master copy of float16 weights
+    Gradients come multiplied by the loss scale of `cast_network`.
+    """
+    def __init__(self, loss_scale=1.0, **kwargs):
+        super(MultiPrecisionNAG, self).__init__(**kwargs)
+        self.loss_scale=loss_scale
+        self.rescale_grad/=loss_scale
+
+    def create_state(self, index, weight):
+        if weight.dtype==np.float16:
+            master=weight.astype(np.float32)
+            return (super(MultiPrecisionNAG, self).create_state(index, master), master)
+        return super(MultiPrecisionNAG, self).create_state(index, weight)
+
+    def update(self, index, weight, grad, state):
+        if isinstance(state, tuple):
+            mom, master=state
+            super(MultiPrecisionNAG, self).update(index, master, grad.astype(np.float32), mom)
+            weight[:]=master.astype(weight.dtype)
+        else:
+            super(MultiPrecisionNAG, self).update(index, weight, grad, state)
 
 @mx.optimizer.Optimizer.register
-class Nesterov(mx.optimizer.NAG):
+class Nesterov(MultiPrecisionNAG):
     #same with torch implementation
     def set_wd_mult(self, args_wd_mult):
         self.wd_mult = {}
@@ -57,7 +165,7 @@ class Nesterov(mx.optimizer.NAG):
         self.wd_mult.update(args_wd_mult)
 
 @mx.optimizer.Optimizer.register
-class wdwfNesterov(mx.optimizer.NAG):
+class wdwfNesterov(MultiPrecisionNAG):
     #same with torch implementation
     def set_wd_mult(self, args_wd_mult):
         self.wd_mult = {}
@@ -74,6 +182,119 @@ class wdwfNesterov(mx.optimizer.NAG):
                     self.wd_mult[k[:-len('_wd_mult')]] = float(v)
         self.wd_mult.update(args_wd_mult)
 
+class FusedNesterov(object):
+    """The Nesterov step of `optimizer` on all the parameters of every device at once
+    The parameters, gradients and momenta of a device are contiguous float32 buffers, `weights` and
+    `grads` are views of them for binding the executors, so a step is a few vectorised operations
+    instead of an update per parameter. The weight decay and learning rate multipliers of the
+    optimizer, i.e. of set_wd_mult, are expanded once into vectors of the buffer size; the learning
+    rate scheduler, rescale_grad and clip_gradient are read from `optimizer` at every step.
+    """
+    def __init__(self, optimizer, names, shapes, contexts):
+        assert isinstance(optimizer, mx.optimizer.NAG), 'the fused update is the Nesterov step'
+        self.optimizer=optimizer
+        sizes=[int(np.prod(shape)) for shape in shapes]
+        offsets=np.cumsum([0]+sizes)
+        wd=np.repeat([optimizer.wd*optimizer.wd_mult.get(n, 1.0) for n in names], sizes)
+        lr_mult=np.repeat([optimizer.lr_mult.get(n, 1.0) for n in names], sizes)
+        self.weight, self.grad, self.mom, self.wd, self.lr_mult=[], [], [], [], []
+        self.weights, self.grads=[], []
+        for ctx in contexts:
+            self.weight.append(mx.nd.zeros((offsets[-1],), ctx))
+            self.grad.append(mx.nd.zeros((offsets[-1],), ctx))
+            self.mom.append(mx.nd.zeros((offsets[-1],), ctx))
+            self.wd.append(mx.nd.array(wd, ctx))
+            #no vector when every multiplier is 1, the common case
+            self.lr_mult.append(None if (lr_mult==1.0).all() else mx.nd.array(lr_mult, ctx))
+            self.weights.append([self.weight[-1][b:e].reshape(s) for b, e, s in zip(offsets[:-1], offsets[1:], shapes)])
+            self.grads.append([self.grad[-1][b:e].reshape(s) for b, e, s in zip(offsets[:-1], offsets[1:], shapes)])
+
+    def get_states(self):
+        """The momenta as a string, as mx.optimizer.Updater.get_states; the devices hold the same"""
+        import pickle
+        return pickle.dumps(self.mom[0].asnumpy(), pickle.HIGHEST_PROTOCOL)
+
+    def set_states(self, states):
+        import pickle
+        mom=pickle.loads(states)
+        for m in self.mom:
+            m[:]=mom
+
+    def update(self):
+        """One step on every device, the gradients are already reduced"""
+        opt=self.optimizer
+        opt._update_count(0) #one count for all the parameters
+        lr=opt.lr if opt.lr_scheduler is None else opt.lr_scheduler(opt.num_update)
+        for weight, grad, mom, wd, lr_mult in zip(self.weight, self.grad, self.mom, self.wd, self.lr_mult):
+            step=grad*opt.rescale_grad
+            if opt.clip_gradient:
+                step=mx.nd.clip(step, -opt.clip_gradient, opt.clip_gradient)
+            #as nag_mom_update: the decay only enters the momentum
+            mom*=opt.momentum
+            mom+=step
+            mom+=wd*weight
+            step+=opt.momentum*mom
+            if lr_mult is not None:
+                step*=lr_mult
+            weight-=lr*step
+
+PHASES=['data', 'forward', 'backward', 'update', 'metric', 'eval', 'checkpoint']
+
+class PhaseTimer(object):
+    """Wall time of the phases of engine.Trainer.fit: data fetch, forward, backward,
+    update (including kvstore), metric, evaluation and checkpoint.
+    The trainer calls every phase through run(), which waits for the engine, so the asynchronous
+    work is charged to the phase which queued it at the cost of some overlap between phases.
+    Windows are read by InfoCallback, epochs are logged by the wrapped checkpoint callback; both
+    are appended as json lines to `filename`. The trainer evaluates after the checkpoint, so the
+    eval time is reported with the next epoch."""
+    def __init__(self, filename=None):
+        self.window=dict.fromkeys(PHASES, 0.0)
+        self.total=dict.fromkeys(PHASES, 0.0)
+        self.file=open(filename, 'a') if filename is not None else None
+
+    def add(self, phase, seconds):
+        self.window[phase]+=seconds
+        self.total[phase]+=seconds
+
+    def run(self, phase, func, *args, **kwargs):
+        """Call func, wait for the work it queued and charge the time to `phase`"""
+        tic=time.time()
+        try:
+            out=func(*args, **kwargs)
+            mx.nd.waitall()
+            return out
+        finally:
+            self.add(phase, time.time()-tic)
+
+    def checkpoint(self, callback):
+        """Wrap the epoch end callback: time it and report the phases of the epoch"""
+        def wrapped(epoch, symbol, arg_params, aux_params):
+            tic=time.time()
+            if callback is not None:
+                callback(epoch, symbol, arg_params, aux_params)
+            self.add('checkpoint', time.time()-tic)
+            logging.info('Epoch[%d] %s', epoch, self.format(self.total))
+            self.write({'epoch': epoch, 'phases': self.total})
+            self.total=dict.fromkeys(PHASES, 0.0)
+        return wrapped
+
+    def pop_window(self):
+        """Phase times since the last call"""
+        window, self.window=self.window, dict.fromkeys(PHASES, 0.0)
+        return window
+
+    def format(self, times, num_batch=None):
+        if num_batch:
+            return 'ms/batch '+' '.join('%s: %.1f'%(k, 1000.0*times[k]/num_batch) for k in PHASES if times[k]>0)
+        return 'seconds '+' '.join('%s: %.1f'%(k, times[k]) for k in PHASES if times[k]>0)
+
+    def write(self, record):
+        if self.file is not None:
+            record['time']=time.time()
+            self.file.write(json.dumps(record)+'\n')
+            self.file.flush()
+
 class InfoCallback(mx.callback.Speedometer):
     """Calculate training speed in frequent
 
@@ -83,12 +304,15 @@ class InfoCallback(mx.callback.Speedometer):
         batch_size of data
     frequent: int
         calculation frequent
+    timer: PhaseTimer
+        optional, adds the phase times of each window to the log and its file
     """
-    def __init__(self, batch_size, frequent=50):
+    def __init__(self, batch_size, frequent=50, timer=None):
         mx.callback.Speedometer.__init__(self, batch_size, frequent)
         self.total_top1=0.0
         self.total_top5=0.0
         self.total_loss=0.0
+        self.timer=timer
 
     def __call__(self, param):
         """Callback to Show speed."""
@@ -115,13 +339,20 @@ class InfoCallback(mx.callback.Speedometer):
                         elif 'top_k' in name:
                             self.total_top5+=1.0*value*self.frequent
                             log_info=log_info+'\ttop5: %.4f(%.4f)'%(100.0*value,100.0*self.total_top5/count)
-                    logging.info(log_info)
                 else:
-                    logging.info("Iter[%d] Batch [%d]\tSpeed: %.2f samples/sec",
-                                 param.epoch, count, speed)
+                    name_value = []
+                    log_info='Iter[%d] Batch [%d]\tSpeed: %.2f samples/sec'%(param.epoch, count, speed)
+                if self.timer is not None:
+                    window = self.timer.pop_window()
+                    log_info=log_info+'\t'+self.timer.format(window, self.frequent)
+                    self.timer.write({'epoch': param.epoch, 'batch': count, 'speed': speed, 'phases': window,
+                                      'metrics': dict((n, float(v)) for n, v in name_value)})
+                logging.info(log_info)
                 self.tic = time.time()
         else:
             self.init = True
+            if self.timer is not None:
+                self.timer.pop_window()
             self.tic = time.time()
             self.total_top1=0.0
             self.total_top5=0.0
@@ -0,0 +1,108 @@
+'''
+Validation of the checkpoints written during training, out of the training process.
+Waits for <model-prefix>-NNNN.params files, evaluates each new one on the validation iterator
+described by --config (see dataset.create_iterator) and appends the loss, top-1 and top-5
+accuracy to the log of the run. Started by the training scripts with --async-val; it exits
+once the process --parent has finished and every checkpoint is evaluated.
+
+Usage: python validate.py --model-prefix=<prefix> --config=<prefix>-val.json --log-file=<run log> [--gpus=1 | --cores=0,1,2,3]
+'''
+import mxnet as mx
+import argparse
+import glob
+import json
+import logging
+import os
+import re
+import subprocess
+import sys
+import time
+import dataset
+
+def launch(model_prefix, config, log_file, gpus=None, cores=None, begin_epoch=0):
+    """Start the validation process of the current training process, returns the Popen object
+    `gpus` are physical ids: the process does not inherit the CUDA_VISIBLE_DEVICES of training."""
+    config_file = model_prefix+'-val.json'
+    with open(config_file, 'w') as f:
+        json.dump(config, f)
+    command = [sys.executable, os.path.abspath(__file__), '--model-prefix', model_prefix, '--config', config_file,
+               '--log-file', log_file, '--parent', str(os.getpid()), '--begin-epoch', str(begin_epoch)]
+    if gpus:
+        command += ['--gpus', gpus]
+    if cores:
+        command += ['--cores', cores]
+    logging.info('validation runs in a separate process: %s', ' '.join(command))
+    return subprocess.Popen(command, env=dict(os.environ, CUDA_VISIBLE_DEVICES=gpus or '')) #no training gpu is used
+
+def checkpoints(model_prefix):
+    """Epochs of the params files of `model_prefix`"""
+    pattern = re.compile(re.escape(model_prefix)+r'-(\d{4})\.params$')
+    return sorted(int(m.group(1)) for m in (pattern.match(f) for f in glob.glob(model_prefix+'-*.params')) if m)
+
+def alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+def evaluate(model_prefix, epoch, val, ctx):
+    """Cross-entropy, top-1 and top-5 accuracy of the checkpoint of `epoch`"""
+    symbol, arg_params, aux_params = mx.model.load_checkpoint(model_prefix, epoch)
+    exe = symbol.simple_bind(ctx=ctx, grad_req='null', **dict(val.provide_data+val.provide_label))
+    exe.copy_params_from(arg_params, aux_params, allow_extra_params=True)
+    metric = mx.metric.CompositeEvalMetric()
+    for m in ['ce', 'acc', mx.metric.create('top_k_accuracy', top_k=5)]:
+        metric.add(mx.metric.create(m))
+    val.reset()
+    for batch in val:
+        exe.arg_dict['data'][:] = batch.data[0]
+        exe.forward(is_train=False)
+        num = batch.data[0].shape[0]-batch.pad
+        metric.update([batch.label[0][:num]], [exe.outputs[0][:num]])
+    return metric.get_name_value()
+
+def main():
+    parser = argparse.ArgumentParser(description='evaluate the checkpoints of a training run as they are written')
+    parser.add_argument('--model-prefix', type=str, required=True, help='the prefix of the checkpoints')
+    parser.add_argument('--config', type=str, required=True, help='json description of the validation iterator')
+    parser.add_argument('--log-file', type=str, help='log of the run to append the results to')
+    parser.add_argument('--gpus', type=str, help='the physical id of the gpu to use, cpu if not given')
+    parser.add_argument('--cores', type=str, help='cpu cores to run on, e.g., --cores=28,29,30,31')
+    parser.add_argument('--parent', type=int, help='exit after the last checkpoint once this process has finished')
+    parser.add_argument('--begin-epoch', type=int, default=0, help='skip the checkpoints up to this epoch')
+    parser.add_argument('--poll', type=float, default=10, help='seconds between two looks for new checkpoints')
+    args = parser.parse_args()
+    head = '%(asctime)-15s %(message)s'
+    logging.basicConfig(level=logging.INFO, format=head)
+    if args.log_file is not None:
+        handler = logging.FileHandler(args.log_file)
+        handler.setFormatter(logging.Formatter(head))
+        logging.getLogger().addHandler(handler)
+    if args.cores is not None:
+        dataset.pin([int(c) for c in args.cores.split(',')])
+
+    if args.gpus is not None: #before the first cuda call, the gpu is then device 0
+        os.environ['CUDA_VISIBLE_DEVICES'] = args.gpus.split(',')[0]
+    ctx = mx.cpu() if args.gpus is None else mx.gpu(0)
+    with open(args.config) as f:
+        val = dataset.create_iterator(json.load(f))
+    done = args.begin_epoch
+    while True:
+        finished = args.parent is not None and not alive(args.parent) #checked before the scan, nothing is missed
+        for epoch in checkpoints(args.model_prefix):
+            if epoch <= done:
+                continue
+            #engine.Checkpoint renames complete files in place
+            tic = time.time()
+            for name, value in evaluate(args.model_prefix, epoch, val, ctx):
+                logging.info('Epoch[%d] Validation-%s=%f', epoch-1, name, value) #the checkpoints number epochs from 1
+            logging.info('Epoch[%d] Validation time cost=%.3f', epoch-1, time.time()-tic)
+            done = epoch
+        else:
+            if finished:
+                return
+        time.sleep(args.poll)
+
+if __name__ == '__main__':
+    main()